@@ -21,9 +21,9 @@ import base64
 import json
 from typing import List
 import threading
-from pathlib import Path
 
 import tqdm
+from manifest import get_manifest
 from query import get_image_caption
 
 # ============================= IMPORTANT CONSTANTS =============================
@@ -31,103 +31,77 @@ from query import get_image_caption
 # Multithreading constants
 NUM_THREADS = 9
 
-# Data path
-DATASET_PATH = Path("./data")
-TRAINING_DATA_PATH = DATASET_PATH / "train"
-TESTING_DATA_PATH = DATASET_PATH / "test"
 
-
-def __caption_images_of_dir(dir_path: Path):
-    """This function captions all the images of a directory.
-    It reads each one and places them in an array. The whole array is captioned and
-    then saved in a JSON file.
+def __caption_images_of_dir(dataset_split: str, movie_id: str):
+    """This function captions the images of a directory that have no caption yet.
+    Every caption is recorded in the manifest as soon as it arrives, so a failure
+    only loses the image that failed. Once every image has a caption, they are
+    saved in the captions.json file of the directory, which is also how a
+    captions.json that was never written gets written from the manifest.
     """
 
-    caption_file_path = dir_path / "captions.json"
-    # If the caption file already exists, check if it is complete
-    if caption_file_path.exists():
-        with open(caption_file_path, "r") as caption_file:
-            captions = json.load(caption_file)
-        if len(captions.keys()) == len(list(dir_path.iterdir())):
+    manifest = get_manifest()
+    images = manifest.images(split=dataset_split, movie_id=movie_id)
+    captions = {image.name: image.caption for image in images if image.caption}
+    missing = [image for image in images if image.caption is None]
+    for image in tqdm.tqdm(missing, desc=f"Captioning {movie_id}"):
+        image_file_name = image.path.stem
+        image_data = base64.b64encode(image.path.read_bytes()).decode("utf-8")
+
+        # Get the captions of the images
+        try:
+            caption = get_image_caption(image_data, image_file_name)
+        except Exception as e:
+            print(f"Failed to caption image {image_file_name} of {movie_id}")
+            print(e)
             return
+        manifest.set_caption(image.path, caption)
+        captions[image.name] = caption
+
+    # Save the captions to a JSON file only if every image has a caption
+    if captions and len(captions) == len(images):
+        caption_file_path = images[0].path.parent / "captions.json"
+        with open(caption_file_path, "w") as caption_file:
+            json.dump(captions, caption_file, indent=4)
+        manifest.record_captions_file(dataset_split, movie_id, captions)
 
-    # Read all the images of the directory
-    captions = {}
-    for image_path in tqdm.tqdm(dir_path.iterdir(), desc=f"Captioning {dir_path.name}"):
-        if image_path.is_file() and image_path.suffix == ".jpg":
-            with open(image_path, "rb") as image_file:
-                image_file_name = image_path.name.split(".")[0]
-                image_file_ext = image_path.name.split(".")[1]
-                image_data = base64.b64encode(image_file.read()).decode("utf-8")
-
-            # Get the captions of the images
-            try:
-                captions[f"{image_file_name}.{image_file_ext}"] = get_image_caption(
-                    image_data, image_file_name
-                )
-            except Exception as e:
-                print(f"Failed to caption image {image_file_name} of {dir_path.name}")
-                print(e)
-                return
-
-    # Save the captions to a JSON file only if there are captions
-    if captions != {}:
-        with open(caption_file_path, "w") as caption_file_path:
-            json.dump(captions, caption_file_path, indent=4)
-
-
-def __caption_images_from_list(dir_list: List[Path]):
-    for dir_path in dir_list:
-        __caption_images_of_dir(dir_path)
+
+def __caption_images_from_list(dataset_split: str, movie_ids: List[str]):
+    for movie_id in movie_ids:
+        __caption_images_of_dir(dataset_split, movie_id)
     print("Done captioning images")
 
 
 def caption_images(dataset_split: str):
     """This function captions all the images in the dataset.
     For each directory, it will create a captions.json file that contains the captions for each image
-    of that directory.
+    of that directory. The manifest tells which directories still have images
+    without a caption.
     """
 
-    directories = []
-    datapath = TRAINING_DATA_PATH if dataset_split == "train" else TESTING_DATA_PATH
-    for dir_path in datapath.iterdir():
-        if dir_path.is_dir():
-            # Check if the captions file already exists
-            if not (dir_path / "captions.json").exists():
-                print(
-                    f"Adding directory {dir_path.name} because captions file does not exist"
-                )
-                directories.append(dir_path)
-            else:
-                with open(dir_path / "captions.json", "r") as captions_file:
-                    captions = json.load(captions_file)
-                # If the captions file is not complete, add this directory
-                if len(captions.keys()) != (len(list(dir_path.iterdir())) - 1):
-                    print(
-                        f"Adding directory {dir_path.name} because captions file is incomplete"
-                    )
-                    directories.append(dir_path)
+    movie_ids = get_manifest().uncaptioned_movies(dataset_split)
 
     # Multithreading
-    print(f"Total number of directories = {len(directories)}")
-    if len(directories) == 0:
+    print(f"Total number of directories = {len(movie_ids)}")
+    if len(movie_ids) == 0:
         print("All directories have been captioned")
         return
     if DEMO:
-        directories = directories[:20]
-    CHUNK_SIZE = int(math.ceil(len(directories) / NUM_THREADS))
-    chunked_dirs = [
-        directories[i : min(len(directories), i + CHUNK_SIZE)]
-        for i in range(0, len(directories), CHUNK_SIZE)
+        movie_ids = movie_ids[:20]
+    CHUNK_SIZE = int(math.ceil(len(movie_ids) / NUM_THREADS))
+    chunked_ids = [
+        movie_ids[i : min(len(movie_ids), i + CHUNK_SIZE)]
+        for i in range(0, len(movie_ids), CHUNK_SIZE)
     ]
 
-    for i in range(NUM_THREADS):
-        thread = threading.Thread(
-            target=__caption_images_from_list, args=(chunked_dirs[i],)
-        )
+    threads = [
+        threading.Thread(target=__caption_images_from_list, args=(dataset_split, chunk))
+        for chunk in chunked_ids
+    ]
+    for thread in threads:
         thread.start()
 
-    for i in range(NUM_THREADS):
+    for thread in threads:
         thread.join()
 
 
@@ -1,62 +1,76 @@
 """
 This file is for downloading the entire dataset. This will require that you have an OMDb API key.
-- 180,000 images 
-- 3000 movies 
-Approximately 15GB of data will be required for all these images. 
+- 180,000 images
+- 3000 movies
+Approximately 15GB of data will be required for all these images.
+
+The pages and images are crawled with asyncio over a pool of keep-alive
+connections. Movies are downloaded concurrently by a fixed number of workers and
+the images of each movie are fetched concurrently as well.
 """
 
+import asyncio
 import json
-import math
-import queue
-import threading
-import urllib.parse
-import urllib.request
+import os
+import random
 from collections import defaultdict
 from pathlib import Path
 from shutil import rmtree
+from typing import Callable, List
 
-import requests
+import aiohttp
 from bs4 import BeautifulSoup
+from manifest import get_manifest
 from query import get_movie_data_from_title
 
 # ============================= IMPORTANT CONSTANTS =============================
 
-# Constants for the producers consumers
-MAX_BUFFER_SIZE = 100
-NUM_PRODUCERS = 15
-NUM_CONSUMERS = 60
+# Constants for the crawler
+NUM_WORKERS = 60  # movies downloaded at the same time
+MAX_CONNECTIONS = 100  # pooled connections across all hosts
+MAX_CONNECTIONS_PER_HOST = 30
+MAX_IMAGES_PER_MOVIE = 8  # images of one movie downloaded at the same time
+MAX_RETRIES = 4
+RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled on every retry
+CHUNK_SIZE = 64 * 1024
+# Seconds to connect, and seconds without a byte from the server. There is no
+# total timeout, which would also count the wait for a pooled connection, so
+# that queued requests timed out without ever being sent.
+CONNECT_TIMEOUT = 15
+READ_TIMEOUT = 60
+
+# Responses worth retrying, everything else 4xx fails right away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 # Directory path
 SAVE_PATH = Path("./data")
-TRAINING_DATA_PATH = SAVE_PATH / "train"
-TESTING_DATA_PATH = SAVE_PATH / "test"
 FILM_GRAB_URL = "https://film-grab.com/movies-a-z/"
 
+# Every completed movie is appended to the journal as one JSON line. Compaction
+# folds it into results.json, directors.json, genres.json and ids.json.
+JOURNAL_NAME = "journal.jsonl"
 
-# ============================= DOWNLOADING IMAGES ===============================
+# FILM-GRAB's class names for the images of a movie's gallery
+IMAGE_CLASSES = [
+    "skip-lazy bwg-masonry-thumb bwg_masonry_thumb_0",
+    "skip-lazy bwg_standart_thumb_img_0 ",
+    "bwg_mosaic_thumb_0 skip-lazy bwg_img_clear bwg_img_custom",
+]
 
-# Queue to hold URLS
-url_queue = queue.Queue(MAX_BUFFER_SIZE)
 
-# Semaphores for the producers consumers
-queue_semaphore = threading.Semaphore(0)
-full_semaphore = threading.Semaphore(MAX_BUFFER_SIZE)
+# ============================= DOWNLOADING IMAGES ===============================
 
 # Movie results
 movie_results = {}
-movie_results_mutex = threading.Lock()
 
 # Map of IMDB ID to Movie name
 movie_id_names = {}
-movie_id_names_mutex = threading.Lock()
 
 # Director to movie ID map
 director_movie_id = defaultdict(list)
-director_movie_id_mutex = threading.Lock()
 
 # Genre to movie ID map
 genre_movie_id = defaultdict(list)
-genre_movie_id_mutex = threading.Lock()
 
 # Existing movie names
 # This is used to check if we have already downloaded the images ane
@@ -64,256 +78,361 @@ genre_movie_id_mutex = threading.Lock()
 existing_movie_names = set()
 
 
-def __download_images_from_url(url: str, movie_id: str) -> int:
+class RetryableError(Exception):
+    """Raised for responses that are worth retrying, like 429 and 503."""
+
+
+async def with_retries(fn: Callable, *args):
     """
-    Function to download images from a given URL and stores them in the specified path.
-    Returns the number of images that were extracted.
+    Awaits `fn(*args)`, retrying connection errors, timeouts and retryable
+    statuses with exponential backoff and jitter.
     """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await fn(*args)
+        except (
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+            asyncio.TimeoutError,
+            RetryableError,
+        ):
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2**attempt * (1 + random.random()))
 
-    image_count = 0
-
-    # Get the HTML of the page from the URL
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
 
-    # Find all image elements in the page
-    # 'bwg-masonry-thumb' because that is FILM-GRABs unique class name for
-    # all the images that occur in that specific
-    image_tags = soup.find_all(
-        "img", class_="skip-lazy bwg-masonry-thumb bwg_masonry_thumb_0"
-    )
-    alt_images_tags = soup.find_all("img", class_="skip-lazy bwg_standart_thumb_img_0 ")
-    image_tags.extend(alt_images_tags)
-    alt_images_tags = soup.find_all(
-        "img", class_="bwg_mosaic_thumb_0 skip-lazy bwg_img_clear bwg_img_custom"
-    )
-    image_tags.extend(alt_images_tags)
-    movie_train_data_dir = TRAINING_DATA_PATH / movie_id
-    movie_test_data_dir = TESTING_DATA_PATH / movie_id
+def check_response(response: aiohttp.ClientResponse):
+    if response.status in RETRY_STATUSES:
+        raise RetryableError(f"{response.status} for {response.url}")
+    response.raise_for_status()
 
-    # Create a directory to save images
-    # (NOTE): We can freely delete the directory if it already exists because
-    # if we are downloading the images here, it means that the exisiting folder
-    # is corrupted or incomplete.
-    if movie_train_data_dir.exists():
-        rmtree(movie_train_data_dir)
-    movie_train_data_dir.mkdir(parents=True)
-    if movie_test_data_dir.exists():
-        rmtree(movie_test_data_dir)
-    movie_test_data_dir.mkdir(parents=True)
 
-    # Download all the images and move 5 of them from
-    # training set to the testing set.
-    image_count = len(image_tags)
-    if image_count == 0:
-        raise Exception("No images found")
+async def fetch_text(session: aiohttp.ClientSession, url: str) -> str:
+    async def fetch():
+        async with session.get(url) as response:
+            check_response(response)
+            return await response.text()
 
-    train_img_count, test_img_count = 0, 0
-    test_img_ids = set([i for i in range(0, image_count, max(1, image_count // 5))])
-    for idx, img_tag in enumerate(image_tags):
-        img_url = img_tag.get("src")
-        if img_url:
-            if idx in test_img_ids:
-                img_filename = (
-                    TESTING_DATA_PATH / movie_id / f"{test_img_count + 1}.jpg"
-                )
-                test_img_count += 1
-            else:
-                img_filename = (
-                    TRAINING_DATA_PATH / movie_id / f"{train_img_count + 1}.jpg"
-                )
-                train_img_count += 1
-            with open(img_filename, "wb") as img_file:
-                response = requests.get(img_url)
-                if response.status_code == requests.codes.ok:
-                    image_data = response.content
-                img_file.write(image_data)
+    return await with_retries(fetch)
 
-    return image_count
 
+async def download_file(session: aiohttp.ClientSession, url: str, path: Path):
+    """
+    Streams the file at `url` to `path` in chunks. It is written to a .part file
+    first and renamed once complete, so a crash never leaves a truncated image,
+    and a failed download leaves no file at all.
+    """
+    part_path = path.with_name(path.name + ".part")
 
-def __produce(data: list):
-    for url_name_pair in data:
-        # Add the URL to the queue
-        full_semaphore.acquire()
+    async def download():
+        async with session.get(url) as response:
+            check_response(response)
+            with open(part_path, "wb") as part_file:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    part_file.write(chunk)
 
-        # If the movie is already present in the dataset,
-        # then we don't need to download it again.
-        if url_name_pair[1] in existing_movie_names:
-            print(f"Omitting {url_name_pair[1]} since it is already present")
-            full_semaphore.release()
-            continue
-        url_queue.put(url_name_pair)
-        print(f"Added {url_name_pair[1]} to the queue")
-        queue_semaphore.release()
+    try:
+        await with_retries(download)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    part_path.rename(path)
 
 
-def __consume(save_path: Path):
-    global total_movies
-    global total_images
+def parse_image_urls(html: str) -> List[str]:
+    """
+    Function to find the URLs of the images of a movie page.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    image_tags = []
+    for image_class in IMAGE_CLASSES:
+        image_tags.extend(soup.find_all("img", class_=image_class))
+    return [img_tag.get("src") for img_tag in image_tags if img_tag.get("src")]
 
-    while True:
-        queue_semaphore.acquire()
-        data = url_queue.get()
-        full_semaphore.release()
 
-        url, movie_name = data
+def parse_movie_urls(html: str) -> list:
+    """
+    Function to find the (URL, movie name) of every movie in the A-Z listing.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    urls = []
+    # Loop through each listing item
+    for item in soup.find_all("li", class_="listing-item"):
+        link = item.find("a", class_="title")
+        if link:
+            # Extract the URL and text of the link
+            urls.append((link.get("href"), link.get_text()))
+    return urls
 
-        # Get the movie information from OMDb
-        try:
-            movie_data = get_movie_data_from_title(movie_name)
-            movie_id = movie_data["imdbID"]
-            directors = movie_data["Director"]
-            genres = movie_data["Genre"]
-        except Exception as e:
-            print(f"Failed for movie {movie_name} since {e}")
-            continue
-
-        # Download images from the extracted URL
-        print(f"Downloading images from {url} for {movie_name}")
-        try:
-            num_images = __download_images_from_url(url, movie_id)
-        except Exception as e:
-            print(f"Failed for movie {movie_name} because {e}")
-            continue
 
-        # Only add to the results if we have successfully downloaded the images
-        # and gotten the metadata.
-        with movie_id_names_mutex:
-            movie_id_names[movie_id] = movie_name
+async def download_images_from_url(
+    session: aiohttp.ClientSession, url: str, movie_id: str, save_path: Path
+) -> int:
+    """
+    Function to download images from a given URL and stores them in the train
+    and test directories of `save_path`.
+    Returns the number of images that were extracted.
+    """
 
-        with director_movie_id_mutex:
-            for director in directors:
-                director_movie_id[director].append(movie_id)
+    image_urls = parse_image_urls(await fetch_text(session, url))
+    image_count = len(image_urls)
+    if image_count == 0:
+        raise Exception("No images found")
 
-        with genre_movie_id_mutex:
-            for genre in genres:
-                genre_movie_id[genre].append(movie_id)
+    movie_train_data_dir = save_path / "train" / movie_id
+    movie_test_data_dir = save_path / "test" / movie_id
 
-        with movie_results_mutex:
-            movie_results[movie_id] = movie_data
-            movie_results[movie_id]["NumImages"] = num_images
+    # Create a directory to save images
+    # (NOTE): We can freely delete the directory if it already exists because
+    # if we are downloading the images here, it means that the exisiting folder
+    # is corrupted or incomplete.
+    manifest = get_manifest(save_path)
+    manifest.remove_movie(movie_id)
+    for data_dir in [movie_train_data_dir, movie_test_data_dir]:
+        if data_dir.exists():
+            rmtree(data_dir)
+        data_dir.mkdir(parents=True)
 
-            # Checkpointing
-            # - every 500 movies we save the results, genres, directors, and ids
-            if len(movie_results) % 500 == 0:
-                with open(save_path / "results.json", "w+") as outfile:
-                    json.dump(movie_results, outfile, indent=4)
+    # Download all the images and move 5 of them from
+    # training set to the testing set.
+    test_img_ids = set(range(0, image_count, max(1, image_count // 5)))
+    img_filenames = []
+    train_img_count, test_img_count = 0, 0
+    for idx in range(image_count):
+        if idx in test_img_ids:
+            test_img_count += 1
+            img_filenames.append(movie_test_data_dir / f"{test_img_count}.jpg")
+        else:
+            train_img_count += 1
+            img_filenames.append(movie_train_data_dir / f"{train_img_count}.jpg")
+
+    semaphore = asyncio.Semaphore(MAX_IMAGES_PER_MOVIE)
+
+    async def download(img_url: str, img_filename: Path):
+        async with semaphore:
+            await download_file(session, img_url, img_filename)
+
+    # The first failure cancels the other downloads of the movie, so none of them
+    # keeps writing into its directories after the movie has failed
+    tasks = [
+        asyncio.create_task(download(*pair)) for pair in zip(image_urls, img_filenames)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    # Hashing the images reads them back, which is kept off the event loop
+    await asyncio.to_thread(manifest.add_images, img_filenames)
+    return image_count
 
-                with open(save_path / "directors.json", "w+") as outfile:
-                    json.dump(director_movie_id, outfile, indent=4)
 
-                with open(save_path / "genres.json", "w+") as outfile:
-                    json.dump(genre_movie_id, outfile, indent=4)
+def record_movie(movie_id: str, movie_name: str, movie_data: dict):
+    """
+    Adds a downloaded movie to the results, movie ids maps, directors, and genres.
+    Recording the same movie twice doesn't add it twice.
+    """
+    movie_id_names[movie_id] = movie_name
+    for director in movie_data["Director"]:
+        if movie_id not in director_movie_id[director]:
+            director_movie_id[director].append(movie_id)
+    for genre in movie_data["Genre"]:
+        if movie_id not in genre_movie_id[genre]:
+            genre_movie_id[genre].append(movie_id)
+    movie_results[movie_id] = movie_data
 
-                with open(save_path / "ids.json", "w+") as outfile:
-                    json.dump(movie_id_names, outfile, indent=4)
 
-                print(
-                    f"\n========Checkpointed at {len(movie_results)} movies========\n"
-                )
-        url_queue.task_done()
+def append_to_journal(save_path: Path, movie_id: str, movie_name: str, movie_data):
+    """
+    Appends a completed movie to the journal. The line is on disk before the
+    function returns, so a crash loses at most the movies still downloading.
+    """
+    entry = {"movie_id": movie_id, "movie_name": movie_name, "movie_data": movie_data}
+    with open(save_path / JOURNAL_NAME, "a") as journal:
+        journal.write(json.dumps(entry) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
 
 
-def collect_existing_movies():
+def replay_journal(save_path: Path) -> int:
     """
-    Function to collect all the existing movies that are present in the dataset.
-    This must be CALLED ONLY WHEN YOU KNOW THAT THE DATASET IS PRESENT.
+    Records every movie of the journal. A line cut short by a crash is skipped.
+    Returns the number of movies replayed.
     """
+    journal_path = save_path / JOURNAL_NAME
+    if not journal_path.exists():
+        return 0
+    count = 0
+    with open(journal_path, "r") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping a torn line of {journal_path}")
+                continue
+            record_movie(entry["movie_id"], entry["movie_name"], entry["movie_data"])
+            count += 1
+    return count
+
+
+def __write_json(path: Path, data):
+    # Write next to the file and swap it in, so a crash leaves the old snapshot
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w+") as outfile:
+        json.dump(data, outfile, indent=4)
+    os.replace(tmp_path, path)
+
+
+def compact_journal(save_path: Path):
+    """
+    Saves the movie results, movie ids maps, directors, and genres, which hold
+    the snapshot and the journal, and then empties the journal.
+    """
+    __write_json(save_path / "results.json", movie_results)
+    __write_json(save_path / "directors.json", director_movie_id)
+    __write_json(save_path / "genres.json", genre_movie_id)
+    __write_json(save_path / "ids.json", movie_id_names)
+
+    # Replaying the journal onto the new snapshot changes nothing, so a crash
+    # before this point is harmless
+    (save_path / JOURNAL_NAME).unlink(missing_ok=True)
+
+
+async def __download_movie(
+    session: aiohttp.ClientSession,
+    url: str,
+    movie_name: str,
+    save_path: Path,
+    get_movie_data: Callable[[str], dict],
+):
+    # Get the movie information from OMDb
+    try:
+        movie_data = await asyncio.to_thread(get_movie_data, movie_name)
+        movie_id = movie_data["imdbID"]
+    except Exception as e:
+        print(f"Failed for movie {movie_name} since {e}")
+        return
+
+    # Download images from the extracted URL
+    print(f"Downloading images from {url} for {movie_name}")
+    try:
+        num_images = await download_images_from_url(session, url, movie_id, save_path)
+    except Exception as e:
+        print(f"Failed for movie {movie_name} because {e}")
+        return
+
+    # Only add to the results if we have successfully downloaded the images
+    # and gotten the metadata. Everything runs on one event loop, so no locks.
+    movie_data["NumImages"] = num_images
+    append_to_journal(save_path, movie_id, movie_name, movie_data)
+    record_movie(movie_id, movie_name, movie_data)
+
+
+async def __consume(session, movie_queue: asyncio.Queue, save_path, get_movie_data):
+    while True:
+        url, movie_name = await movie_queue.get()
+        try:
+            await __download_movie(session, url, movie_name, save_path, get_movie_data)
+        finally:
+            movie_queue.task_done()
 
-    global existing_movie_names
-    global movie_results
-    global genre_movie_id
-    global director_movie_id
-    global movie_id_names
-
-    existing_movie_ids = set()
-    for movie_id in TRAINING_DATA_PATH.iterdir():
-        if movie_id.is_dir():
-            existing_movie_ids.add(movie_id.name)
 
-    # Read the ids.json file
-    with open(SAVE_PATH / "ids.json", "r") as infile:
-        movie_id_names = json.load(infile)
+def collect_existing_movies(save_path: Path = SAVE_PATH):
+    """
+    Function to collect all the existing movies that are present in the dataset
+    at `save_path`, from the last snapshot and the journal of the movies
+    downloaded since.
+    This must be CALLED ONLY WHEN YOU KNOW THAT THE DATASET IS PRESENT.
+    """
 
-    for movie_id in existing_movie_ids:
+    # Populate the results, genres, directors, and ids from the snapshot
+    snapshot = {
+        "results.json": movie_results,
+        "genres.json": genre_movie_id,
+        "directors.json": director_movie_id,
+        "ids.json": movie_id_names,
+    }
+    for file_name, data in snapshot.items():
+        if (save_path / file_name).exists():
+            with open(save_path / file_name, "r") as infile:
+                data.update(json.load(infile))
+    replayed = replay_journal(save_path)
+    if (save_path / JOURNAL_NAME).exists():
+        print(f"Replayed {replayed} movies from the journal")
+        # Start the run with an empty journal, so that nothing is appended to a
+        # line that a crash cut short
+        compact_journal(save_path)
+
+    # Movies are added to the manifest once all of their images are downloaded
+    for movie_id in get_manifest(save_path).movie_ids("train"):
         if movie_id in movie_id_names:
             existing_movie_names.add(movie_id_names[movie_id])
 
-    # Populate the results, genres, directors
-    with open(SAVE_PATH / "results.json", "r") as infile:
-        movie_results.update(json.load(infile))
-    with open(SAVE_PATH / "genres.json", "r") as infile:
-        genre_movie_id.update(json.load(infile))
-    with open(SAVE_PATH / "directors.json", "r") as infile:
-        director_movie_id.update(json.load(infile))
-    with open(SAVE_PATH / "ids.json", "r") as infile:
-        movie_id_names.update(json.load(infile))
-
 
-def download_images() -> dict:
+async def crawl(
+    index_url: str = FILM_GRAB_URL,
+    get_movie_data: Callable[[str], dict] = get_movie_data_from_title,
+    save_path: Path = SAVE_PATH,
+):
+    """
+    Crawls the A-Z listing at `index_url` and downloads the images of every movie
+    that is not in the dataset at `save_path` yet. `get_movie_data` maps a movie
+    name to its OMDb metadata; both can point at a local server for testing.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT
+    )
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        urls = parse_movie_urls(await fetch_text(session, index_url))
+        if DEMO:
+            urls = urls[:8]
+        print(f"Total number of movies = {len(urls)}")
+
+        movie_queue = asyncio.Queue()
+        for url, movie_name in urls:
+            # If the movie is already present in the dataset,
+            # then we don't need to download it again.
+            if movie_name in existing_movie_names:
+                print(f"Omitting {movie_name} since it is already present")
+                continue
+            movie_queue.put_nowait((url, movie_name))
+
+        workers = [
+            asyncio.create_task(
+                __consume(session, movie_queue, save_path, get_movie_data)
+            )
+            for _ in range(NUM_WORKERS)
+        ]
+        await movie_queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def download_images(save_path: Path = SAVE_PATH, **kwargs):
     """
     Function to extract HTMLS links from a list and and download the images from
-    the respective webpages. (Modifies global variables)
+    the respective webpages into the dataset at `save_path`, resuming from what
+    is already there. (Modifies global variables)
 
-    Returns a dictionary containing information about the movies downloaded and the
-    path to where they are downloaded.
+    Other keyword arguments are passed on to `crawl`.
     """
 
-    # Get the HTML content from the URL
-    fp = urllib.request.urlopen(FILM_GRAB_URL)
-    html_bytes = fp.read()
-    html_content = html_bytes.decode("utf8")
-    fp.close()
-    soup = BeautifulSoup(html_content, "html.parser")
-
-    if SAVE_PATH.exists():
-        collect_existing_movies()
+    save_path = Path(save_path)
+    if save_path.exists():
+        collect_existing_movies(save_path)
     else:
-        SAVE_PATH.mkdir(exist_ok=True)
-        TRAINING_DATA_PATH.mkdir(exist_ok=True)
-        TESTING_DATA_PATH.mkdir(exist_ok=True)
-
-    # Find all list items with class 'listing-item'
-    listing_items = soup.find_all("li", class_="listing-item")
-    urls = []
-    # Loop through each listing item
-    for item in listing_items:
-        link = item.find("a", class_="title")
-        if link:
-            # Extract the URL and text of the link
-            url = link.get("href")
-            name = link.get_text()
-            urls.append((url, name))
-    if DEMO:
-        urls = urls[:8]
-    print(f"Total number of movies = {len(urls)}")
-    CHUNK_SIZE = int(math.ceil(len(urls) / NUM_PRODUCERS))
-    chunked_urls = [
-        urls[i : min(len(urls), i + CHUNK_SIZE)]
-        for i in range(0, len(urls), CHUNK_SIZE)
-    ]
-
-    # Create producer threads
-    producer_threads = []
-    for i in range(NUM_PRODUCERS):
-        producer = threading.Thread(target=__produce, args=(chunked_urls[i],))
-        producer_threads.append(producer)
-        producer.start()
+        save_path.mkdir(parents=True)
+    (save_path / "train").mkdir(exist_ok=True)
+    (save_path / "test").mkdir(exist_ok=True)
 
-    # Create consumer threads
-    consumer_threads = []
-    for i in range(NUM_CONSUMERS):
-        consumer = threading.Thread(target=__consume, args=(SAVE_PATH,))
-        consumer_threads.append(consumer)
-        consumer.start()
-
-    # Wait for all producer threads to complete
-    for producer in producer_threads:
-        producer.join()
-
-    # Wait for all tasks in the queue to be processed
-    url_queue.join()
+    asyncio.run(crawl(save_path=save_path, **kwargs))
 
 
 #  =========================== SAVING ALL THE NECESSARY INFORMATION ===========================
@@ -321,23 +440,13 @@ def download_images() -> dict:
 DEMO = False
 
 if __name__ == "__main__":
+    save_path = SAVE_PATH
     print("Starting to download all images")
-    download_images()
+    download_images(save_path)
     print("Completed downloading all images")
 
-    # Save the movie results, movie ids maps, directors, and genres.
-    with open(SAVE_PATH / "results.json", "w+") as outfile:
-        json.dump(movie_results, outfile, indent=4)
-        total_movies = len(movie_results)
-        total_images = sum([movie["NumImages"] for movie in movie_results.values()])
-
-    with open(SAVE_PATH / "directors.json", "w+") as outfile:
-        json.dump(director_movie_id, outfile, indent=4)
-
-    with open(SAVE_PATH / "genres.json", "w+") as outfile:
-        json.dump(genre_movie_id, outfile, indent=4)
-
-    with open(SAVE_PATH / "ids.json", "w+") as outfile:
-        json.dump(movie_id_names, outfile, indent=4)
+    compact_journal(save_path)
+    total_movies = len(movie_results)
+    total_images = sum([movie["NumImages"] for movie in movie_results.values()])
 
-    print(f"Completed saving information to {SAVE_PATH}")
+    print(f"Completed saving information to {save_path}")
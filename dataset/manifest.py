@@ -0,0 +1,365 @@
+"""
+This file keeps the manifest of the dataset: a SQLite table listing every image
+with its split, size, dimensions, content hash and caption. Downloading,
+captioning, the search ingest and training all read it instead of walking the
+data/ directory and opening every captions.json.
+
+The manifest is updated as images are downloaded and captioned. Images that are
+added, changed or removed by hand (or a dataset unzipped from S3) are picked up
+by a refresh, which only re-reads the files whose size or modification time
+changed and the captions.json files that were rewritten:
+
+$ python3 manifest.py
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# ============================= IMPORTANT CONSTANTS =============================
+
+# Data path
+DATASET_PATH = Path("./data")
+SPLITS = ["train", "test"]
+
+# The manifest lives next to the splits it describes
+MANIFEST_NAME = "manifest.sqlite"
+CAPTIONS_NAME = "captions.json"
+
+# JPEG markers that start a frame header, which holds the dimensions
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE}
+
+
+class ManifestImage(NamedTuple):
+    """An image of the dataset as recorded in the manifest."""
+
+    path: Path
+    split: str
+    movie_id: str
+    name: str
+    size: int
+    width: Optional[int]
+    height: Optional[int]
+    content_hash: str
+    caption: Optional[str]  # None until the image is captioned
+
+
+def __jpeg_size(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Reads the width and height from the frame header of a JPEG without decoding
+    it. Returns (None, None) for anything that isn't a JPEG.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None, None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None, None
+        marker = data[i + 1]
+        # Padding, and markers without a length
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 5 : i + 7], "big")
+            width = int.from_bytes(data[i + 7 : i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None, None
+
+
+def describe_image(path: Path) -> Tuple[int, int, Optional[int], Optional[int], str]:
+    """
+    Returns the size, modification time, width, height and SHA-256 of an image.
+    """
+    stat = path.stat()
+    data = path.read_bytes()
+    width, height = __jpeg_size(data)
+    digest = hashlib.sha256(data).hexdigest()
+    return stat.st_size, stat.st_mtime_ns, width, height, digest
+
+
+class DatasetManifest:
+    """
+    SQLite index of the images under `root`, one row per image keyed by its
+    path relative to `root` (e.g. train/tt0111161/1.jpg). It is safe to use
+    from several threads.
+    """
+
+    def __init__(self, root: Path = DATASET_PATH, path: Optional[Path] = None):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path or self.root / MANIFEST_NAME, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                split TEXT NOT NULL,
+                movie_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                content_hash TEXT NOT NULL,
+                caption TEXT
+            );
+            CREATE INDEX IF NOT EXISTS images_of_movie ON images (split, movie_id);
+            CREATE TABLE IF NOT EXISTS caption_files (
+                split TEXT NOT NULL,
+                movie_id TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (split, movie_id)
+            );
+            """
+        )
+
+    def __key(self, path: Path) -> Tuple[str, str, str, str]:
+        split, movie_id, name = Path(path).relative_to(self.root).parts
+        return f"{split}/{movie_id}/{name}", split, movie_id, name
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM images LIMIT 1").fetchone() is None
+
+    def add_images(self, paths: Iterable[Path]):
+        """
+        Records new or changed images. The caption of an image is kept as long
+        as its content hash stays the same.
+        """
+        rows = [(*self.__key(path), *describe_image(Path(path))) for path in paths]
+        with self._lock, self._db:
+            self._db.executemany(
+                """
+                INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    width = excluded.width,
+                    height = excluded.height,
+                    content_hash = excluded.content_hash,
+                    caption = CASE WHEN content_hash = excluded.content_hash
+                        THEN caption ELSE NULL END
+                """,
+                rows,
+            )
+
+    def remove_movie(self, movie_id: str):
+        """
+        Forgets every image of a movie in all splits, e.g. before it is
+        downloaded again.
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM images WHERE movie_id = ?", (movie_id,))
+            self._db.execute(
+                "DELETE FROM caption_files WHERE movie_id = ?", (movie_id,)
+            )
+
+    def set_caption(self, path: Path, caption: str):
+        key = self.__key(path)[0]
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE images SET caption = ? WHERE path = ?", (caption, key)
+            )
+
+    def record_captions_file(self, split: str, movie_id: str, captions: dict):
+        """
+        Sets the captions of a movie from the contents of its captions.json and
+        remembers the file's modification time, so a refresh doesn't read it
+        again.
+        """
+        captions_path = self.root / split / movie_id / CAPTIONS_NAME
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE images SET caption = ? WHERE path = ?",
+                [
+                    (caption, f"{split}/{movie_id}/{name}")
+                    for name, caption in captions.items()
+                ],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO caption_files VALUES (?, ?, ?)",
+                (split, movie_id, captions_path.stat().st_mtime_ns),
+            )
+
+    def refresh(self, splits: List[str] = SPLITS) -> Dict[str, int]:
+        """
+        Brings the manifest in line with the files of the splits. Only the
+        images whose size or modification time changed are read and hashed,
+        and only the captions.json files that changed are loaded.
+        Returns the number of images added, updated and removed and the number
+        of captions.json files loaded.
+        """
+        with self._lock:
+            known = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._db.execute(
+                    "SELECT path, size, mtime_ns FROM images"
+                )
+            }
+            caption_mtimes = {
+                (split, movie_id): mtime_ns
+                for split, movie_id, mtime_ns in self._db.execute(
+                    "SELECT split, movie_id, mtime_ns FROM caption_files"
+                )
+            }
+
+        summary = {"added": 0, "updated": 0, "removed": 0, "captions_files": 0}
+        seen, changed, captions_files = set(), [], []
+        for split in splits:
+            split_path = self.root / split
+            if not split_path.is_dir():
+                continue
+            for movie_entry in os.scandir(split_path):
+                if not movie_entry.is_dir():
+                    continue
+                for entry in os.scandir(movie_entry.path):
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if entry.name == CAPTIONS_NAME:
+                        movie_key = (split, movie_entry.name)
+                        if caption_mtimes.get(movie_key) != stat.st_mtime_ns:
+                            captions_files.append(movie_key)
+                    elif entry.name.endswith(".jpg"):
+                        key = f"{split}/{movie_entry.name}/{entry.name}"
+                        seen.add(key)
+                        if known.get(key) != (stat.st_size, stat.st_mtime_ns):
+                            summary["updated" if key in known else "added"] += 1
+                            changed.append(Path(entry.path))
+
+        self.add_images(changed)
+        removed = [
+            (key,) for key in known if key.split("/")[0] in splits and key not in seen
+        ]
+        summary["removed"] = len(removed)
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM images WHERE path = ?", removed)
+
+        # Captions are loaded after the images, so that they have rows to go to
+        for split, movie_id in captions_files:
+            with open(self.root / split / movie_id / CAPTIONS_NAME, "r") as infile:
+                self.record_captions_file(split, movie_id, json.load(infile))
+        summary["captions_files"] = len(captions_files)
+        return summary
+
+    def movie_ids(self, split: Optional[str] = None) -> set:
+        """
+        Returns the ids of the movies that have at least one image in the split,
+        or in any split.
+        """
+        query, args = "SELECT DISTINCT movie_id FROM images", ()
+        if split is not None:
+            query, args = query + " WHERE split = ?", (split,)
+        with self._lock:
+            return {row[0] for row in self._db.execute(query, args)}
+
+    def uncaptioned_movies(self, split: str) -> List[str]:
+        """
+        Returns the ids of the movies of the split with images that have no
+        caption yet, or whose captions.json was never written, e.g. because the
+        captioning stopped right after the last caption.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT DISTINCT movie_id FROM images
+                WHERE split = ? AND (
+                    caption IS NULL
+                    OR (split, movie_id) NOT IN (
+                        SELECT split, movie_id FROM caption_files
+                    )
+                ) ORDER BY movie_id""",
+                (split,),
+            )
+            return [row[0] for row in rows]
+
+    def images(
+        self,
+        split: Optional[str] = None,
+        movie_id: Optional[str] = None,
+        captioned: Optional[bool] = None,
+    ) -> List[ManifestImage]:
+        """
+        Returns the images, optionally only those of a split, of a movie, and
+        with or without a caption, ordered by path.
+        """
+        conditions, args = [], []
+        if split is not None:
+            conditions.append("split = ?")
+            args.append(split)
+        if movie_id is not None:
+            conditions.append("movie_id = ?")
+            args.append(movie_id)
+        if captioned is not None:
+            conditions.append(f"caption IS {'NOT ' if captioned else ''}NULL")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"""SELECT path, split, movie_id, name, size, width, height,
+                content_hash, caption FROM images{where} ORDER BY path""",
+                args,
+            ).fetchall()
+        return [ManifestImage(self.root / row[0], *row[1:]) for row in rows]
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Returns the number of movies, images, captioned images and bytes of
+        every split.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT split, COUNT(DISTINCT movie_id), COUNT(*), COUNT(caption),
+                SUM(size) FROM images GROUP BY split"""
+            ).fetchall()
+        return {
+            split: {
+                "movies": movies,
+                "images": images,
+                "captioned": captioned,
+                "bytes": size,
+            }
+            for split, movies, images, captioned, size in rows
+        }
+
+
+# Created on first use, so importing this module doesn't create the manifest
+manifests = {}
+manifest_mutex = threading.Lock()
+
+
+def get_manifest(root: Path = DATASET_PATH) -> DatasetManifest:
+    """
+    Returns the manifest of the dataset at `root`, DATASET_PATH by default. An
+    empty manifest is filled from the files that are already there.
+    """
+    root = Path(root)
+    with manifest_mutex:
+        if root not in manifests:
+            manifests[root] = DatasetManifest(root)
+            if manifests[root].is_empty():
+                print(f"Building the manifest of {root}")
+                manifests[root].refresh()
+        return manifests[root]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        print("Usage: python manifest.py")
+        sys.exit(1)
+
+    dataset_manifest = DatasetManifest(DATASET_PATH)
+    summary = dataset_manifest.refresh()
+    print(f"Refreshed the manifest of {DATASET_PATH}: {summary}")
+    print(json.dumps(dataset_manifest.stats(), indent=4))
@@ -1,4 +1,11 @@
 import os
+import json
+import time
+import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import Future
+from typing import Optional
 import requests
 from pathlib import Path
 from dotenv import load_dotenv
@@ -7,6 +14,149 @@ load_dotenv()
 OMDB_API_KEY = os.getenv("OMDB_API_KEY")
 BASE_URL = f"http://www.omdbapi.com/?apikey={OMDB_API_KEY}&"
 
+# ============================= OMDb CACHE =============================
+
+# SQLite file that the OMDb responses are cached in
+OMDB_CACHE_PATH = Path(os.getenv("OMDB_CACHE_PATH", "./omdb_cache.sqlite"))
+# Seconds that a movie, or the fact that a movie was not found, stays cached
+OMDB_CACHE_TTL = float(os.getenv("OMDB_CACHE_TTL", 90 * 24 * 3600))
+OMDB_NOT_FOUND_TTL = float(os.getenv("OMDB_NOT_FOUND_TTL", 7 * 24 * 3600))
+# Most requests sent to OMDb per second, across all threads
+OMDB_REQUESTS_PER_SECOND = float(os.getenv("OMDB_REQUESTS_PER_SECOND", 10))
+# Only answer from the cache and never call OMDb
+OMDB_OFFLINE = os.getenv("OMDB_OFFLINE", "false").lower() == "true"
+
+
+class NotInCache(Exception):
+    """Raised in offline mode for lookups that are not cached."""
+
+
+class OMDbCache:
+    """
+    OMDb responses stored in SQLite by lookup, with the time they were fetched.
+    Responses for movies that were not found are kept too, for a shorter time.
+    """
+
+    def __init__(self, path: Path = OMDB_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self._db.commit()
+
+    def get(self, key: str, offline: bool = False) -> Optional[dict]:
+        """
+        Returns the cached response, or None when it is missing or has expired.
+        Expired responses are still returned offline.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, found, fetched_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        response, found, fetched_at = row
+        ttl = OMDB_CACHE_TTL if found else OMDB_NOT_FOUND_TTL
+        if not offline and time.time() - fetched_at > ttl:
+            return None
+        return json.loads(response)
+
+    def put(self, key: str, response: dict, found: bool):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), int(found), time.time()),
+            )
+            self._db.commit()
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most `rate` of them start per second, across all
+    the threads that share it.
+    """
+
+    def __init__(self, rate: float = OMDB_REQUESTS_PER_SECOND):
+        self.interval = 1 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+# Created on first use, so importing this module doesn't create the cache file
+cache = None
+cache_mutex = threading.Lock()
+rate_limiter = RateLimiter()
+session = requests.Session()
+
+# Lookups in flight, so that concurrent lookups of one movie make a single call
+in_flight = {}
+in_flight_mutex = threading.Lock()
+
+
+def get_cache() -> OMDbCache:
+    global cache
+    with cache_mutex:
+        if cache is None:
+            cache = OMDbCache()
+    return cache
+
+
+def __fetch(key: str, url: str) -> dict:
+    """
+    Function to get the raw OMDb response for a lookup, from the cache when it is
+    there and otherwise from OMDb.
+    """
+    response = get_cache().get(key, offline=OMDB_OFFLINE)
+    if response is not None:
+        return response
+    if OMDB_OFFLINE:
+        raise NotInCache(f"{key} is not cached")
+
+    with in_flight_mutex:
+        future = in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = in_flight[key] = Future()
+    if not leader:
+        # Every caller gets its own copy, since the response is processed in place
+        return json.loads(future.result())
+
+    try:
+        rate_limiter.wait()
+        r = session.get(url)
+        if r.status_code != requests.codes.ok:
+            print(f"Failed to get data for {key}")
+        response = r.json()
+        # OMDb answers 200 with an error for movies it doesn't know. Those are
+        # cached as well, other errors (rate limit, bad key) are not.
+        if response.get("Response") == "True":
+            get_cache().put(key, response, found=True)
+        elif "not found" in response.get("Error", "").lower():
+            get_cache().put(key, response, found=False)
+        future.set_result(json.dumps(response))
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with in_flight_mutex:
+            del in_flight[key]
+
 
 def __process_response(response: dict) -> dict:
     """
@@ -21,30 +171,22 @@ def __process_response(response: dict) -> dict:
 
 
 def get_movie_data_from_title(title: str):
-    url = f"{BASE_URL}t={title}"
+    url = f"{BASE_URL}t={urllib.parse.quote(title)}"
 
-    r = requests.get(url)
-    if r.status_code != requests.codes.ok:
-        print(f"Failed to get data for {title}")
-    return __process_response(r.json())
+    # OMDb matches titles regardless of case and surrounding spaces
+    return __process_response(__fetch(f"t:{title.strip().lower()}", url))
 
 
 def get_movie_data_from_id(id: str):
     url = f"{BASE_URL}i={id}"
 
-    r = requests.get(url)
-    if r.status_code != requests.codes.ok:
-        print(f"Failed to get data for {id}")
-    return __process_response(r.json())
+    return __process_response(__fetch(f"i:{id}", url))
 
 
 def get_movie_poster_from_id(id: str):
     url = f"{BASE_URL}i={id}"
 
-    r = requests.get(url)
-    if r.status_code != requests.codes.ok:
-        print(f"Failed to get data for {id}")
-    return __process_response(r.json())
+    return __process_response(__fetch(f"i:{id}", url))
 
 
 CAPTIONING_IMAGE_URL = os.getenv("CAPTIONING_IMAGE_URL")
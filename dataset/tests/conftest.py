@@ -0,0 +1,12 @@
+"""
+The dataset scripts import each other as top-level modules, so the tests run
+with this directory on the path.
+
+Usage (from dataset/):
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
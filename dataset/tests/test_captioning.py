@@ -0,0 +1,45 @@
+import json
+
+import captioning
+import pytest
+from manifest import DatasetManifest
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    movie_path = tmp_path / "train" / "tt1"
+    movie_path.mkdir(parents=True)
+    for i in range(3):
+        (movie_path / f"{i}.jpg").write_bytes(bytes([i]) * 100)
+    manifest = DatasetManifest(tmp_path)
+    manifest.refresh()
+    monkeypatch.setattr(captioning, "get_manifest", lambda: manifest)
+    return manifest
+
+
+def test_captions_file_is_written_after_a_crash(manifest, tmp_path, monkeypatch):
+    # Every caption made it into the manifest, but captions.json didn't
+    for image in manifest.images(movie_id="tt1"):
+        manifest.set_caption(image.path, f"caption of {image.name}")
+    assert manifest.uncaptioned_movies("train") == ["tt1"]
+
+    def get_image_caption(image_data, image_file_name):
+        raise AssertionError("No image needs captioning")
+
+    monkeypatch.setattr(captioning, "get_image_caption", get_image_caption)
+    captioning.caption_images("train")
+
+    with open(tmp_path / "train" / "tt1" / "captions.json") as f:
+        assert json.load(f) == {f"{i}.jpg": f"caption of {i}.jpg" for i in range(3)}
+    assert manifest.uncaptioned_movies("train") == []
+
+
+def test_missing_captions_are_requested(manifest, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        captioning, "get_image_caption", lambda data, name: f"caption {name}"
+    )
+    captioning.caption_images("train")
+
+    with open(tmp_path / "train" / "tt1" / "captions.json") as f:
+        assert json.load(f) == {f"{i}.jpg": f"caption {i}" for i in range(3)}
+    assert manifest.uncaptioned_movies("train") == []
@@ -0,0 +1,173 @@
+"""
+Crawls a local stand-in for FILM-GRAB served by aiohttp, so nothing is fetched
+from the internet or written outside the test's directory.
+"""
+
+import asyncio
+import json
+from collections import Counter
+
+import download
+import pytest
+from aiohttp import web
+
+# Number of images in the gallery of every movie, a fifth of which go to test
+MOVIES = {"Movie a": 12, "Movie b": 12, "Movie c": 12, "Movie broken": 12}
+
+
+def movie_data(movie_name: str) -> dict:
+    return {
+        "imdbID": "tt" + movie_name.split()[-1],
+        "Title": movie_name,
+        "Director": ["Director"],
+        "Genre": ["Drama"],
+    }
+
+
+class FilmGrab:
+    """
+    The A-Z listing, the movie pages and the images. The first request for every
+    3.jpg gets a 503, and while `broken` is set the images of "Movie broken"
+    are cut off halfway through.
+    """
+
+    def __init__(self):
+        self.hits = Counter()
+        self.broken = True
+        self.base_url = None
+
+    async def index(self, request):
+        items = "".join(
+            f'<li class="listing-item"><a class="title" '
+            f'href="{self.base_url}/movie/{name}">{name}</a></li>'
+            for name in MOVIES
+        )
+        return web.Response(text=f"<ul>{items}</ul>", content_type="text/html")
+
+    async def movie(self, request):
+        name = request.match_info["name"]
+        self.hits[request.path] += 1
+        images = "".join(
+            f'<img class="{download.IMAGE_CLASSES[0]}" '
+            f'src="{self.base_url}/images/{name}/{i}.jpg">'
+            for i in range(MOVIES[name])
+        )
+        return web.Response(text=images, content_type="text/html")
+
+    async def image(self, request):
+        self.hits[request.path] += 1
+        body = request.path.encode() * 1000
+        if request.match_info["file"] == "3.jpg" and self.hits[request.path] == 1:
+            return web.Response(status=503)
+        response = web.StreamResponse()
+        response.content_length = len(body)
+        await response.prepare(request)
+        if self.broken and request.match_info["name"] == "Movie broken":
+            await response.write(body[: len(body) // 2])
+            request.transport.close()
+            return response
+        await response.write(body)
+        return response
+
+    async def crawl(self, save_path):
+        """Serves the site on a free port for the duration of a crawl."""
+        app = web.Application()
+        app.router.add_get("/", self.index)
+        app.router.add_get("/movie/{name}", self.movie)
+        app.router.add_get("/images/{name}/{file}", self.image)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        try:
+            await download.crawl(f"{self.base_url}/", movie_data, save_path)
+        finally:
+            await runner.cleanup()
+
+
+@pytest.fixture
+def film_grab(tmp_path, monkeypatch):
+    # Nothing may be written to ./data
+    (tmp_path / "cwd").mkdir()
+    monkeypatch.chdir(tmp_path / "cwd")
+    monkeypatch.setattr(download, "RETRY_BACKOFF", 0.001)
+    for state in [
+        download.movie_results,
+        download.movie_id_names,
+        download.director_movie_id,
+        download.genre_movie_id,
+        download.existing_movie_names,
+    ]:
+        state.clear()
+    return FilmGrab()
+
+
+def test_crawl_retries_and_leaves_no_partial_files(film_grab, tmp_path):
+    save_path = tmp_path / "data"
+    save_path.mkdir()
+    asyncio.run(film_grab.crawl(save_path))
+
+    assert sorted(download.movie_results) == ["tta", "ttb", "ttc"]
+    for movie_id in ["tta", "ttb", "ttc"]:
+        assert download.movie_results[movie_id]["NumImages"] == 12
+        assert len(list(save_path.glob(f"train/{movie_id}/*.jpg"))) == 6
+        assert len(list(save_path.glob(f"test/{movie_id}/*.jpg"))) == 6
+    # Every 503 was retried once
+    assert film_grab.hits["/images/Movie a/3.jpg"] == 2
+    # The truncated images were retried, then the movie was given up without
+    # leaving a trace
+    broken = [film_grab.hits[f"/images/Movie broken/{i}.jpg"] for i in range(12)]
+    assert max(broken) == download.MAX_RETRIES + 1
+    assert list(save_path.rglob("*.part")) == []
+    assert list((tmp_path / "cwd").iterdir()) == []
+
+    journal = (save_path / download.JOURNAL_NAME).read_text().splitlines()
+    assert sorted(json.loads(line)["movie_id"] for line in journal) == [
+        "tta",
+        "ttb",
+        "ttc",
+    ]
+
+
+def test_crawl_resumes_from_the_journal(film_grab, tmp_path):
+    save_path = tmp_path / "data"
+    save_path.mkdir()
+    asyncio.run(film_grab.crawl(save_path))
+    # A .part file left behind by a crash in the middle of a download
+    (save_path / "train" / "ttbroken").mkdir(parents=True, exist_ok=True)
+    (save_path / "train" / "ttbroken" / "1.jpg.part").write_bytes(b"partial")
+
+    # A new run only knows what is on disk
+    for state in [download.movie_results, download.movie_id_names]:
+        state.clear()
+    download.collect_existing_movies(save_path)
+    assert download.existing_movie_names == {"Movie a", "Movie b", "Movie c"}
+
+    film_grab.broken = False
+    film_grab.hits.clear()
+    asyncio.run(film_grab.crawl(save_path))
+
+    # Only the movie that failed is downloaded again
+    assert {path.split("/")[2] for path in film_grab.hits} == {"Movie broken"}
+    assert sorted(download.movie_results) == ["tta", "ttb", "ttbroken", "ttc"]
+    assert len(list(save_path.glob("*/ttbroken/*.jpg"))) == 12
+    assert list(save_path.rglob("*.part")) == []
+
+
+def test_download_images_only_touches_the_given_save_path(
+    film_grab, tmp_path, monkeypatch
+):
+    crawled = []
+
+    async def crawl(**kwargs):
+        crawled.append(kwargs)
+
+    monkeypatch.setattr(download, "crawl", crawl)
+    save_path = tmp_path / "data"
+    download.download_images(save_path, index_url="http://film-grab/")
+
+    assert crawled == [{"save_path": save_path, "index_url": "http://film-grab/"}]
+    assert sorted(path.name for path in save_path.iterdir()) == ["test", "train"]
+    assert list((tmp_path / "cwd").iterdir()) == []
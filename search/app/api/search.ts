@@ -7,7 +7,7 @@ export const imageurl = `${baseurl}/images`
 
 interface BackendSearchResult {
     id: string;
-    version: number;
+    version?: number;
     score: number;
     payload: {
       actor: string[];
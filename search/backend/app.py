@@ -1,19 +1,77 @@
-import io
-from typing import Optional
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import List, Optional
 
-from fastapi import FastAPI, File, UploadFile
+import httpx
+import orjson
+from config import (
+    IMAGE_DATA_PATH,
+    MAX_UPLOAD_BYTES,
+    PAYLOAD_MODE,
+    QDRANT_GRPC_PORT,
+    QDRANT_HOST,
+    QDRANT_MAX_CONNECTIONS,
+    QDRANT_MAX_KEEPALIVE_CONNECTIONS,
+    QDRANT_PORT,
+    QDRANT_PREFER_GRPC,
+    QDRANT_TIMEOUT,
+    QUERY_CACHE_WARMUP_FILE,
+    SEARCH_BACKEND,
+    SEARCH_K,
+    THUMBNAIL_PATH,
+)
+from embedding_store import EmbeddingStore
+from fastapi import FastAPI, File, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
-from fastapi.staticfiles import StaticFiles
-from image_ingestion import *
-from image_search import *
-from PIL import Image
-from pydantic import BaseModel
-from qdrant_client import QdrantClient, models
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from image_ingestion import create_collections, create_payload_indexes
+from image_search import (
+    search_hybrid_in_db,
+    search_images_bulk_in_db,
+    search_images_in_db,
+    search_text_in_db,
+    search_texts_in_db,
+    text_embedding_cache,
+)
+from ingestion_manifest import IngestionManifest, ingest_incremental
+from metrics import (
+    ERRORS,
+    REGISTRY,
+    REQUEST_SECONDS,
+    REQUESTS,
+    STAGE_SECONDS,
+    maybe_profile,
+)
+from movie_table import MovieTable
+from preprocessing import ImageTooLarge, open_upload
+from pydantic import BaseModel, Field
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+from starlette.concurrency import run_in_threadpool
+from thumbnails import CachedStaticFiles, ThumbnailFiles, generate_thumbnails
+from utils import get_text_embeddings, image_batcher, text_batcher, warm_up
+from vector_index import NumpyIndex
+
+# Time to readiness is measured from here, once the imports are done
+started = time.perf_counter()
 
 app = FastAPI()
 # Mount a static directory to serve images from
-app.mount("/images", StaticFiles(directory="../image_data"), name="images")
+app.mount("/images", CachedStaticFiles(directory=IMAGE_DATA_PATH), name="images")
+# Thumbnails of the frames, which the search results point at
+Path(THUMBNAIL_PATH).mkdir(parents=True, exist_ok=True)
+app.mount(
+    "/thumbnails",
+    ThumbnailFiles(IMAGE_DATA_PATH, directory=THUMBNAIL_PATH),
+    name="thumbnails",
+)
 
 # Specify the origins where CORS is enabled
 origins = [
@@ -29,17 +87,172 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = QdrantClient("localhost", port=6333)
+
+def metrics_path(path: str) -> str:
+    # Label the static files by their mount and unknown paths as "other", so the
+    # number of series stays bounded
+    prefix = "/" + path.strip("/").split("/")[0]
+    if prefix in ["/images", "/thumbnails"]:
+        return prefix
+    if any(path == getattr(route, "path", None) for route in app.routes):
+        return path
+    return "other"
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    path = metrics_path(request.url.path)
+    start = time.perf_counter()
+    with maybe_profile(path):
+        try:
+            response = await call_next(request)
+        except Exception:
+            ERRORS.inc(path=path)
+            REQUESTS.inc(path=path, status=500)
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+    if response.status_code >= 400:
+        ERRORS.inc(path=path)
+    REQUESTS.inc(path=path, status=response.status_code)
+    return response
+
+
+# The blocking client is used for ingestion, which runs on a worker thread. The
+# search endpoints use the async client so they never block the event loop.
+client = QdrantClient(
+    QDRANT_HOST,
+    port=QDRANT_PORT,
+    grpc_port=QDRANT_GRPC_PORT,
+    prefer_grpc=QDRANT_PREFER_GRPC,
+    timeout=QDRANT_TIMEOUT,
+)
+async_client = AsyncQdrantClient(
+    QDRANT_HOST,
+    port=QDRANT_PORT,
+    grpc_port=QDRANT_GRPC_PORT,
+    prefer_grpc=QDRANT_PREFER_GRPC,
+    timeout=QDRANT_TIMEOUT,
+    limits=httpx.Limits(
+        max_connections=QDRANT_MAX_CONNECTIONS,
+        max_keepalive_connections=QDRANT_MAX_KEEPALIVE_CONNECTIONS,
+    ),
+)
+manifest = IngestionManifest()
+store = EmbeddingStore()
+
+
+def load_movie_info() -> dict:
+    results_path = Path(IMAGE_DATA_PATH) / "results.json"
+    if not results_path.exists():
+        return {}
+    with open(results_path) as f:
+        return json.load(f)
+
+
+# Metadata of the movies, which compact payloads are filtered and joined with
+movie_table = MovieTable(load_movie_info())
+
+# Engine answering the searches. The in-process index serves the embedding
+# store and exposes the same search interface as the async Qdrant client.
+if SEARCH_BACKEND == "numpy":
+    search_client = NumpyIndex(store, load_movie_info())
+else:
+    search_client = async_client
+
+
+def search_content(results: list, fields: Optional[List[str]] = None) -> dict:
+    content = {"results": results}
+    if PAYLOAD_MODE == "compact":
+        # Add the metadata the points don't carry, once per movie
+        content["results"], content["movies"] = movie_table.join(results, fields)
+    return content
+
+
+def search_response(
+    message: str, results: list, fields: Optional[List[str]] = None
+) -> ORJSONResponse:
+    # The body is rendered to JSON when the response is created
+    with STAGE_SECONDS.time(stage="serialize"):
+        return ORJSONResponse(
+            content={"message": message, **search_content(results, fields)},
+            status_code=200,
+        )
+
+
+def bulk_search_response(
+    message: str,
+    results: List[list],
+    stream: bool,
+    fields: List[Optional[List[str]]],
+):
+    """Returns the results of every search in order, either in one JSON body or
+    streamed as one JSON line per search."""
+    if not stream:
+        with STAGE_SECONDS.time(stage="serialize"):
+            return ORJSONResponse(
+                content={
+                    "message": message,
+                    "responses": [
+                        search_content(result, result_fields)
+                        for result, result_fields in zip(results, fields)
+                    ],
+                },
+                status_code=200,
+            )
+
+    def lines():
+        for index, (result, result_fields) in enumerate(zip(results, fields)):
+            content = {"index": index, **search_content(result, result_fields)}
+            yield orjson.dumps(content) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 class SearchRequest(BaseModel):
     text: str
-    k: Optional[int] = 20
+    k: int = Field(SEARCH_K, gt=0)
     movie: Optional[str] = None
     director: Optional[str] = None
     actor: Optional[str] = None
     genre: Optional[str] = None
     year: Optional[str] = None
+    rescore: Optional[bool] = None
+    # Payload fields to return, all of them when unset
+    fields: Optional[List[str]] = None
+
+
+class HybridSearchRequest(SearchRequest):
+    fusion: Optional[str] = None
+    caption_weight: Optional[float] = None
+
+
+class BulkSearchRequest(BaseModel):
+    requests: List[SearchRequest]
+    stream: bool = False
+
+
+# Set once the model is loaded and warmed up, see /api/health/ready
+readiness = {"ready": False}
+
+
+def prepare():
+    """Loads and warms up the model, then embeds the popular queries."""
+    stats = warm_up()
+    if QUERY_CACHE_WARMUP_FILE:
+        count = text_embedding_cache.warm_up(
+            QUERY_CACHE_WARMUP_FILE, get_text_embeddings
+        )
+        print(f"Cached the embeddings of {count} queries")
+    stats["seconds_to_ready"] = round(time.perf_counter() - started, 3)
+    print(f"Ready to serve after {stats['seconds_to_ready']}s: {stats}")
+    readiness.update(ready=True, cold_start=stats)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Warm up in the background so the server answers liveness checks meanwhile
+    app.state.warm_up = asyncio.create_task(run_in_threadpool(prepare))
 
 
 def does_collection_exist() -> bool:
@@ -63,39 +276,43 @@ def does_collection_exist() -> bool:
     return found_captions and found_scenes
 
 
-# Ingest endpoint
-@app.get("/api/ingest", status_code=201)
-async def ingest():
-    # recreate_collection will delete the collection if it already exists
+def run_ingest(incremental: bool) -> JSONResponse:
     if not does_collection_exist():
-        client.recreate_collection(
-            collection_name="scenes",
-            vectors_config=models.VectorParams(
-                size=512, distance=models.Distance.COSINE
-            ),
-        )
-        client.recreate_collection(
-            collection_name="captions",
-            vectors_config=models.VectorParams(
-                size=512, distance=models.Distance.COSINE
-            ),
-        )
-    else:
+        # recreate_collection will delete the collection if it already exists
+        create_collections(client)
+        manifest.clear()
+    elif not incremental:
         return JSONResponse(
             content={"message": "Ingestion unnecessary."}, status_code=200
         )
 
-    # try:
-    with open("../image_data/results.json") as f:
-        results = json.load(f)
-    # Iterate through each of the directories and upsert them
-    # into the Qdrant db
-    for dir_path in Path("../image_data").iterdir():
-        if dir_path.is_dir():
-            ingest_dir(dir_path, client, results)
-    # except:
-    return JSONResponse(content={"message": "Ingest failed"}, status_code=400)
-    return JSONResponse(content={"message": "Ingest successful"}, status_code=201)
+    try:
+        results = load_movie_info()
+        # Collections created before the payload indexes existed get them here
+        create_payload_indexes(client)
+        # Embed and upsert the new or changed frames of every movie directory
+        # into the Qdrant db
+        summary = ingest_incremental(
+            client, results, Path(IMAGE_DATA_PATH), manifest, store
+        )
+        summary["thumbnails"] = generate_thumbnails(Path(IMAGE_DATA_PATH))
+        movie_table.reload(results)
+        if isinstance(search_client, NumpyIndex):
+            search_client.movie_info = results
+            search_client.reload()
+    except Exception as e:
+        print(f"Ingest failed because {e}")
+        return JSONResponse(content={"message": "Ingest failed"}, status_code=400)
+    return JSONResponse(
+        content={"message": "Ingest successful", **summary}, status_code=201
+    )
+
+
+# Ingest endpoint
+@app.get("/api/ingest", status_code=201)
+async def ingest(incremental: bool = False):
+    # Ingestion blocks for a long time, so keep it off the event loop
+    return await run_in_threadpool(run_ingest, incremental)
 
 
 # Search endpoint
@@ -105,11 +322,10 @@ async def search_text(request: SearchRequest):
     request_dict = request.model_dump()
     try:
         text = request_dict.pop("text")
-        results = search_text_in_db(text, client, **request_dict)
-        return JSONResponse(
-            content={"message": "Caption search successful", "results": results},
-            status_code=200,
+        results = await search_text_in_db(
+            text, search_client, movie_table, **request_dict
         )
+        return search_response("Caption search successful", results, request.fields)
     except:
         return JSONResponse(
             content={"message": "Caption search failed"}, status_code=400
@@ -117,26 +333,134 @@ async def search_text(request: SearchRequest):
 
 
 # Search endpoint
-@app.post("/api/search_image")
-async def search_image(file: UploadFile = File()):
+@app.post("/api/search_hybrid")
+async def search_hybrid(request: HybridSearchRequest):
     # We assume that the collection is already created with the correct config
-    file_data = file.file.read()
+    request_dict = request.model_dump()
     try:
-        image = Image.open(io.BytesIO(file_data))
-        results = search_images_in_db(image, client)
+        text = request_dict.pop("text")
+        results = await search_hybrid_in_db(
+            text, search_client, movie_table, **request_dict
+        )
+        return search_response("Hybrid search successful", results, request.fields)
+    except:
         return JSONResponse(
-            content={"message": "Image search successful", "results": results},
-            status_code=200,
+            content={"message": "Hybrid search failed"}, status_code=400
         )
+
+
+# Search endpoint
+@app.post("/api/search_image")
+async def search_image(
+    file: UploadFile = File(), fields: Optional[List[str]] = Query(None)
+):
+    # We assume that the collection is already created with the correct config
+    # Reading one byte past the limit is enough to reject an oversized upload
+    file_data = await file.read(MAX_UPLOAD_BYTES + 1)
+    try:
+        image = open_upload(file_data)
+        results = await search_images_in_db(image, search_client, fields=fields)
+        return search_response("Image search successful", results, fields)
+    except ImageTooLarge as e:
+        return JSONResponse(content={"message": str(e)}, status_code=413)
     except:
         return JSONResponse(content={"message": "Image search failed"}, status_code=401)
 
 
+# Bulk search endpoints
+@app.post("/api/search_text_bulk")
+async def search_text_bulk(request: BulkSearchRequest):
+    # We assume that the collection is already created with the correct config
+    try:
+        results = await search_texts_in_db(
+            [search.model_dump() for search in request.requests],
+            search_client,
+            movie_table,
+        )
+        return bulk_search_response(
+            "Bulk caption search successful",
+            results,
+            request.stream,
+            [search.fields for search in request.requests],
+        )
+    except:
+        return JSONResponse(
+            content={"message": "Bulk caption search failed"}, status_code=400
+        )
+
+
+@app.post("/api/search_image_bulk")
+async def search_image_bulk(
+    files: List[UploadFile] = File(),
+    k: int = Query(SEARCH_K, gt=0),
+    stream: bool = False,
+    fields: Optional[List[str]] = Query(None),
+):
+    # We assume that the collection is already created with the correct config
+    file_datas = [await file.read(MAX_UPLOAD_BYTES + 1) for file in files]
+    try:
+        images = [open_upload(file_data) for file_data in file_datas]
+        results = await search_images_bulk_in_db(
+            images, search_client, k=k, fields=fields
+        )
+        return bulk_search_response(
+            "Bulk image search successful", results, stream, [fields] * len(results)
+        )
+    except ImageTooLarge as e:
+        return JSONResponse(content={"message": str(e)}, status_code=413)
+    except:
+        return JSONResponse(
+            content={"message": "Bulk image search failed"}, status_code=401
+        )
+
+
+# Liveness endpoint, answers as soon as the server is up
+@app.get("/api/health/live")
+async def live():
+    return JSONResponse(content={"alive": True}, status_code=200)
+
+
+# Readiness endpoint, answers 200 once the model is loaded and warmed up
+@app.get("/api/health/ready")
+async def ready():
+    warm_up_task = getattr(app.state, "warm_up", None)
+    if warm_up_task is not None and warm_up_task.done() and warm_up_task.exception():
+        return JSONResponse(
+            content={"ready": False, "error": str(warm_up_task.exception())},
+            status_code=503,
+        )
+    return JSONResponse(
+        content=readiness, status_code=200 if readiness["ready"] else 503
+    )
+
+
+# Query cache statistics endpoint
+@app.get("/api/cache_stats")
+async def cache_stats():
+    return JSONResponse(content=text_embedding_cache.stats(), status_code=200)
+
+
+# Micro-batching statistics endpoint
+@app.get("/api/batch_stats")
+async def batch_stats():
+    return JSONResponse(
+        content={"text": text_batcher.stats(), "image": image_batcher.stats()},
+        status_code=200,
+    )
+
+
+# Prometheus metrics endpoint
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # Delete collections endpoint
 @app.get("/api/delete", status_code=204)
 async def delete():
-    client.delete_collection("scenes")
-    client.delete_collection("captions")
+    await async_client.delete_collection("scenes")
+    await async_client.delete_collection("captions")
+    manifest.clear()
     return Response(status_code=204)
 
 
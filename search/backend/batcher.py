@@ -0,0 +1,124 @@
+"""
+Dynamic micro-batching of concurrent requests. Items submitted from many threads
+within a short window are run through the model as one batch, and each caller
+gets back its own row of the result.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Runs `fn` on batches of the items submitted to it.
+
+    Args:
+        fn (Callable): maps a list of items to an array with one row per item
+        max_batch_size (int): largest batch passed to `fn`
+        max_wait_ms (float): how long the first item of a batch waits for more
+            items before the batch is run
+        name (str): used to name the worker thread
+        executor (Executor): optional executor that the batches run on. At most
+            `max_concurrency` batches are handed to it at a time; meanwhile new
+            items keep queueing up and form the next, larger batch.
+        max_concurrency (int): batches running on the executor at once
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], np.ndarray],
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str = "batcher",
+        executor: Optional[Executor] = None,
+        max_concurrency: int = 1,
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._executor = executor
+        self._slots = threading.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._batch_sizes = {}
+        self._batches = 0
+        self._items = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queues an item. The future resolves to its row of `fn`'s output."""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self) -> list:
+        """Blocks for the first item, then gathers more until the batch is full
+        or the first item has waited `max_wait`."""
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._record(batch, time.perf_counter())
+            if self._executor is None:
+                self._run_batch(batch)
+            else:
+                self._slots.acquire()
+                self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: list):
+        try:
+            outputs = self.fn([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), output in zip(batch, outputs):
+                future.set_result(output)
+        finally:
+            if self._executor is not None:
+                self._slots.release()
+
+    def _record(self, batch: list, started: float):
+        waits = [started - enqueued for _, _, enqueued in batch]
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+    def stats(self) -> dict:
+        """Batch size histogram and the time items spent queued."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": round(self._items / self._batches, 2)
+                if self._batches
+                else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_wait_ms": round(1000 * self._total_wait / self._items, 3)
+                if self._items
+                else 0.0,
+                "max_queue_wait_ms": round(1000 * self._max_wait_seen, 3),
+            }
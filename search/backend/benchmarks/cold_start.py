@@ -0,0 +1,68 @@
+"""
+Cold start of the backend. Each run starts a fresh interpreter that imports the
+app, loads the model, and times the first text and image embeddings before and
+after the warm-up that the server runs at startup.
+
+Usage (from backend/):
+    python -m benchmarks.cold_start --runs 3
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+from benchmarks.common import write_results
+
+# Runs in the fresh interpreter and prints its timings as JSON
+CHILD = """
+import json, time
+start = time.perf_counter()
+import app
+from PIL import Image
+from utils import get_encoder, get_image_embeddings, get_text_embeddings, warm_up
+timings = {"import_seconds": time.perf_counter() - start}
+
+start = time.perf_counter()
+get_encoder()
+timings["load_seconds"] = time.perf_counter() - start
+
+def first_calls(prefix):
+    start = time.perf_counter()
+    get_text_embeddings(["a man walking down a street"])
+    timings[prefix + "_text_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    get_image_embeddings([Image.new("RGB", (640, 360))])
+    timings[prefix + "_image_ms"] = (time.perf_counter() - start) * 1000
+
+first_calls("cold")
+start = time.perf_counter()
+warm_up()
+timings["warm_up_seconds"] = time.perf_counter() - start
+first_calls("warm")
+print(json.dumps(timings))
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = []
+    for run in range(args.runs):
+        output = subprocess.check_output([sys.executable, "-c", CHILD], text=True)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+        print(
+            f"Run {run + 1}: " + ", ".join(f"{k} {v:.3f}" for k, v in runs[-1].items())
+        )
+
+    report = {
+        "runs": args.runs,
+        **{
+            name: round(float(np.median([run[name] for run in runs])), 3)
+            for name in runs[0]
+        },
+    }
+    write_results("cold_start", report)
@@ -0,0 +1,91 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+
+import json
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+
+def percentiles(samples: List[float]) -> dict:
+    """Summarizes latencies given in seconds as milliseconds."""
+    samples_ms = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(samples_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+    }
+
+
+def time_calls(fn: Callable, args: list) -> List[float]:
+    """Calls `fn` once per argument and returns the latency of every call."""
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def index_collection(
+    client: QdrantClient, collection_name: str, timeout: float = 600
+) -> dict:
+    """Has Qdrant build the HNSW index (and the quantized vectors) of every point
+    of a benchmark collection, and waits until it is done. Collections below the
+    default `indexing_threshold` of 20k vectors are otherwise searched by a
+    plain scan, whatever their configuration.
+
+    Returns:
+        dict: the status, the number of points and of indexed vectors, to be
+            saved with the results so that a run without indexes shows up
+    """
+    client.update_collection(
+        collection_name,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+    )
+    deadline = time.monotonic() + timeout
+    while True:
+        info = client.get_collection(collection_name)
+        indexed = info.status == models.CollectionStatus.GREEN and (
+            info.indexed_vectors_count or 0
+        ) >= (info.points_count or 0)
+        if indexed or time.monotonic() > deadline:
+            break
+        time.sleep(1)
+    if not indexed:
+        print(f"Timed out waiting for the index of {collection_name}")
+    return {
+        "status": str(info.status.value),
+        "points_count": info.points_count,
+        "indexed_vectors_count": info.indexed_vectors_count,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(name: str, results: dict) -> Path:
+    """Writes the results to benchmarks/results/<name>-<git revision>.json."""
+    RESULTS_PATH.mkdir(exist_ok=True)
+    path = RESULTS_PATH / f"{name}-{git_revision()}.json"
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Saved the results to {path}")
+    return path
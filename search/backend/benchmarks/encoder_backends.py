@@ -0,0 +1,82 @@
+"""
+Per-batch latency of the encoder backends. Every backend embeds the same random
+image batches and caption batches, and the latency of each batch size is
+reported. Backends without an export are skipped.
+
+Usage (from backend/):
+    python encoders.py export --backend torchscript
+    python encoders.py export --backend onnx
+    python -m benchmarks.encoder_backends
+"""
+
+import argparse
+
+import numpy as np
+from benchmarks.common import percentiles, time_calls, write_results
+from config import MODEL_NAME
+from encoders import BACKENDS, PRECISIONS, load_encoder
+from transformers import AutoTokenizer
+
+# Captions of typical length that the text batches are drawn from
+CAPTIONS = [
+    "a man in a suit walks down a dark street at night",
+    "two women talking at a kitchen table",
+    "a car speeding along a desert highway",
+    "close up of a child laughing",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    rng = np.random.default_rng(0)
+    report = {
+        "model": MODEL_NAME,
+        "precision": args.precision,
+        "repeats": args.repeats,
+    }
+    for backend in args.backends:
+        try:
+            encoder = load_encoder(backend, args.precision)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+
+        report[backend] = {}
+        for batch_size in args.batch_sizes:
+            pixel_values = rng.standard_normal(
+                (batch_size, 3, 224, 224), dtype=np.float32
+            )
+            tokens = tokenizer(
+                (CAPTIONS * batch_size)[:batch_size], padding=True, return_tensors="np"
+            )
+            # One untimed call so every backend starts warm
+            encoder.encode_images(pixel_values)
+            encoder.encode_texts(tokens["input_ids"], tokens["attention_mask"])
+
+            image = percentiles(
+                time_calls(
+                    lambda _: encoder.encode_images(pixel_values),
+                    range(args.repeats),
+                )
+            )
+            text = percentiles(
+                time_calls(
+                    lambda _: encoder.encode_texts(
+                        tokens["input_ids"], tokens["attention_mask"]
+                    ),
+                    range(args.repeats),
+                )
+            )
+            report[backend][f"batch_{batch_size}"] = {"image": image, "text": text}
+            print(
+                f"{backend:>12} batch {batch_size:>3}: image p50 {image['p50_ms']:.2f}ms"
+                f"  text p50 {text['p50_ms']:.2f}ms"
+            )
+    write_results("encoder_backends", report)
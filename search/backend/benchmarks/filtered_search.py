@@ -0,0 +1,130 @@
+"""
+Latency of filtered searches with and without payload indexes. A collection of
+random vectors is filled with the payloads of the movies in results.json, and
+searches filtered on a movie, a director, a genre and a year are timed:
+
+    no_index        the collection without payload indexes (the old setup)
+    payload_index   the same points with the payload indexes
+    planned         payload indexes, and exact search for selective filters
+
+Both collections get their HNSW index built before anything is timed.
+
+Usage (from backend/, with Qdrant running):
+    python -m benchmarks.filtered_search --image-data ../image_data
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+from benchmarks.common import (
+    index_collection,
+    percentiles,
+    time_calls,
+    write_results,
+)
+from config import EXACT_SEARCH_MAX_FRAMES, IMAGE_DATA_PATH, QDRANT_HOST, QDRANT_PORT
+from image_ingestion import build_payload, create_collections, create_payload_indexes
+from image_search import build_query_filter
+from movie_table import MovieTable
+from qdrant_client import QdrantClient, models
+from utils import generate_id
+
+
+def sample_filters(table: MovieTable, count: int, rng: random.Random) -> dict:
+    """Picks `count` values of every filter from the movies in the table."""
+    movies = list(table.movies.values())
+    filters = {"movie": [], "director": [], "genre": [], "year": []}
+    for _ in range(count):
+        movie = rng.choice(movies)
+        filters["movie"].append({"movie": movie["title"]})
+        filters["director"].append({"director": rng.choice(movie["director"])})
+        filters["genre"].append({"genre": rng.choice(movie["genre"])})
+        filters["year"].append({"year": movie["year"]})
+    return filters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--image-data", default=IMAGE_DATA_PATH)
+    parser.add_argument("--frames-per-movie", type=int, default=300)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(Path(args.image_data) / "results.json") as f:
+        movie_info = json.load(f)
+    for info in movie_info.values():
+        info["NumImages"] = args.frames_per_movie
+    table = MovieTable(movie_info)
+
+    rng = np.random.default_rng(0)
+    ids, payloads = [], []
+    for movie_id in movie_info:
+        for i in range(args.frames_per_movie):
+            image_id = f"{i:05d}.jpg"
+            ids.append(generate_id(image_id, movie_id))
+            payloads.append(build_payload(movie_id, image_id, "", movie_info, "full"))
+    vectors = rng.standard_normal((len(ids), 512), dtype=np.float32)
+    queries = rng.standard_normal((args.queries, 512), dtype=np.float32)
+    filters = sample_filters(table, args.queries, random.Random(0))
+
+    client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT, timeout=60)
+    collections = {"no_index": "bench_filters_no_index", "indexed": "bench_filters"}
+    create_collections(client, [collections["no_index"]], payload_indexes=False)
+    create_collections(client, [collections["indexed"]], payload_indexes=False)
+    for name in collections.values():
+        client.upload_collection(name, vectors=vectors, payload=payloads, ids=ids)
+    # Index after the upload, the way existing collections get their indexes
+    create_payload_indexes(client, [collections["indexed"]], "full")
+
+    def searcher(collection_name: str, plan: bool):
+        def search(call):
+            query, kwargs = call
+            params = None
+            if plan:
+                movie_ids = table.resolve(**kwargs)
+                if table.num_frames(movie_ids) <= EXACT_SEARCH_MAX_FRAMES:
+                    params = models.SearchParams(exact=True)
+            return client.search(
+                collection_name,
+                query.tolist(),
+                query_filter=build_query_filter(**kwargs),
+                search_params=params,
+                limit=args.k,
+            )
+
+        return search
+
+    modes = {
+        "no_index": searcher(collections["no_index"], plan=False),
+        "payload_index": searcher(collections["indexed"], plan=False),
+        "planned": searcher(collections["indexed"], plan=True),
+    }
+    try:
+        indexes = {}
+        for mode, name in collections.items():
+            indexes[mode] = index_collection(client, name)
+            print(f"{name}: {indexes[mode]}")
+
+        report = {
+            "k": args.k,
+            "points": len(ids),
+            "movies": len(movie_info),
+            "collections": indexes,
+        }
+        for field, kwargs in filters.items():
+            report[field] = {}
+            for mode, search in modes.items():
+                latencies = time_calls(search, list(zip(queries, kwargs)))
+                report[field][mode] = percentiles(latencies)
+                print(
+                    f"{field:>8} {mode:>13}: p50 {report[field][mode]['p50_ms']:.2f}ms"
+                    f"  p99 {report[field][mode]['p99_ms']:.2f}ms"
+                )
+        write_results("filtered_search", report)
+    finally:
+        for name in collections.values():
+            client.delete_collection(name)
@@ -0,0 +1,305 @@
+"""
+Offline end-to-end benchmark of ingestion and search. A tiny randomly
+initialized CLIP model, a character-level CLIP tokenizer and synthetic JPEGs and
+captions stand in for the real model and dataset, and Qdrant runs in `:memory:`
+mode (or the in-process NumpyIndex answers the searches), so nothing is
+downloaded and no server is needed. The numbers are only comparable between
+runs with the same settings, which are saved along with them.
+
+Measures:
+    - ingest frames/sec of `ingest_incremental` into Qdrant with an embedding
+      store, through the same decode/encode/upload pipeline as /api/ingest,
+      along with the throughput of every stage
+    - latency percentiles of single text and image searches, one at a time
+    - searches/sec of text searches at several levels of concurrency
+
+Usage (from backend/):
+    python -m benchmarks.offline --index qdrant
+    python -m benchmarks.offline --index numpy --movies 50
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import preprocessing
+import torch
+from benchmarks.common import percentiles, write_results
+from config import NUM_DECODE_WORKERS, NUM_UPLOAD_WORKERS
+from embedding_store import EmbeddingStore
+from encoders import TorchEncoder
+from image_ingestion import create_collections
+from image_search import search_images_in_db, search_text_in_db
+from ingestion_manifest import IngestionManifest, ingest_incremental
+from movie_table import MovieTable
+from PIL import Image
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPTokenizer
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+from utils import set_encoder
+from vector_index import NumpyIndex
+
+WORDS = (
+    "a man woman child dog car street house night day running sitting holding "
+    "red blue dark bright old young two people window door table gun phone city "
+    "forest beach room crowd looking at the in on with near"
+).split()
+GENRES = ["Drama", "Comedy", "Action", "Horror", "Romance"]
+
+
+def tiny_clip(dir_path: Path):
+    """Builds a randomly initialized two-layer CLIP model with the real model's
+    512-dim projections, and a CLIP tokenizer whose vocabulary is single
+    characters, so no files have to be downloaded."""
+    chars = list(bytes_to_unicode().values())
+    vocab = chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"]
+    with open(dir_path / "vocab.json", "w") as f:
+        json.dump({token: i for i, token in enumerate(vocab)}, f)
+    with open(dir_path / "merges.txt", "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(
+        dir_path / "vocab.json", dir_path / "merges.txt", model_max_length=77
+    )
+
+    torch.manual_seed(0)
+    layers = dict(
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+    )
+    config = CLIPConfig(
+        text_config=dict(
+            vocab_size=len(vocab),
+            bos_token_id=len(vocab) - 2,
+            eos_token_id=len(vocab) - 1,
+            pad_token_id=len(vocab) - 1,
+            **layers,
+        ),
+        vision_config=dict(image_size=224, patch_size=32, **layers),
+        projection_dim=512,
+    )
+    return CLIPModel(config).eval(), tokenizer
+
+
+def caption(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 12)))
+
+
+def make_image_data(dir_path: Path, movies: int, frames: int, size: List[int]) -> dict:
+    """Writes `movies` directories of `frames` JPEGs with captions and a
+    results.json, in the layout of IMAGE_DATA_PATH. The frames are smooth random
+    gradients plus noise, which compress about as well as real stills."""
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    width, height = size
+    movie_info = {}
+    for m in range(movies):
+        movie_id = f"tt{m:07d}"
+        movie_path = dir_path / movie_id
+        movie_path.mkdir(parents=True)
+        captions = {}
+        for i in range(1, frames + 1):
+            corners = np_rng.integers(0, 256, (2, 2, 3)).astype(np.float32)
+            gradient = np.asarray(
+                Image.fromarray(corners.astype(np.uint8)).resize(
+                    (width, height), Image.BILINEAR
+                ),
+                dtype=np.float32,
+            )
+            noise = np_rng.normal(0, 12, (height, width, 3))
+            pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+            Image.fromarray(pixels).save(movie_path / f"{i}.jpg", quality=90)
+            captions[f"{i}.jpg"] = caption(rng)
+        with open(movie_path / "captions.json", "w") as f:
+            json.dump(captions, f)
+        movie_info[movie_id] = {
+            "Title": f"Movie {m}",
+            "Director": [f"Director {m % 7}"],
+            "Actors": [f"Actor {m % 11}", f"Actor {m % 13 + 11}"],
+            "Genre": [GENRES[m % len(GENRES)]],
+            "Year": str(1980 + m % 40),
+            "NumImages": frames,
+        }
+    with open(dir_path / "results.json", "w") as f:
+        json.dump(movie_info, f)
+    return movie_info
+
+
+async def copy_collections(client: QdrantClient, async_client: AsyncQdrantClient):
+    """The sync and async clients each keep their own `:memory:` store, so the
+    points ingested with the sync client are copied to the async one."""
+    for collection_name in ["scenes", "captions"]:
+        count = client.count(collection_name).count
+        points, _ = client.scroll(
+            collection_name, limit=count, with_payload=True, with_vectors=True
+        )
+        await async_client.recreate_collection(
+            collection_name,
+            vectors_config=models.VectorParams(
+                size=512, distance=models.Distance.COSINE
+            ),
+        )
+        await async_client.upsert(
+            collection_name,
+            points=[
+                models.PointStruct(
+                    id=point.id, vector=point.vector, payload=point.payload
+                )
+                for point in points
+            ],
+        )
+
+
+async def time_searches(search, queries: list) -> List[float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        await search(query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def throughput(search, queries: list, concurrency: int) -> dict:
+    """Runs the searches with `concurrency` of them in flight at once."""
+    queue = list(reversed(queries))
+
+    async def worker():
+        while queue:
+            await search(queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "searches": len(queries),
+        "searches_per_second": round(len(queries) / elapsed, 2),
+    }
+
+
+async def run_searches(search_client, movie_table, image_paths, args) -> dict:
+    rng = random.Random(1)
+    # Every query is unique so that none of them is answered from the query cache
+    texts = [f"{caption(rng)} {i}" for i in range(args.queries * 2)]
+    images = [
+        image_paths[rng.randrange(len(image_paths))].read_bytes()
+        for _ in range(args.queries)
+    ]
+
+    async def search_text(text):
+        results = await search_text_in_db(text, search_client, movie_table, k=args.k)
+        assert len(results) == args.k
+        return results
+
+    async def search_image(data):
+        image = preprocessing.open_upload(data)
+        return await search_images_in_db(image, search_client)
+
+    # Warm up the model, the batchers and the index
+    await time_searches(search_text, [caption(rng) for _ in range(10)])
+    await time_searches(search_image, images[:5])
+
+    report = {
+        "text_search": percentiles(
+            await time_searches(search_text, texts[: args.queries])
+        ),
+        "image_search": percentiles(await time_searches(search_image, images)),
+        "text_throughput": [],
+    }
+    for concurrency in args.concurrency:
+        report["text_throughput"].append(
+            await throughput(search_text, texts[args.queries :], concurrency)
+        )
+        # Reuse the queries, with a suffix that keeps them out of the cache
+        texts[args.queries :] = [f"{t} {concurrency}" for t in texts[args.queries :]]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--index", choices=["qdrant", "numpy"], default="qdrant")
+    parser.add_argument("--movies", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=50, help="frames per movie")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[854, 480])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        model, tokenizer = tiny_clip(tmp_path)
+        set_encoder(TorchEncoder(model), tokenizer)
+        preprocessing.processor = CLIPImageProcessor()
+
+        start = time.perf_counter()
+        image_data_path = tmp_path / "image_data"
+        movie_info = make_image_data(
+            image_data_path, args.movies, args.frames, args.image_size
+        )
+        print(
+            f"Wrote {args.movies * args.frames} frames in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+        client = QdrantClient(":memory:")
+        create_collections(client, payload_indexes=False)
+        store = EmbeddingStore(tmp_path / "embeddings", model_id="tiny-clip")
+        manifest = IngestionManifest(str(tmp_path / "ingest.sqlite"), "tiny-clip")
+        start = time.perf_counter()
+        summary = ingest_incremental(
+            client, movie_info, image_data_path, manifest, store, dataset_manifest=None
+        )
+        ingest_seconds = time.perf_counter() - start
+        frames = args.movies * args.frames
+        assert summary["embedded_frames"] == frames
+
+        if args.index == "numpy":
+            search_client = NumpyIndex(store, movie_info)
+        else:
+            search_client = AsyncQdrantClient(":memory:")
+            asyncio.run(copy_collections(client, search_client))
+
+        image_paths = sorted(image_data_path.glob("*/*.jpg"))
+        report = {
+            "settings": {
+                **vars(args),
+                "frames_total": frames,
+                "torch_threads": torch.get_num_threads(),
+                "decode_workers": NUM_DECODE_WORKERS,
+                "upload_workers": NUM_UPLOAD_WORKERS,
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "machine": platform.machine(),
+            },
+            "ingest": {
+                "frames": frames,
+                "seconds": round(ingest_seconds, 3),
+                "frames_per_second": round(frames / ingest_seconds, 2),
+                "stages": summary["stats"],
+            },
+            **asyncio.run(
+                run_searches(search_client, MovieTable(movie_info), image_paths, args)
+            ),
+        }
+
+    print(f"Ingest: {report['ingest']['frames_per_second']} frames/s")
+    for name in ["text_search", "image_search"]:
+        print(
+            f"{name}: p50 {report[name]['p50_ms']:.2f}ms"
+            f"  p99 {report[name]['p99_ms']:.2f}ms"
+        )
+    for result in report["text_throughput"]:
+        print(
+            f"text search x{result['concurrency']}: "
+            f"{result['searches_per_second']} searches/s"
+        )
+    write_results(f"offline-{args.index}", report)
@@ -0,0 +1,120 @@
+"""
+Retrieval quality and speed of the reduced precision encoders against float32.
+The frames and captions of the dataset's test split are embedded by every
+precision, and each caption is used as a query against all frames (and each
+frame against all captions). Recall@k counts how often the caption's own frame
+is among the k closest, so the drop from float32 is what a precision costs.
+
+Usage (from backend/):
+    python -m benchmarks.precision_report --split-path ../../dataset/data/test
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from benchmarks.common import percentiles, write_results
+from config import BATCH_SIZE, MODEL_NAME
+from encoders import BACKENDS, PRECISIONS, load_encoder
+from image_ingestion import iter_frames
+from preprocessing import load_image, preprocess_images
+from transformers import AutoTokenizer
+
+
+def recall_at_k(queries: np.ndarray, targets: np.ndarray, ks: list) -> dict:
+    """Fraction of queries whose own target (same row) is among the k closest."""
+    scores = queries @ targets.T
+    own = scores[np.arange(len(scores)), np.arange(len(scores))]
+    # Rank of the own target, 0 being the closest
+    ranks = (scores > own[:, None]).sum(axis=1)
+    return {f"recall@{k}": round(float(np.mean(ranks < k)), 4) for k in ks}
+
+
+def normalized(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--split-path", default="../../dataset/data/test")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument(
+        "--precisions", nargs="+", choices=PRECISIONS, default=PRECISIONS
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    split_path = Path(args.split_path)
+    frames = [
+        frame
+        for dir_path in sorted(split_path.iterdir())
+        if dir_path.is_dir() and (dir_path / "captions.json").exists()
+        for frame in iter_frames(dir_path)
+    ]
+    print(f"Embedding {len(frames)} frames of {split_path}")
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    precisions = ["float32"] + [p for p in args.precisions if p != "float32"]
+    encoders, skipped = {}, {}
+    for precision in precisions:
+        encoder = load_encoder(args.backend, precision)
+        # A bf16 encoder stays float32 on a CPU without native bf16, and its
+        # row would report float32 recall and latency as bf16
+        if encoder.precision != precision:
+            print(f"Skipping {precision}, the encoder runs at {encoder.precision}")
+            skipped[precision] = f"ran at {encoder.precision}"
+            continue
+        encoders[precision] = encoder
+    precisions = list(encoders)
+    image_embeddings = {p: [] for p in precisions}
+    text_embeddings = {p: [] for p in precisions}
+    image_latencies = {p: [] for p in precisions}
+    text_latencies = {p: [] for p in precisions}
+
+    # Decode and tokenize every batch once and run it through all the encoders
+    for start in range(0, len(frames), args.batch_size):
+        batch = frames[start : start + args.batch_size]
+        pixel_values = preprocess_images([load_image(f.image_path) for f in batch])
+        tokens = tokenizer(
+            [frame.caption for frame in batch],
+            padding=True,
+            truncation=True,
+            return_tensors="np",
+        )
+        for precision, encoder in encoders.items():
+            begin = time.perf_counter()
+            image_embeddings[precision].append(encoder.encode_images(pixel_values))
+            image_latencies[precision].append(time.perf_counter() - begin)
+
+            begin = time.perf_counter()
+            text_embeddings[precision].append(
+                encoder.encode_texts(tokens["input_ids"], tokens["attention_mask"])
+            )
+            text_latencies[precision].append(time.perf_counter() - begin)
+
+    report = {
+        "model": MODEL_NAME,
+        "backend": args.backend,
+        "frames": len(frames),
+        "batch_size": args.batch_size,
+        "skipped": skipped,
+    }
+    for precision in precisions:
+        images = normalized(np.concatenate(image_embeddings[precision]))
+        texts = normalized(np.concatenate(text_embeddings[precision]))
+        report[precision] = {
+            "text_to_image": recall_at_k(texts, images, args.k),
+            "image_to_text": recall_at_k(images, texts, args.k),
+            "image_batch": percentiles(image_latencies[precision]),
+            "text_batch": percentiles(text_latencies[precision]),
+        }
+        recalls = report[precision]["text_to_image"]
+        print(
+            f"{precision:>9}: text->image "
+            + "  ".join(f"{name} {value:.4f}" for name, value in recalls.items())
+            + f"  image batch p50 {report[precision]['image_batch']['p50_ms']:.1f}ms"
+            + f"  text batch p50 {report[precision]['text_batch']['p50_ms']:.1f}ms"
+        )
+    write_results("precision", report)
@@ -0,0 +1,120 @@
+"""
+Recall-vs-latency report for the quantized collections. The frames and captions
+of the dataset's test split are loaded into temporary collections with and
+without int8 quantization, and every caption is used as a query against the
+scenes. Recall@k is measured against an exact search over the float32 vectors.
+The collections are fully indexed before they are searched.
+
+Usage (from backend/, with Qdrant running):
+    python -m benchmarks.quantization_report --split-path ../../dataset/data/test
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from benchmarks.common import index_collection, percentiles, write_results
+from config import QDRANT_HOST, QDRANT_PORT
+from image_ingestion import create_collections, embed_frames, iter_frames
+from qdrant_client import QdrantClient, models
+from utils import generate_id
+
+# Search settings compared by the report
+MODES = {
+    "float32": ("none", None),
+    "int8": ("int8", models.QuantizationSearchParams(rescore=False)),
+    "int8+rescore": (
+        "int8",
+        models.QuantizationSearchParams(rescore=True, oversampling=2.0),
+    ),
+}
+
+
+def load_split(split_path: Path):
+    frames = [
+        frame
+        for dir_path in sorted(split_path.iterdir())
+        if dir_path.is_dir() and (dir_path / "captions.json").exists()
+        for frame in iter_frames(dir_path)
+    ]
+    print(f"Embedding {len(frames)} frames of {split_path}")
+    image_embeddings, text_embeddings = embed_frames(frames)
+    return frames, image_embeddings, text_embeddings
+
+
+def search(client, collection_name, queries, k, params):
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = client.search(
+            collection_name, query.tolist(), limit=k, search_params=params
+        )
+        latencies.append(time.perf_counter() - start)
+        ids.append([result.id for result in results])
+    return ids, latencies
+
+
+def recall(found, expected) -> float:
+    return float(
+        np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected) if b])
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--split-path", default="../../dataset/data/test")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = QdrantClient(QDRANT_HOST, port=QDRANT_PORT, timeout=60)
+    frames, image_embeddings, text_embeddings = load_split(Path(args.split_path))
+    ids = [generate_id(frame.image_id, frame.movie_id) for frame in frames]
+    queries = text_embeddings[: args.queries]
+
+    collections, indexes = {}, {}
+    for quantization in ["none", "int8"]:
+        name = f"bench_scenes_{quantization}"
+        create_collections(
+            client, [name], quantization=quantization, payload_indexes=False
+        )
+        client.upload_collection(name, vectors=image_embeddings, ids=ids)
+        collections[quantization] = name
+
+    try:
+        for quantization, name in collections.items():
+            indexes[quantization] = index_collection(client, name)
+            print(f"{name}: {indexes[quantization]}")
+
+        exact_params = models.SearchParams(exact=True)
+        expected, _ = search(client, collections["none"], queries, args.k, exact_params)
+
+        report = {
+            "k": args.k,
+            "queries": len(queries),
+            "frames": len(frames),
+            "collections": indexes,
+        }
+        for mode, (quantization, quantization_params) in MODES.items():
+            params = models.SearchParams(quantization=quantization_params)
+            found, latencies = search(
+                client, collections[quantization], queries, args.k, params
+            )
+            report[mode] = {
+                f"recall@{args.k}": round(recall(found, expected), 4),
+                # How often the caption's own frame is among the results
+                "own_frame_hit_rate": round(
+                    float(np.mean([i in f for i, f in zip(ids, found)])), 4
+                ),
+                **percentiles(latencies),
+            }
+            print(
+                f"{mode:>14}: recall@{args.k} {report[mode][f'recall@{args.k}']:.4f}"
+                f"  p50 {report[mode]['p50_ms']:.2f}ms"
+                f"  p99 {report[mode]['p99_ms']:.2f}ms"
+            )
+        write_results("quantization", report)
+    finally:
+        for name in collections.values():
+            client.delete_collection(name)
@@ -0,0 +1,141 @@
+"""
+Bytes and latency of search responses before and after the lean response path.
+Random points with full payloads are loaded into a collection, and the same
+searches are answered both ways:
+
+    - "model_dump+json": the whole payload, `model_dump` of every point and
+      the stdlib JSON encoder of JSONResponse
+    - "projected+orjson": only the requested payload fields fetched from Qdrant,
+      no vectors, plain result dicts and ORJSONResponse
+
+A "full+orjson" mode in between separates the gain of the encoder from the gain
+of the projection. The latency is split into the search and the rendering of
+the response body. With `:memory:` there is no network in between, and the local
+mode applies the projection in Python, so the search time of the projection
+is only meaningful against a Qdrant server.
+
+Usage (from backend/):
+    python -m benchmarks.response_size
+    python -m benchmarks.response_size --location http://localhost:6333
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import numpy as np
+from benchmarks.common import percentiles, write_results
+from benchmarks.offline import GENRES, caption
+from fastapi.responses import JSONResponse, ORJSONResponse
+from image_ingestion import build_payload
+from image_search import to_result
+from qdrant_client import AsyncQdrantClient, models
+
+# Fields the frontend shows for every result
+FIELDS = ["movie_id", "image_id", "title", "image_path"]
+
+
+def random_points(count: int, movies: int = 200):
+    rng = random.Random(0)
+    movie_info = {
+        f"tt{m:07d}": {
+            "Title": f"Movie {m}",
+            "Director": [f"Director {m % 37}"],
+            "Actors": [f"Actor {(m * 7 + i) % 500}" for i in range(4)],
+            "Genre": [GENRES[m % len(GENRES)], GENRES[(m + 2) % len(GENRES)]],
+            "Year": str(1950 + m % 70),
+        }
+        for m in range(movies)
+    }
+    vectors = np.random.default_rng(0).normal(size=(count, 512)).astype(np.float32)
+    return [
+        models.PointStruct(
+            id=str(uuid.UUID(int=i)),
+            vector=vector.tolist(),
+            payload=build_payload(
+                f"tt{i % movies:07d}",
+                f"{i}.jpg",
+                caption(rng),
+                movie_info,
+                "full",
+            ),
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def before(results) -> bytes:
+    content = {"results": [result.model_dump() for result in results]}
+    return JSONResponse(content=content).body
+
+
+def after(results) -> bytes:
+    content = {"results": [to_result(result) for result in results]}
+    return ORJSONResponse(content=content).body
+
+
+# How every mode searches and renders the response
+MODES = {
+    "model_dump+json": (dict(with_payload=True), before),
+    "full+orjson": (dict(with_payload=True, with_vectors=False), after),
+    "projected+orjson": (dict(with_payload=FIELDS, with_vectors=False), after),
+}
+
+
+async def run(args) -> dict:
+    client = AsyncQdrantClient(location=args.location)
+    collection_name = "bench_response_size"
+    await client.recreate_collection(
+        collection_name,
+        vectors_config=models.VectorParams(size=512, distance=models.Distance.COSINE),
+    )
+    points = random_points(args.points)
+    for start in range(0, len(points), 1000):
+        await client.upsert(collection_name, points=points[start : start + 1000])
+    queries = np.random.default_rng(1).normal(size=(args.queries, 512)).tolist()
+
+    report = {"points": args.points, "queries": args.queries, "fields": FIELDS}
+    try:
+        for k in args.k:
+            for mode, (options, render) in MODES.items():
+                search_latencies, render_latencies, total_latencies = [], [], []
+                # The first query warms up
+                for query in queries[:1] + queries:
+                    start = time.perf_counter()
+                    results = await client.search(
+                        collection_name, query, limit=k, **options
+                    )
+                    searched = time.perf_counter()
+                    body = render(results)
+                    end = time.perf_counter()
+                    search_latencies.append(searched - start)
+                    render_latencies.append(end - searched)
+                    total_latencies.append(end - start)
+                report[f"k={k} {mode}"] = result = {
+                    "bytes": len(body),
+                    **percentiles(total_latencies[1:]),
+                    "search_p50_ms": percentiles(search_latencies[1:])["p50_ms"],
+                    "render_p50_ms": percentiles(render_latencies[1:])["p50_ms"],
+                }
+                print(
+                    f"k={k:>4} {mode:>17}: {len(body):>8} bytes"
+                    f"  p50 {result['p50_ms']:.2f}ms"
+                    f" (search {result['search_p50_ms']:.2f}ms"
+                    f" + render {result['render_p50_ms']:.2f}ms)"
+                )
+    finally:
+        await client.delete_collection(collection_name)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--location", default=":memory:")
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, nargs="+", default=[20, 500])
+    args = parser.parse_args()
+
+    write_results("response_size", asyncio.run(run(args)))
@@ -0,0 +1,165 @@
+"""
+Configuration for the search backend. Every value can be overridden with an
+environment variable of the same name.
+"""
+
+import os
+
+# ============================= MODEL =============================
+
+# Hugging Face model used for both the image and the text towers
+MODEL_NAME = os.getenv("MODEL_NAME", "openai/clip-vit-base-patch16")
+
+# Number of images or captions that are embedded in a single forward pass
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 32))
+
+# Runtime of the image and text towers: "torch", "torchscript" or "onnx". The
+# last two run graphs exported with `python encoders.py export`.
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ENCODER_PATH = os.getenv("ENCODER_PATH", "./encoders")
+# Precision of the towers: "float32", "int8" (dynamic quantization) or
+# "bfloat16" (on CPUs with native bf16). Exported backends need an export of the
+# same precision.
+ENCODER_PRECISION = os.getenv("ENCODER_PRECISION", "float32")
+# Intra-op threads of the torchscript and onnx backends, 0 for the default
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", 0))
+
+# Image preprocessing: "fast" resizes with JPEG draft decoding and normalizes
+# whole batches in NumPy, "hf" runs the Hugging Face image processor
+PREPROCESSING = os.getenv("PREPROCESSING", "fast")
+
+# ============================= QDRANT =============================
+
+QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+
+# Talk to Qdrant over gRPC instead of REST
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+
+# Seconds before a request to Qdrant times out
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", 10))
+
+# Connection pool of the async REST client used by the search endpoints
+QDRANT_MAX_CONNECTIONS = int(os.getenv("QDRANT_MAX_CONNECTIONS", 64))
+QDRANT_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("QDRANT_MAX_KEEPALIVE_CONNECTIONS", 32)
+)
+
+# Quantization of the vectors in the "scenes" and "captions" collections:
+# "none", or "int8" for scalar quantization kept in RAM
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")
+
+# Keep the original float32 vectors on disk. Combined with quantization only the
+# int8 vectors take up RAM.
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "false").lower() == "true"
+
+# ============================= INGESTION =============================
+
+# Directory holding results.json and one directory of frames per movie
+IMAGE_DATA_PATH = os.getenv("IMAGE_DATA_PATH", "../image_data")
+
+# SQLite file recording which frames have been ingested with which model
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "./ingest_manifest.sqlite")
+
+# Manifest of the dataset written by dataset/manifest.py, and the split of it
+# that IMAGE_DATA_PATH holds. When set, ingestion lists the frames and captions
+# from the manifest instead of walking the movie directories, and the image
+# hashes from it instead of reading every image.
+DATASET_MANIFEST_PATH = os.getenv("DATASET_MANIFEST_PATH")
+DATASET_SPLIT = os.getenv("DATASET_SPLIT", "train")
+
+# Processes that decode and preprocess the JPEGs during ingestion
+NUM_DECODE_WORKERS = int(os.getenv("NUM_DECODE_WORKERS", max(1, os.cpu_count() // 2)))
+
+# Threads that upload the embedded points to Qdrant
+NUM_UPLOAD_WORKERS = int(os.getenv("NUM_UPLOAD_WORKERS", 4))
+
+# Maximum number of batches waiting between two stages of the ingestion pipeline
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+
+# Directory of the thumbnails generated at ingest, one directory per size
+THUMBNAIL_PATH = os.getenv("THUMBNAIL_PATH", "./thumbnails")
+
+# Longest edge of every thumbnail size, empty to serve the original frames
+THUMBNAIL_SIZES = [
+    int(size) for size in os.getenv("THUMBNAIL_SIZES", "256,640").split(",") if size
+]
+
+# Thumbnail size that `image_path` in the search results points at
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 640))
+
+# "webp" or "jpeg", and the encoder quality
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+
+# Seconds that browsers may cache frames and thumbnails before revalidating
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", 7 * 24 * 3600))
+
+# What the points store in their payload: "full" copies the movie's metadata
+# into every point, "compact" stores only the frame's ids and caption and joins
+# the metadata from results.json at query time
+PAYLOAD_MODE = os.getenv("PAYLOAD_MODE", "full")
+
+# ============================= EMBEDDING STORE =============================
+
+# Directory of the on-disk embedding store, one sub-directory per model, encoder
+# backend and precision
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "./embeddings")
+
+# Precision of the stored embeddings, "float32" or "float16"
+EMBEDDING_STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "float16")
+
+# ============================= SEARCH =============================
+
+# Uploaded query images larger than this many bytes or pixels are rejected
+# before they are decoded
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_UPLOAD_PIXELS = int(os.getenv("MAX_UPLOAD_PIXELS", 50_000_000))
+
+# Engine answering the searches: "qdrant", or "numpy" for exact search in
+# process over the embedding store
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "qdrant")
+
+# Number of results of a text or image search that does not ask for a k
+SEARCH_K = int(os.getenv("SEARCH_K", 20))
+
+# Rescore the candidates found with the quantized vectors using the original
+# vectors, and how many extra candidates to fetch for it
+SEARCH_RESCORE = os.getenv("SEARCH_RESCORE", "true").lower() == "true"
+SEARCH_OVERSAMPLING = float(os.getenv("SEARCH_OVERSAMPLING", 2.0))
+
+# Filters matching at most this many frames are answered by an exact search
+# over the matching points instead of the HNSW graph
+EXACT_SEARCH_MAX_FRAMES = int(os.getenv("EXACT_SEARCH_MAX_FRAMES", 2000))
+
+# How /api/search_hybrid merges the caption and scene rankings: "rrf" for
+# reciprocal rank fusion or "weighted" for a weighted sum of the scores
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+# Rank offset of reciprocal rank fusion, larger values flatten the rank weights
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+# Weight of the caption ranking, the scene ranking gets the rest
+HYBRID_CAPTION_WEIGHT = float(os.getenv("HYBRID_CAPTION_WEIGHT", 0.5))
+
+# Number of query texts whose embeddings are kept in memory
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 10000))
+
+# Optional file of popular queries, one per line, embedded at startup
+QUERY_CACHE_WARMUP_FILE = os.getenv("QUERY_CACHE_WARMUP_FILE")
+
+# Threads running the model for search requests. Each runs one batch at a time.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 2))
+
+# Largest batch of concurrent queries that are embedded in one forward pass
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", 32))
+
+# How long the first query of a batch waits for others to join it
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", 5))
+
+# ============================= METRICS =============================
+
+# Fraction of requests profiled with cProfile, 0 turns profiling off
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+
+# Directory that the profiles of the sampled requests are written to
+PROFILE_PATH = os.getenv("PROFILE_PATH", "./profiles")
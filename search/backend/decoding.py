@@ -0,0 +1,27 @@
+"""
+Work done in the decoder processes of the ingestion pipeline. The pool spawns
+its workers, which import this module to unpickle the task. It only imports
+preprocessing, PIL and NumPy, so the workers never import torch or the model
+code, or start the inference threads of utils.
+"""
+
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from preprocessing import load_image, preprocess_images
+
+
+def decode_images(image_paths: List[Path]) -> Tuple[np.ndarray, float]:
+    """Decodes and preprocesses a batch of images.
+
+    Args:
+        image_paths (List[Path]): images to be decoded
+
+    Returns:
+        Tuple[np.ndarray, float]: the pixel values and the seconds it took
+    """
+    start = time.perf_counter()
+    pixel_values = preprocess_images([load_image(path) for path in image_paths])
+    return pixel_values, time.perf_counter() - start
@@ -0,0 +1,350 @@
+"""
+On-disk store of the CLIP embeddings of every frame, kept independently of the
+vector store. Rebuilding the "scenes" and "captions" collections (or any other
+index) from it is a bulk load that does not run the model.
+
+Layout of a store, one directory per model, backend and precision (see
+`embedding_id`):
+
+|- <path>/
+|   |- <embedding id>/
+|   |   |- meta.json        model, dimension and dtype of the vectors
+|   |   |- index.sqlite     point id -> row, movie, image, caption, content hash
+|   |   |- scenes.bin       one row of `dim` values per frame
+|   |   |- captions.bin
+
+Usage:
+    python embedding_store.py embed    # embed the frames of IMAGE_DATA_PATH
+    python embedding_store.py load     # bulk load the store into Qdrant
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+from config import (
+    EMBEDDING_STORE_DTYPE,
+    EMBEDDING_STORE_PATH,
+    IMAGE_DATA_PATH,
+    QDRANT_HOST,
+    QDRANT_PORT,
+)
+from image_ingestion import (
+    Frame,
+    build_payload,
+    create_collections,
+    embed_frames,
+    iter_frames,
+)
+from ingestion_manifest import IngestionManifest, embedding_id
+from qdrant_client import QdrantClient
+from utils import content_hash, generate_id
+
+COLLECTIONS = ["scenes", "captions"]
+
+
+class StoredFrame(NamedTuple):
+    """A row of the store's id index."""
+
+    point_id: str
+    movie_id: str
+    image_id: str
+    caption: str
+    content_hash: str
+    row: int
+
+
+class EmbeddingStore:
+    """Memory-mapped matrices of the frame embeddings of one model, backend and
+    precision. New frames are appended, re-embedded frames overwrite their row.
+
+    Args:
+        path (str): root directory of the store
+        model_id (str): what the embeddings are computed with, see `embedding_id`
+        dim (int): dimension of the embeddings
+        dtype (str): "float32" or "float16"
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_STORE_PATH,
+        model_id: str = embedding_id(),
+        dim: int = 512,
+        dtype: str = EMBEDDING_STORE_DTYPE,
+    ):
+        self.model_id = model_id
+        self.dir_path = Path(path) / model_id.replace("/", "__")
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.dir_path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != dim or meta["model"] != model_id:
+                raise ValueError(f"{self.dir_path} holds embeddings of {meta}")
+            dtype = meta["dtype"]
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"model": model_id, "dim": dim, "dtype": dtype}, f)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._db = sqlite3.connect(
+            self.dir_path / "index.sqlite", check_same_thread=False
+        )
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS frames (
+                point_id TEXT PRIMARY KEY,
+                movie_id TEXT NOT NULL,
+                image_id TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                row INTEGER NOT NULL
+            );
+            -- Rows of removed frames, which new frames are written to first
+            CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY);
+            """
+        )
+        self._rows = self._repair()
+
+    def _matrix_path(self, collection_name: str) -> Path:
+        return self.dir_path / f"{collection_name}.bin"
+
+    def _repair(self) -> int:
+        """Drops rows that were only partially written by an interrupted `add`."""
+        row_bytes = self.dim * self.dtype.itemsize
+        rows = min(
+            self._matrix_path(name).stat().st_size // row_bytes
+            if self._matrix_path(name).exists()
+            else 0
+            for name in COLLECTIONS
+        )
+        for name in COLLECTIONS:
+            with open(self._matrix_path(name), "ab") as f:
+                f.truncate(rows * row_bytes)
+        with self._db:
+            self._db.execute("DELETE FROM frames WHERE row >= ?", (rows,))
+            self._db.execute("DELETE FROM free_rows WHERE row >= ?", (rows,))
+        return rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+
+    def lookup(self, frames: List[Frame]) -> List[int]:
+        """Finds the rows of the frames whose embeddings are stored for the same
+            content hash.
+
+        Returns:
+            List[int]: the row of each frame, or -1 where it has to be embedded
+        """
+        with self._lock:
+            rows = []
+            for frame in frames:
+                found = self._db.execute(
+                    "SELECT row FROM frames WHERE point_id = ? AND content_hash = ?",
+                    (generate_id(frame.image_id, frame.movie_id), frame.content_hash),
+                ).fetchone()
+                rows.append(found[0] if found and frame.content_hash else -1)
+            return rows
+
+    def add(
+        self,
+        frames: List[Frame],
+        image_embeddings: np.ndarray,
+        text_embeddings: np.ndarray,
+    ):
+        """Stores the embeddings of the frames. A frame that is already stored
+        is overwritten in its row, and new frames take the rows of removed ones
+        before they are appended, so re-embedding doesn't grow the store. Safe
+        to call from several threads."""
+        with self._lock:
+            point_ids = [generate_id(f.image_id, f.movie_id) for f in frames]
+            free = [row for (row,) in self._db.execute("SELECT row FROM free_rows")]
+            rows, overwritten, reused, appended = {}, [], [], 0
+            for point_id in point_ids:
+                if point_id in rows:
+                    continue
+                found = self._db.execute(
+                    "SELECT row FROM frames WHERE point_id = ?", (point_id,)
+                ).fetchone()
+                if found:
+                    rows[point_id] = found[0]
+                    overwritten.append((point_id,))
+                elif free:
+                    rows[point_id] = free.pop()
+                    reused.append((rows[point_id],))
+                else:
+                    rows[point_id] = self._rows + appended
+                    appended += 1
+
+            # Until the new hashes are written, no lookup returns a row that is
+            # being overwritten
+            with self._db:
+                self._db.executemany(
+                    "UPDATE frames SET content_hash = '' WHERE point_id = ?",
+                    overwritten,
+                )
+            row_bytes = self.dim * self.dtype.itemsize
+            for name, embeddings in zip(
+                COLLECTIONS, [image_embeddings, text_embeddings]
+            ):
+                embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+                with open(self._matrix_path(name), "r+b") as f:
+                    for point_id, embedding in zip(point_ids, embeddings):
+                        f.seek(rows[point_id] * row_bytes)
+                        f.write(embedding.tobytes())
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            point_id,
+                            frame.movie_id,
+                            frame.image_id,
+                            frame.caption,
+                            frame.content_hash,
+                            rows[point_id],
+                        )
+                        for point_id, frame in zip(point_ids, frames)
+                    ],
+                )
+                self._db.executemany("DELETE FROM free_rows WHERE row = ?", reused)
+            self._rows += appended
+
+    def remove(self, movie_id: str, image_ids: List[str]):
+        """Forgets the frames, e.g. once their files are gone, so that they are
+        neither looked up nor searched. Their rows are reused by `add`."""
+        point_ids = [(generate_id(image_id, movie_id),) for image_id in image_ids]
+        with self._lock, self._db:
+            self._db.executemany(
+                """INSERT OR IGNORE INTO free_rows
+                SELECT row FROM frames WHERE point_id = ?""",
+                point_ids,
+            )
+            self._db.executemany("DELETE FROM frames WHERE point_id = ?", point_ids)
+
+    def matrix(self, collection_name: str) -> np.ndarray:
+        """Returns a read-only memory map of all the rows of a collection."""
+        with self._lock:
+            matrix = self._maps.get(collection_name)
+            if matrix is None or len(matrix) != self._rows:
+                if self._rows == 0:
+                    return np.zeros((0, self.dim), dtype=self.dtype)
+                matrix = np.memmap(
+                    self._matrix_path(collection_name),
+                    dtype=self.dtype,
+                    mode="r",
+                    shape=(self._rows, self.dim),
+                )
+                self._maps[collection_name] = matrix
+            return matrix
+
+    def get(self, collection_name: str, rows: List[int]) -> np.ndarray:
+        """Returns the embeddings at `rows` as float32."""
+        return np.asarray(self.matrix(collection_name)[rows], dtype=np.float32)
+
+    def frames(self) -> List[StoredFrame]:
+        """Returns the index entries of every stored frame, ordered by row."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM frames ORDER BY row").fetchall()
+        return [StoredFrame(*row) for row in rows]
+
+    def iter_batches(
+        self, batch_size: int
+    ) -> Iterator[Tuple[List[StoredFrame], np.ndarray, np.ndarray]]:
+        """Yields the stored frames with their scene and caption embeddings."""
+        frames = self.frames()
+        for start in range(0, len(frames), batch_size):
+            batch = frames[start : start + batch_size]
+            rows = [frame.row for frame in batch]
+            yield batch, self.get("scenes", rows), self.get("captions", rows)
+
+
+def load_into_qdrant(
+    store: EmbeddingStore, client: QdrantClient, movie_info: dict, batch_size=1024
+) -> List[StoredFrame]:
+    """Recreates the "scenes" and "captions" collections from the store without
+        running the model.
+
+    Args:
+        store (EmbeddingStore): embeddings to be loaded
+        client (QdrantClient): connection to the vector store
+        movie_info (dict): Metadata on the movies
+        batch_size (int): points per upload request
+
+    Returns:
+        List[StoredFrame]: the frames loaded into each collection. Frames of
+            movies missing from `movie_info` are left out.
+    """
+    create_collections(client)
+    loaded = []
+    for frames, scene_embeddings, caption_embeddings in store.iter_batches(batch_size):
+        keep = [i for i, frame in enumerate(frames) if frame.movie_id in movie_info]
+        frames = [frames[i] for i in keep]
+        ids = [frame.point_id for frame in frames]
+        payloads = [
+            build_payload(frame.movie_id, frame.image_id, frame.caption, movie_info)
+            for frame in frames
+        ]
+        for name, embeddings in zip(
+            COLLECTIONS, [scene_embeddings[keep], caption_embeddings[keep]]
+        ):
+            client.upload_collection(
+                name, vectors=embeddings, payload=payloads, ids=ids, batch_size=256
+            )
+        loaded.extend(frames)
+    return loaded
+
+
+def embed_image_data(store: EmbeddingStore, image_data_path: Path) -> int:
+    """Embeds every frame under `image_data_path` that is not in the store yet.
+
+    Returns:
+        int: the number of frames that were embedded
+    """
+    count = 0
+    for dir_path in sorted(path for path in image_data_path.iterdir() if path.is_dir()):
+        frames = [
+            frame._replace(content_hash=content_hash(frame.image_path, frame.caption))
+            for frame in iter_frames(dir_path)
+        ]
+        missing = [frame for frame, row in zip(frames, store.lookup(frames)) if row < 0]
+        if missing:
+            print(f"Embedding {len(missing)} frames of {dir_path.name}")
+            embed_frames(missing, store)
+            count += len(missing)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["embed", "load"])
+    parser.add_argument("--image-data", default=IMAGE_DATA_PATH)
+    parser.add_argument("--store", default=EMBEDDING_STORE_PATH)
+    parser.add_argument("--host", default=QDRANT_HOST)
+    parser.add_argument("--port", type=int, default=QDRANT_PORT)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    if args.command == "embed":
+        count = embed_image_data(store, Path(args.image_data))
+        print(f"Embedded {count} frames, {len(store)} frames are stored")
+    else:
+        with open(Path(args.image_data) / "results.json") as f:
+            results = json.load(f)
+        client = QdrantClient(args.host, port=args.port)
+        loaded = load_into_qdrant(store, client, results)
+        print(f"Loaded {len(loaded)} points into each collection")
+
+        # The collections now hold exactly the loaded frames
+        manifest = IngestionManifest(model_id=store.model_id)
+        manifest.clear()
+        manifest.record_frames(loaded)
@@ -0,0 +1,444 @@
+"""
+Interchangeable runtimes for the CLIP image and text towers. Every backend takes
+preprocessed pixels or token ids as NumPy arrays and returns the unnormalized
+projected features as float32 NumPy arrays:
+
+    torch        eager PyTorch, straight from the Hugging Face checkpoint
+    torchscript  traced and frozen image and text graphs
+    onnx         image and text graphs run by ONNX Runtime (optional dependency)
+
+The torchscript and onnx graphs are exported ahead of time, one directory per
+model and backend:
+
+|- <ENCODER_PATH>/
+|   |- <model name>/
+|   |   |- <backend>/
+|   |   |   |- image.pt / image.onnx
+|   |   |   |- text.pt / text.onnx
+|   |   |   |- meta.json
+
+Usage:
+    python encoders.py export --backend onnx    # export and compare with torch
+    python encoders.py verify --backend onnx    # compare an existing export
+"""
+
+import argparse
+import copy
+import inspect
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+from config import (
+    ENCODER_BACKEND,
+    ENCODER_PATH,
+    ENCODER_PRECISION,
+    ENCODER_THREADS,
+    MODEL_NAME,
+)
+from transformers import AutoModel, AutoTokenizer
+
+BACKENDS = ["torch", "torchscript", "onnx"]
+
+# Weights and activations of the towers. int8 quantizes the weights of every
+# linear layer and the activations dynamically, bfloat16 runs the whole model
+# in bf16 where the CPU supports it natively.
+PRECISIONS = ["float32", "int8", "bfloat16"]
+
+# Largest difference from float32 torch that `export` accepts per precision
+TOLERANCES = {"float32": 1e-4, "int8": 5e-2, "bfloat16": 2e-2}
+
+# Captions that the exported text graphs are traced with, and the differently
+# sized batch of captions that they are verified with
+TRACE_TEXTS = ["two people talking", "a car chase"]
+VERIFY_TEXTS = [
+    "a man in a suit walks down a dark street at night in the rain",
+    "a car chase",
+    "a woman",
+]
+
+
+class Encoder:
+    """Runs the image and text towers of a CLIP model.
+
+    Args:
+        projection_dim (int): dimension of the embeddings
+        precision (str): precision the encoder actually runs at, see PRECISIONS
+    """
+
+    name = None
+
+    def __init__(self, projection_dim: int, precision: str = "float32"):
+        self.projection_dim = projection_dim
+        self.precision = precision
+
+    def encode_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        """Embeds a batch of preprocessed images of shape (N, 3, H, W)."""
+        raise NotImplementedError
+
+    def encode_texts(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray
+    ) -> np.ndarray:
+        """Embeds a batch of tokenized, padded captions of shape (N, L)."""
+        raise NotImplementedError
+
+
+class TorchEncoder(Encoder):
+    """Eager PyTorch on the Hugging Face model."""
+
+    name = "torch"
+
+    def __init__(self, model, precision: str = "float32"):
+        super().__init__(model.config.projection_dim, precision)
+        self.model = model.eval()
+        self.dtype = model.dtype
+
+    def encode_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            features = self.model.get_image_features(
+                pixel_values=torch.from_numpy(pixel_values).to(self.dtype)
+            )
+        return features.float().numpy()
+
+    def encode_texts(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray
+    ) -> np.ndarray:
+        with torch.inference_mode():
+            features = self.model.get_text_features(
+                input_ids=torch.from_numpy(input_ids),
+                attention_mask=torch.from_numpy(attention_mask),
+            )
+        return features.float().numpy()
+
+
+class TorchScriptEncoder(Encoder):
+    """Frozen TorchScript graphs of the two towers."""
+
+    name = "torchscript"
+
+    def __init__(
+        self, dir_path: Path, projection_dim: int, dtype: torch.dtype = torch.float32
+    ):
+        super().__init__(projection_dim)
+        self.image = torch.jit.load(str(dir_path / "image.pt"))
+        self.text = torch.jit.load(str(dir_path / "text.pt"))
+        self.dtype = dtype
+
+    def encode_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        pixel_values = torch.from_numpy(pixel_values).to(self.dtype)
+        with torch.inference_mode():
+            return self.image(pixel_values).float().numpy()
+
+    def encode_texts(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray
+    ) -> np.ndarray:
+        with torch.inference_mode():
+            features = self.text(
+                torch.from_numpy(input_ids), torch.from_numpy(attention_mask)
+            )
+        return features.float().numpy()
+
+
+class OnnxEncoder(Encoder):
+    """ONNX Runtime sessions of the two towers on the CPU."""
+
+    name = "onnx"
+
+    def __init__(self, dir_path: Path, projection_dim: int, threads: int = 0):
+        super().__init__(projection_dim)
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                "The onnx encoder backend needs onnxruntime: pip install onnxruntime"
+            )
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.image = onnxruntime.InferenceSession(
+            str(dir_path / "image.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.text = onnxruntime.InferenceSession(
+            str(dir_path / "text.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+
+    def encode_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.image.run(None, {"pixel_values": pixel_values})[0]
+
+    def encode_texts(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray
+    ) -> np.ndarray:
+        return self.text.run(
+            None,
+            {
+                "input_ids": input_ids.astype(np.int64, copy=False),
+                "attention_mask": attention_mask.astype(np.int64, copy=False),
+            },
+        )[0]
+
+
+# ============================= PRECISION =============================
+
+
+def bfloat16_supported() -> bool:
+    """Whether the CPU has native bf16 instructions (AVX512-BF16 or AMX).
+    Without them bf16 is emulated and slower than float32."""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def effective_precision(precision: str) -> str:
+    """The precision that `apply_precision` actually converts to on this CPU."""
+    if precision == "bfloat16" and not bfloat16_supported():
+        return "float32"
+    return precision
+
+
+def apply_precision(model, precision: str):
+    """Returns the model converted to `precision`, see PRECISIONS. Without native
+    bf16 support the model stays float32, see `effective_precision`."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}")
+    if effective_precision(precision) != precision:
+        print("This CPU has no native bf16 support, keeping float32")
+        return model
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    if precision == "bfloat16":
+        return model.to(torch.bfloat16)
+    return model
+
+
+# ============================= EXPORT =============================
+
+
+# Newer versions of torch default to the dynamo exporter, which needs
+# onnxscript. The TorchScript based exporter handles both towers.
+EXPORT_OPTIONS = (
+    {"dynamo": False}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters
+    else {}
+)
+
+
+class ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(
+            input_ids=input_ids, attention_mask=attention_mask
+        )
+
+
+def export_dir(
+    backend: str,
+    precision: str = "float32",
+    model_name: str = MODEL_NAME,
+    path: str = ENCODER_PATH,
+) -> Path:
+    name = backend if precision == "float32" else f"{backend}-{precision}"
+    return Path(path) / model_name.replace("/", "__") / name
+
+
+def sample_inputs(model, tokenizer, texts: list):
+    """Random pixels and the tokens of `texts`, one image per text."""
+    image_size = model.config.vision_config.image_size
+    generator = torch.Generator().manual_seed(0)
+    pixel_values = torch.randn(
+        len(texts), 3, image_size, image_size, generator=generator
+    )
+    tokens = tokenizer(texts, padding=True, truncation=True, return_tensors="pt")
+    return pixel_values, tokens["input_ids"], tokens["attention_mask"]
+
+
+def export(model, tokenizer, backend: str, dir_path: Path, precision: str = "float32"):
+    """Exports the image and text towers of `model` for `backend`. ONNX graphs
+    are quantized with ONNX Runtime's own dynamic quantization, and have no bf16
+    variant."""
+    if backend == "onnx" and precision == "bfloat16":
+        raise ValueError("The onnx backend supports float32 and int8")
+    model = model.eval()
+    if backend == "torchscript":
+        # Converting to bf16 happens in place, keep the caller's model float32
+        model = apply_precision(copy.deepcopy(model), precision)
+    dir_path.mkdir(parents=True, exist_ok=True)
+    pixel_values, input_ids, attention_mask = sample_inputs(
+        model, tokenizer, TRACE_TEXTS
+    )
+    pixel_values = pixel_values.to(model.dtype)
+    image_tower, text_tower = ImageTower(model).eval(), TextTower(model).eval()
+
+    if backend == "torchscript":
+        with torch.no_grad():
+            image = torch.jit.freeze(torch.jit.trace(image_tower, (pixel_values,)))
+            text = torch.jit.freeze(
+                torch.jit.trace(text_tower, (input_ids, attention_mask))
+            )
+        image.save(str(dir_path / "image.pt"))
+        text.save(str(dir_path / "text.pt"))
+    elif backend == "onnx":
+        with torch.no_grad():
+            torch.onnx.export(
+                image_tower,
+                (pixel_values,),
+                str(dir_path / "image.onnx"),
+                input_names=["pixel_values"],
+                output_names=["image_embeds"],
+                dynamic_axes={
+                    "pixel_values": {0: "batch"},
+                    "image_embeds": {0: "batch"},
+                },
+                opset_version=17,
+                **EXPORT_OPTIONS,
+            )
+            torch.onnx.export(
+                text_tower,
+                (input_ids, attention_mask),
+                str(dir_path / "text.onnx"),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["text_embeds"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "text_embeds": {0: "batch"},
+                },
+                opset_version=17,
+                **EXPORT_OPTIONS,
+            )
+        if precision == "int8":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            for name in ["image", "text"]:
+                float_path = dir_path / f"{name}.onnx"
+                quantized_path = dir_path / f"{name}.int8.onnx"
+                quantize_dynamic(
+                    float_path, quantized_path, weight_type=QuantType.QInt8
+                )
+                quantized_path.replace(float_path)
+    else:
+        raise ValueError(f"Cannot export the {backend} backend")
+
+    with open(dir_path / "meta.json", "w") as f:
+        json.dump(
+            {
+                "model": model.name_or_path,
+                "backend": backend,
+                "precision": (
+                    effective_precision(precision)
+                    if backend == "torchscript"
+                    else precision
+                ),
+                "dtype": str(model.dtype).removeprefix("torch."),
+                "projection_dim": model.config.projection_dim,
+            },
+            f,
+        )
+
+
+def verify(model, tokenizer, encoder: Encoder) -> dict:
+    """Compares the normalized embeddings of `encoder` with eager torch on
+    inputs of a different batch size and sequence length than the traced ones.
+
+    Returns:
+        dict: the largest absolute difference of the image and text embeddings
+    """
+    reference = TorchEncoder(model)
+    pixel_values, input_ids, attention_mask = sample_inputs(
+        model, tokenizer, VERIFY_TEXTS
+    )
+    inputs = {
+        "image": (pixel_values.numpy(),),
+        "text": (input_ids.numpy(), attention_mask.numpy()),
+    }
+
+    def normalized(embeddings):
+        return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+    differences = {}
+    for name, args in inputs.items():
+        method = "encode_images" if name == "image" else "encode_texts"
+        expected = normalized(getattr(reference, method)(*args))
+        found = normalized(getattr(encoder, method)(*args))
+        differences[name] = float(np.abs(expected - found).max())
+    return differences
+
+
+def load_encoder(
+    backend: str = ENCODER_BACKEND,
+    precision: str = ENCODER_PRECISION,
+    model_name: str = MODEL_NAME,
+    path: str = ENCODER_PATH,
+    threads: int = ENCODER_THREADS,
+) -> Encoder:
+    """Loads the encoder of `model_name` for a backend and precision. The
+    torchscript and onnx backends need an export made by
+    `python encoders.py export`."""
+    if backend == "torch":
+        model = AutoModel.from_pretrained(model_name).eval()
+        return TorchEncoder(
+            apply_precision(model, precision), effective_precision(precision)
+        )
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend}")
+
+    dir_path = export_dir(backend, precision, model_name, path)
+    if not (dir_path / "meta.json").exists():
+        raise FileNotFoundError(
+            f"No {backend} {precision} export in {dir_path}, run: python "
+            f"encoders.py export --backend {backend} --precision {precision}"
+        )
+    with open(dir_path / "meta.json") as f:
+        meta = json.load(f)
+    if backend == "torchscript":
+        if threads:
+            torch.set_num_threads(threads)
+        encoder = TorchScriptEncoder(
+            dir_path, meta["projection_dim"], getattr(torch, meta["dtype"])
+        )
+    else:
+        encoder = OnnxEncoder(dir_path, meta["projection_dim"], threads)
+    encoder.precision = meta["precision"]
+    return encoder
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["export", "verify"])
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--path", default=ENCODER_PATH)
+    parser.add_argument("--tolerance", type=float)
+    args = parser.parse_args()
+
+    model = AutoModel.from_pretrained(args.model).eval()
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if args.command == "export":
+        dir_path = export_dir(args.backend, args.precision, args.model, args.path)
+        export(model, tokenizer, args.backend, dir_path, args.precision)
+        print(f"Exported the {args.backend} {args.precision} encoder to {dir_path}")
+
+    encoder = load_encoder(args.backend, args.precision, args.model, args.path)
+    differences = verify(model, tokenizer, encoder)
+    print(f"Largest difference from float32 torch: {differences}")
+    tolerance = args.tolerance or TOLERANCES[args.precision]
+    if max(differences.values()) > tolerance:
+        raise SystemExit(f"The {args.backend} encoder is off by more than {tolerance}")
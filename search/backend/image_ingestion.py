@@ -1,12 +1,199 @@
 import json
 from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
 
-from PIL import Image
+import numpy as np
+from config import (
+    BATCH_SIZE,
+    PAYLOAD_MODE,
+    QDRANT_QUANTIZATION,
+    QDRANT_VECTORS_ON_DISK,
+)
+from metrics import INGESTED_POINTS, STAGE_SECONDS
+from preprocessing import load_image
 from qdrant_client import QdrantClient, models
-from utils import generate_id, get_image_embedding, get_text_embedding
+from thumbnails import thumbnail_url
+from utils import (
+    content_hash,
+    generate_id,
+    get_image_embeddings,
+    get_text_embeddings,
+)
 
+# Payload fields of full payloads that the search filters match on. The year is
+# stored as the string in results.json, so it gets a keyword index like the rest.
+PAYLOAD_INDEXES = ["movie_id", "title", "director", "actor", "genre", "year"]
 
-def ingest_dir(dir_path: Path, client: QdrantClient, movie_info: dict):
+
+class Frame(NamedTuple):
+    """A single movie frame that is to be ingested."""
+
+    movie_id: str
+    image_id: str
+    image_path: Path
+    caption: str
+    content_hash: str = ""
+
+
+def iter_frames(dir_path: Path) -> Iterator[Frame]:
+    """Lists the frames of a movie directory along with their captions.
+
+    Args:
+        dir_path (Path): path to the directory where the movie images are located.
+
+    Yields:
+        Frame: every *.jpg in the directory
+    """
+    with open(dir_path / "captions.json") as f:
+        captions = json.load(f)
+
+    movie_id = dir_path.name
+    for image_path in sorted(dir_path.glob("*.jpg")):
+        yield Frame(movie_id, image_path.name, image_path, captions[image_path.name])
+
+
+def build_payload(
+    movie_id: str,
+    image_id: str,
+    caption: str,
+    movie_info: dict,
+    payload_mode: str = PAYLOAD_MODE,
+) -> dict:
+    """Builds the payload that is stored with a frame's point in both collections.
+
+    Args:
+        movie_id (str): IMDb id of the movie
+        image_id (str): file name of the frame
+        caption (str): caption of the frame
+        movie_info (dict): Metadata on the movie
+        payload_mode (str): "full" or "compact", see PAYLOAD_MODE
+
+    Returns:
+        dict: the payload
+    """
+    if payload_mode == "compact":
+        return {"movie_id": movie_id, "image_id": image_id, "caption": caption}
+    return {
+        "movie_id": movie_id,
+        "image_id": image_id,
+        "title": movie_info[movie_id]["Title"],
+        "director": movie_info[movie_id]["Director"],
+        "actor": movie_info[movie_id]["Actors"],
+        "genre": movie_info[movie_id]["Genre"],
+        "year": movie_info[movie_id]["Year"],
+        "caption": caption,
+        "image_path": thumbnail_url(movie_id, image_id),
+    }
+
+
+def quantization_config(quantization: str) -> Optional[models.QuantizationConfig]:
+    """Maps the QDRANT_QUANTIZATION setting to Qdrant's quantization config."""
+    if quantization == "none":
+        return None
+    if quantization == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+    raise ValueError(f"Unknown quantization {quantization}")
+
+
+def create_payload_indexes(
+    client: QdrantClient,
+    collection_names: Tuple[str, ...] = ("scenes", "captions"),
+    payload_mode: str = PAYLOAD_MODE,
+):
+    """Indexes the payload fields that the search filters match on, so filtered
+        searches don't have to scan the payloads. Indexes that already exist are
+        left as they are.
+
+    Args:
+        client (QdrantClient): connection to the vector store
+        collection_names (Tuple[str, ...]): collections to be indexed
+        payload_mode (str): "full" or "compact", see PAYLOAD_MODE
+    """
+    fields = PAYLOAD_INDEXES if payload_mode == "full" else ["movie_id"]
+    for collection_name in collection_names:
+        for field in fields:
+            client.create_payload_index(
+                collection_name,
+                field_name=field,
+                field_schema=models.PayloadSchemaType.KEYWORD,
+            )
+
+
+def create_collections(
+    client: QdrantClient,
+    collection_names: Tuple[str, ...] = ("scenes", "captions"),
+    quantization: str = QDRANT_QUANTIZATION,
+    on_disk: bool = QDRANT_VECTORS_ON_DISK,
+    payload_indexes: bool = True,
+):
+    """(Re)creates the "scenes" and "captions" collections. Any existing points
+        in them are deleted.
+
+    Args:
+        client (QdrantClient): connection to the vector store
+        collection_names (Tuple[str, ...]): collections to be created
+        quantization (str): "none" or "int8"
+        on_disk (bool): keep the original vectors on disk
+        payload_indexes (bool): index the payload fields that are filtered on
+    """
+    for collection_name in collection_names:
+        client.recreate_collection(
+            collection_name=collection_name,
+            vectors_config=models.VectorParams(
+                size=512, distance=models.Distance.COSINE, on_disk=on_disk
+            ),
+            quantization_config=quantization_config(quantization),
+        )
+    if payload_indexes:
+        create_payload_indexes(client, collection_names)
+
+
+def embed_frames(frames: List[Frame], store=None) -> Tuple[np.ndarray, np.ndarray]:
+    """Embeds the images and captions of the frames. When an embedding store is
+        given, frames stored with the same content hash are read from it instead
+        of being embedded, and the newly computed embeddings are added to it.
+
+    Args:
+        frames (List[Frame]): frames to be embedded
+        store (EmbeddingStore): optional store of precomputed embeddings
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the image and the text embeddings
+    """
+    rows = store.lookup(frames) if store is not None else [-1] * len(frames)
+    missing = [i for i, row in enumerate(rows) if row < 0]
+    # Decode a batch at a time, so that only BATCH_SIZE decoded frames are alive
+    # at once and no file is left open
+    image_embeddings = [get_image_embeddings([])]
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start : start + BATCH_SIZE]
+        image_embeddings.append(
+            get_image_embeddings([load_image(frames[i].image_path) for i in batch])
+        )
+    image_embeddings = np.concatenate(image_embeddings)
+    text_embeddings = get_text_embeddings([frames[i].caption for i in missing])
+    if store is None:
+        return image_embeddings, text_embeddings
+
+    store.add([frames[i] for i in missing], image_embeddings, text_embeddings)
+    found = [i for i, row in enumerate(rows) if row >= 0]
+    found_rows = [rows[i] for i in found]
+    all_image_embeddings = np.empty(
+        (len(frames), image_embeddings.shape[1]), np.float32
+    )
+    all_text_embeddings = np.empty((len(frames), text_embeddings.shape[1]), np.float32)
+    all_image_embeddings[missing] = image_embeddings
+    all_text_embeddings[missing] = text_embeddings
+    all_image_embeddings[found] = store.get("scenes", found_rows)
+    all_text_embeddings[found] = store.get("captions", found_rows)
+    return all_image_embeddings, all_text_embeddings
+
+
+def ingest_dir(dir_path: Path, client: QdrantClient, movie_info: dict, store=None):
     """Given the movie directory path, ingests all the images and their respective
         captions into the "scenes" and "captions" collection of the provided.
 
@@ -14,57 +201,46 @@ def ingest_dir(dir_path: Path, client: QdrantClient, movie_info: dict):
         dir_path (c): path to the directory where the movie images are located.
         client (QdrantClient): connection to the vector store
         movie_info (dict): Metadata on the movie
+        store (EmbeddingStore): optional store that the embeddings are read from
+            and written to
     """
 
     print("Processing ", dir_path)
-    with open(dir_path / "captions.json") as f:
-        captions = json.load(f)
+    frames = list(iter_frames(dir_path))
+    if store is not None:
+        frames = [
+            frame._replace(content_hash=content_hash(frame.image_path, frame.caption))
+            for frame in frames
+        ]
+    with STAGE_SECONDS.time(stage="ingest_encode"):
+        image_embeddings, text_embeddings = embed_frames(frames, store)
 
-    movie_id = dir_path.name
     scene_points = []
     caption_points = []
-    count = 0
-    for image_path in dir_path.glob("*.jpg"):
-        image = Image.open(image_path)
-        image_embedding = get_image_embedding(image)[0].tolist()
-        text_embedding = get_text_embedding(captions[image_path.name])[0].tolist()
-
+    for frame, image_embedding, text_embedding in zip(
+        frames, image_embeddings.tolist(), text_embeddings.tolist()
+    ):
         # We assume that the collection is already created with the correct config
+        payload = build_payload(
+            frame.movie_id, frame.image_id, frame.caption, movie_info
+        )
         scene_points.append(
             models.PointStruct(
-                id=generate_id(image_path.name, movie_id),
+                id=generate_id(frame.image_id, frame.movie_id),
                 vector=image_embedding,
-                payload={
-                    "movie_id": movie_id,
-                    "image_id": image_path.name,
-                    "title": movie_info[movie_id]["Title"],
-                    "director": movie_info[movie_id]["Director"],
-                    "actor": movie_info[movie_id]["Actors"],
-                    "genre": movie_info[movie_id]["Genre"],
-                    "year": movie_info[movie_id]["Year"],
-                    "caption": captions[image_path.name],
-                    "image_path": f"/images/{movie_id}/{image_path.name}",
-                },
+                payload=payload,
             )
         )
         caption_points.append(
             models.PointStruct(
-                id=generate_id(image_path.name, movie_id),
+                id=generate_id(frame.image_id, frame.movie_id),
                 vector=text_embedding,
-                payload={
-                    "movie_id": movie_id,
-                    "image_id": image_path.name,
-                    "title": movie_info[movie_id]["Title"],
-                    "director": movie_info[movie_id]["Director"],
-                    "actor": movie_info[movie_id]["Actors"],
-                    "genre": movie_info[movie_id]["Genre"],
-                    "year": movie_info[movie_id]["Year"],
-                    "caption": captions[image_path.name],
-                    "image_path": f"/images/{movie_id}/{image_path.name}",
-                },
+                payload=payload,
             )
         )
-        count += 1
 
-    client.upload_points("scenes", scene_points)
-    client.upload_points("captions", caption_points)
+    with STAGE_SECONDS.time(stage="ingest_upload"):
+        client.upload_points("scenes", scene_points)
+        client.upload_points("captions", caption_points)
+    INGESTED_POINTS.inc(len(scene_points), collection="scenes")
+    INGESTED_POINTS.inc(len(caption_points), collection="captions")
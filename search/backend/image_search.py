@@ -1,20 +1,137 @@
-from typing import List
+import asyncio
+from typing import List, Optional, Tuple
 
+import numpy as np
+from config import (
+    EXACT_SEARCH_MAX_FRAMES,
+    HYBRID_CAPTION_WEIGHT,
+    HYBRID_FUSION,
+    HYBRID_RRF_K,
+    PAYLOAD_MODE,
+    QDRANT_QUANTIZATION,
+    SEARCH_K,
+    SEARCH_OVERSAMPLING,
+    SEARCH_RESCORE,
+)
+from metrics import STAGE_SECONDS
+from movie_table import FILTER_FIELDS, MovieTable
 from PIL import Image
-from qdrant_client import QdrantClient, models
-from utils import get_image_embedding, get_text_embedding
+from qdrant_client import AsyncQdrantClient, models
+from query_cache import EmbeddingCache
+from utils import (
+    get_image_embeddings,
+    get_text_embeddings,
+    image_batcher,
+    inference_executor,
+    text_batcher,
+)
 
+# Embeddings of recent query texts
+text_embedding_cache = EmbeddingCache()
 
-def search_text_in_db(text: str, client: QdrantClient, **kwargs) -> List[dict]:
-    """Semantically searches the vector store's "captions" collection for images
-        whose captions match the parameter `text`
+# Payload fields that compact results are joined with the movie table on
+JOIN_FIELDS = ["movie_id", "image_id"]
+
+
+def search_params(**kwargs) -> Optional[models.SearchParams]:
+    """Search parameters for collections with quantized vectors.
 
     Args:
-        text (str): caption to be searched for.
-        client (QdrantClient): vector store
+        rescore (bool): rescore the candidates with the original vectors
+        oversampling (float): candidates fetched per result for rescoring
+        exact (bool): skip the index and quantization altogether
 
     Returns:
-        List[dict]: the closest points
+        models.SearchParams: None when the defaults apply
+    """
+    if kwargs.get("exact"):
+        return models.SearchParams(exact=True)
+    if QDRANT_QUANTIZATION == "none":
+        return None
+    rescore = kwargs.get("rescore")
+    rescore = SEARCH_RESCORE if rescore is None else rescore
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            rescore=rescore,
+            oversampling=kwargs.get("oversampling") or SEARCH_OVERSAMPLING,
+        )
+    )
+
+
+def payload_selector(fields: Optional[List[str]] = None):
+    """What `with_payload` asks the vector store for: the whole payload, or only
+    `fields`. Compact payloads also need the fields they are joined on.
+
+    Args:
+        fields (List[str]): payload fields to return, None for all of them
+
+    Returns:
+        Union[bool, List[str]]: True, or the fields to include
+    """
+    if fields is None:
+        return True
+    if PAYLOAD_MODE == "compact":
+        return sorted(set(fields) | set(JOIN_FIELDS))
+    return list(fields)
+
+
+def to_result(point: models.ScoredPoint) -> dict:
+    """The id, score and payload of a point. Unlike `model_dump` this doesn't
+    copy the payload or carry the version, vector, shard key and order value."""
+    return {"id": point.id, "score": point.score, "payload": point.payload}
+
+
+async def embed_query_text(text: str) -> np.ndarray:
+    """Embeds a query text without blocking the event loop. Cached queries skip
+    the model, the rest are batched with concurrent queries."""
+    with STAGE_SECONDS.time(stage="embed_query"):
+        embedding = text_embedding_cache.get(text)
+        if embedding is None:
+            future = text_batcher.submit(EmbeddingCache.normalize(text))
+            embedding = await asyncio.wrap_future(future)
+            text_embedding_cache.put(text, embedding)
+    return embedding
+
+
+async def embed_query_image(image: Image.Image) -> np.ndarray:
+    """Embeds a query image without blocking the event loop. The image is
+    decoded and preprocessed on the inference threads."""
+    with STAGE_SECONDS.time(stage="embed_query"):
+        return await asyncio.wrap_future(image_batcher.submit(image))
+
+
+async def embed_query_texts(texts: List[str]) -> np.ndarray:
+    """Embeds many query texts at once. The ones that are not cached are
+    encoded together in a single batched call on the inference threads."""
+    embeddings = [text_embedding_cache.get(text) for text in texts]
+    missing = sorted(
+        {
+            EmbeddingCache.normalize(text)
+            for text, embedding in zip(texts, embeddings)
+            if embedding is None
+        }
+    )
+    if missing:
+        with STAGE_SECONDS.time(stage="embed_query"):
+            computed = await asyncio.get_running_loop().run_in_executor(
+                inference_executor, get_text_embeddings, missing
+            )
+        computed = dict(zip(missing, computed))
+        for i, text in enumerate(texts):
+            if embeddings[i] is None:
+                embeddings[i] = computed[EmbeddingCache.normalize(text)]
+                text_embedding_cache.put(text, embeddings[i])
+    return np.stack(embeddings)
+
+
+def build_query_filter(**kwargs) -> Optional[models.Filter]:
+    """Builds the filter on the metadata stored in full payloads.
+
+    Args:
+        movie, director, actor, genre, year (str): optional filters
+
+    Returns:
+        models.Filter: None when no filter is set
     """
 
     # Extract the optional filters
@@ -23,8 +140,6 @@ def search_text_in_db(text: str, client: QdrantClient, **kwargs) -> List[dict]:
     actor = kwargs.get("actor")
     genre = kwargs.get("genre")
     year = kwargs.get("year")
-    k = kwargs.get("k", 20)
-    k = int(k)
 
     # Build the query filter
     if any([movie, director, actor, genre, year]):
@@ -39,21 +154,21 @@ def search_text_in_db(text: str, client: QdrantClient, **kwargs) -> List[dict]:
         if director:
             query_filter.must.append(
                 models.FieldCondition(
-                    key="director[]",
+                    key="director",
                     match=models.MatchValue(value=director),
                 )
             )
         if actor:
             query_filter.must.append(
                 models.FieldCondition(
-                    key="actor[]",
+                    key="actor",
                     match=models.MatchValue(value=actor),
                 )
             )
         if genre:
             query_filter.must.append(
                 models.FieldCondition(
-                    key="genre[]",
+                    key="genre",
                     match=models.MatchValue(value=genre),
                 )
             )
@@ -66,30 +181,301 @@ def search_text_in_db(text: str, client: QdrantClient, **kwargs) -> List[dict]:
             )
     else:
         query_filter = None
-    results = client.search(
-        collection_name="captions",
-        query_vector=get_text_embedding(text)[0].tolist(),
-        query_filter=query_filter,
-        limit=k,
-    )
+    return query_filter
+
+
+def plan_search(
+    movie_table: Optional[MovieTable] = None, **kwargs
+) -> Optional[Tuple[Optional[models.Filter], Optional[models.SearchParams]]]:
+    """Turns the filters and options of a search request into Qdrant's filter and
+        search parameters.
+
+    Args:
+        movie_table (MovieTable): movie metadata used to plan filtered searches,
+            required for compact payloads
+        movie, director, actor, genre, year (str): optional filters
+        rescore, oversampling, exact: see `search_params`
+
+    Returns:
+        Optional[Tuple[models.Filter, models.SearchParams]]: None when no movie
+            passes the filters of a compact payload search
+
+    Raises:
+        ValueError: if a compact payload search is filtered without a movie table
+    """
+    # Resolve the filters to the matching movies. Compact payloads only carry
+    # the movie id, so they are filtered on it. Full payloads are filtered on
+    # their own metadata, so that a missing or stale table only costs the exact
+    # search below, not the results.
+    movie_ids = movie_table.resolve(**kwargs) if movie_table is not None else None
+    if PAYLOAD_MODE == "compact":
+        if movie_table is None and any(kwargs.get(name) for name in FILTER_FIELDS):
+            raise ValueError("Filtering compact payloads requires a movie table")
+        if movie_ids == []:
+            return None
+        query_filter = (
+            models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="movie_id", match=models.MatchAny(any=movie_ids)
+                    )
+                ]
+            )
+            if movie_ids
+            else None
+        )
+    else:
+        query_filter = build_query_filter(**kwargs)
+
+    # Scanning the few points of a selective filter is cheaper and more accurate
+    # than walking the graph for points that pass it
+    if movie_ids and movie_table.num_frames(movie_ids) <= EXACT_SEARCH_MAX_FRAMES:
+        kwargs["exact"] = True
+
+    return query_filter, search_params(**kwargs)
+
+
+async def search_text_in_db(
+    text: str, client: AsyncQdrantClient, movie_table: MovieTable = None, **kwargs
+) -> List[dict]:
+    """Semantically searches the vector store's "captions" collection for images
+        whose captions match the parameter `text`
+
+    Args:
+        text (str): caption to be searched for.
+        client (AsyncQdrantClient): vector store
+        movie_table (MovieTable): movie metadata used to plan filtered searches,
+            required for compact payloads
+        fields (List[str]): payload fields to return, None for all of them
+
+    Returns:
+        List[dict]: the closest points
+    """
+    k = int(kwargs.get("k", SEARCH_K))
+
+    plan = plan_search(movie_table, **kwargs)
+    if plan is None:
+        return []
+    query_filter, params = plan
 
-    return [result.model_dump() for result in results]
+    query_vector = await embed_query_text(text)
+    with STAGE_SECONDS.time(stage="vector_search"):
+        results = await client.search(
+            collection_name="captions",
+            query_vector=query_vector.tolist(),
+            query_filter=query_filter,
+            search_params=params,
+            limit=k,
+            with_payload=payload_selector(kwargs.get("fields")),
+            with_vectors=False,
+        )
+
+    return [to_result(result) for result in results]
+
+
+def fuse_results(
+    result_lists: List[List[dict]],
+    weights: List[float],
+    fusion: str = HYBRID_FUSION,
+    limit: int = 20,
+) -> List[dict]:
+    """Merges ranked result lists into one, counting every point once.
+
+    With "rrf" (reciprocal rank fusion) a point scores sum(w / (HYBRID_RRF_K +
+    rank)) over the lists it appears in, which only looks at the ranks. With
+    "weighted" it scores sum(w * score). Text-to-image similarities are much
+    lower than text-to-text ones, so the weights have to make up for it there.
+
+    Args:
+        result_lists (List[List[dict]]): results of each search, best first
+        weights (List[float]): weight of each list
+        fusion (str): "rrf" or "weighted"
+        limit (int): number of results to return
+
+    Returns:
+        List[dict]: the fused results with their fused score, best first
+    """
+    if fusion not in ["rrf", "weighted"]:
+        raise ValueError(f"Unknown fusion {fusion}")
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, result in enumerate(results, start=1):
+            if fusion == "rrf":
+                score = weight / (HYBRID_RRF_K + rank)
+            else:
+                score = weight * result["score"]
+            if result["id"] in fused:
+                fused[result["id"]]["score"] += score
+            else:
+                fused[result["id"]] = {**result, "score": score}
+    return sorted(fused.values(), key=lambda result: -result["score"])[:limit]
+
+
+async def search_hybrid_in_db(
+    text: str, client: AsyncQdrantClient, movie_table: MovieTable = None, **kwargs
+) -> List[dict]:
+    """Searches the "captions" and "scenes" collections with the same text
+        embedding at once and fuses the two rankings. CLIP embeds text and
+        images into the same space, so the text query also finds frames whose
+        captions miss what is on screen.
+
+    Args:
+        text (str): caption to be searched for.
+        client (AsyncQdrantClient): vector store
+        movie_table (MovieTable): movie metadata used to plan filtered searches,
+            required for compact payloads
+        fusion (str): "rrf" or "weighted", see `fuse_results`
+        caption_weight (float): weight of the caption ranking, the scene ranking
+            gets the rest
+        fields (List[str]): payload fields to return, None for all of them
+
+    Returns:
+        List[dict]: the closest points
+    """
+    k = int(kwargs.get("k", SEARCH_K))
+    fusion = kwargs.get("fusion") or HYBRID_FUSION
+    caption_weight = kwargs.get("caption_weight")
+    caption_weight = HYBRID_CAPTION_WEIGHT if caption_weight is None else caption_weight
 
+    plan = plan_search(movie_table, **kwargs)
+    if plan is None:
+        return []
+    query_filter, params = plan
 
-def search_images_in_db(image: Image, client: QdrantClient) -> List[dict]:
+    # Both searches are in flight together, so this takes as long as the slower
+    query_vector = (await embed_query_text(text)).tolist()
+    with STAGE_SECONDS.time(stage="vector_search"):
+        caption_results, scene_results = await asyncio.gather(
+            *[
+                client.search(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    query_filter=query_filter,
+                    search_params=params,
+                    limit=k,
+                    with_payload=payload_selector(kwargs.get("fields")),
+                    with_vectors=False,
+                )
+                for collection_name in ["captions", "scenes"]
+            ]
+        )
+
+    return fuse_results(
+        [
+            [to_result(result) for result in caption_results],
+            [to_result(result) for result in scene_results],
+        ],
+        [caption_weight, 1 - caption_weight],
+        fusion,
+        k,
+    )
+
+
+async def search_images_in_db(
+    image: Image, client: AsyncQdrantClient, **kwargs
+) -> List[dict]:
     """Semantically searches the vector store's "scenes" collection for images like
         the parameter `image`
 
     Args:
         image (Image): image to be semantically searched
-        client (QdrantClient): vector store
+        client (AsyncQdrantClient): vector store
+        fields (List[str]): payload fields to return, None for all of them
 
     Returns:
         List[dict]: the closest points
     """
 
-    results = client.search(
-        collection_name="scenes", query_vector=get_image_embedding(image)[0].tolist()
-    )
+    query_vector = await embed_query_image(image)
+    with STAGE_SECONDS.time(stage="vector_search"):
+        results = await client.search(
+            collection_name="scenes",
+            query_vector=query_vector.tolist(),
+            search_params=search_params(**kwargs),
+            with_payload=payload_selector(kwargs.get("fields")),
+            with_vectors=False,
+        )
+
+    return [to_result(result) for result in results]
+
+
+async def search_texts_in_db(
+    requests: List[dict], client: AsyncQdrantClient, movie_table: MovieTable = None
+) -> List[List[dict]]:
+    """Runs many caption searches with one batched encoder pass and one batch
+        request to the vector store.
+
+    Args:
+        requests (List[dict]): the "text" of every search along with its own
+            filters, k and options, as taken by `search_text_in_db`
+        client (AsyncQdrantClient): vector store
+        movie_table (MovieTable): movie metadata used to plan filtered searches,
+            required for compact payloads
+
+    Returns:
+        List[List[dict]]: the closest points of every request, in request order
+    """
+    plans = [plan_search(movie_table, **request) for request in requests]
+    planned = [i for i, plan in enumerate(plans) if plan is not None]
+    if not planned:
+        return [[] for _ in requests]
+
+    query_vectors = await embed_query_texts([requests[i]["text"] for i in planned])
+    with STAGE_SECONDS.time(stage="vector_search"):
+        batch_results = await client.search_batch(
+            collection_name="captions",
+            requests=[
+                models.SearchRequest(
+                    vector=query_vector.tolist(),
+                    filter=plans[i][0],
+                    params=plans[i][1],
+                    limit=int(requests[i].get("k", SEARCH_K)),
+                    with_payload=payload_selector(requests[i].get("fields")),
+                    with_vector=False,
+                )
+                for i, query_vector in zip(planned, query_vectors)
+            ],
+        )
+
+    results = [[] for _ in requests]
+    for i, points in zip(planned, batch_results):
+        results[i] = [to_result(point) for point in points]
+    return results
+
 
-    return [result.model_dump() for result in results]
+async def search_images_bulk_in_db(
+    images: List[Image.Image], client: AsyncQdrantClient, **kwargs
+) -> List[List[dict]]:
+    """Runs many image searches with one batched encoder pass and one batch
+        request to the vector store.
+
+    Args:
+        images (List[Image]): images to be semantically searched
+        client (AsyncQdrantClient): vector store
+        k (int): number of results per image
+        fields (List[str]): payload fields to return, None for all of them
+
+    Returns:
+        List[List[dict]]: the closest points of every image, in order
+    """
+    if not images:
+        return []
+    with STAGE_SECONDS.time(stage="embed_query"):
+        query_vectors = await asyncio.get_running_loop().run_in_executor(
+            inference_executor, get_image_embeddings, images
+        )
+    with STAGE_SECONDS.time(stage="vector_search"):
+        batch_results = await client.search_batch(
+            collection_name="scenes",
+            requests=[
+                models.SearchRequest(
+                    vector=query_vector.tolist(),
+                    params=search_params(**kwargs),
+                    limit=int(kwargs.get("k", SEARCH_K)),
+                    with_payload=payload_selector(kwargs.get("fields")),
+                    with_vector=False,
+                )
+                for query_vector in query_vectors
+            ],
+        )
+    return [[to_result(point) for point in points] for points in batch_results]
@@ -0,0 +1,321 @@
+"""
+Bookkeeping for incremental ingestion. The manifest records every frame that is
+in the vector store together with the hash of its image and caption and the
+model that embedded it, so that a later run only has to embed the frames that
+are new or changed and delete the ones whose files are gone.
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import (
+    DATASET_MANIFEST_PATH,
+    DATASET_SPLIT,
+    ENCODER_BACKEND,
+    ENCODER_PRECISION,
+    INGEST_MANIFEST_PATH,
+    MODEL_NAME,
+)
+from image_ingestion import Frame, iter_frames
+from ingestion_pipeline import IngestionPipeline
+from qdrant_client import QdrantClient, models
+from utils import content_hash, generate_id
+
+
+def embedding_id(
+    model_name: str = MODEL_NAME,
+    backend: str = ENCODER_BACKEND,
+    precision: str = ENCODER_PRECISION,
+) -> str:
+    """Names the embeddings that an encoder computes. Each backend and precision
+    gets its own name, so that their vectors are never mixed in a store or a
+    collection. The float32 torch encoder keeps the bare model name that
+    stores and manifests were written with before."""
+    if (backend, precision) == ("torch", "float32"):
+        return model_name
+    return f"{model_name}@{backend}-{precision}"
+
+
+class IngestionManifest:
+    """SQLite backed record of the ingested frames.
+
+    Args:
+        path (str): location of the SQLite file
+        model_id (str): what the embeddings are computed with, see
+            `embedding_id`. Frames embedded with anything else count as changed.
+    """
+
+    def __init__(
+        self, path: str = INGEST_MANIFEST_PATH, model_id: str = embedding_id()
+    ):
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS frames (
+                movie_id TEXT NOT NULL,
+                image_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                PRIMARY KEY (movie_id, image_id)
+            );
+            CREATE TABLE IF NOT EXISTS movies (
+                movie_id TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                model_id TEXT NOT NULL
+            );
+            """
+        )
+
+    def movie_ids(self) -> set:
+        """Returns the ids of all movies that have at least one ingested frame."""
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT movie_id FROM frames")
+            return {row[0] for row in rows}
+
+    def frames_of(self, movie_id: str) -> dict:
+        """Returns a map of image id to (content hash, model id) for a movie."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT image_id, content_hash, model_id FROM frames WHERE movie_id = ?",
+                (movie_id,),
+            )
+            return {image_id: (digest, model) for image_id, digest, model in rows}
+
+    def is_movie_complete(self, movie_id: str, signature: str) -> bool:
+        """Checks if every frame of the movie was ingested and nothing in its
+        directory has changed since."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT signature, model_id FROM movies WHERE movie_id = ?",
+                (movie_id,),
+            ).fetchone()
+        return row == (signature, self.model_id)
+
+    def record_frames(self, frames: List[Frame]):
+        """Marks the frames as ingested. Safe to call from several threads."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?)",
+                [
+                    (frame.movie_id, frame.image_id, frame.content_hash, self.model_id)
+                    for frame in frames
+                ],
+            )
+
+    def remove_frames(self, movie_id: str, image_ids: List[str]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM frames WHERE movie_id = ? AND image_id = ?",
+                [(movie_id, image_id) for image_id in image_ids],
+            )
+            self._db.execute("DELETE FROM movies WHERE movie_id = ?", (movie_id,))
+
+    def mark_movie_complete(self, movie_id: str, signature: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO movies VALUES (?, ?, ?)",
+                (movie_id, signature, self.model_id),
+            )
+
+    def clear(self):
+        """Forgets every frame, e.g. after the collections have been deleted."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM frames")
+            self._db.execute("DELETE FROM movies")
+
+
+def movie_signature(dir_path: Path) -> str:
+    """Cheap fingerprint of a movie directory built from the names, sizes and
+    modification times of its files. It is used to skip finished movies without
+    hashing every frame again."""
+    entries = sorted(
+        (path.name, path.stat().st_size, path.stat().st_mtime_ns)
+        for path in dir_path.iterdir()
+        if path.is_file()
+    )
+    return json.dumps(entries)
+
+
+def list_dataset_manifest(
+    manifest_path: str, image_data_path: Path, split: str = DATASET_SPLIT
+) -> Dict[str, Tuple[str, List[Frame]]]:
+    """Lists the captioned frames of a split from the dataset manifest, so that
+        nothing has to walk the movie directories or read their captions.json.
+        The signature of a movie and the content hashes of its frames are built
+        from the image hashes and captions that the manifest holds, so no image
+        is read either.
+
+    Args:
+        manifest_path (str): location of the manifest written by dataset/manifest.py
+        image_data_path (Path): directory holding the split's movie directories
+        split (str): split of the dataset that `image_data_path` holds
+
+    Returns:
+        Dict[str, Tuple[str, List[Frame]]]: signature and frames of every movie
+    """
+    db = sqlite3.connect(f"file:{manifest_path}?mode=ro", uri=True)
+    try:
+        rows = db.execute(
+            """SELECT movie_id, name, content_hash, caption FROM images
+            WHERE split = ? AND caption IS NOT NULL ORDER BY movie_id, name""",
+            (split,),
+        ).fetchall()
+    finally:
+        db.close()
+
+    entries, frames = {}, {}
+    for movie_id, image_id, image_hash, caption in rows:
+        entries.setdefault(movie_id, []).append((image_id, image_hash, caption))
+        image_path = image_data_path / movie_id / image_id
+        frames.setdefault(movie_id, []).append(
+            Frame(
+                movie_id,
+                image_id,
+                image_path,
+                caption,
+                content_hash(image_path, caption, image_hash),
+            )
+        )
+    return {
+        movie_id: (json.dumps(entries[movie_id]), frames[movie_id])
+        for movie_id in entries
+    }
+
+
+def plan_movie(
+    dir_path: Path, manifest: IngestionManifest, frames: Optional[List[Frame]] = None
+) -> Tuple[List[Frame], List[str]]:
+    """Works out what has to change in the vector store for a movie directory.
+
+    Args:
+        dir_path (Path): path to the directory where the movie images are located.
+        manifest (IngestionManifest): frames that are already ingested
+        frames (List[Frame]): frames of the movie, listed from the directory if
+            not given. Frames that carry their content hash are not read.
+
+    Returns:
+        Tuple[List[Frame], List[str]]: the new or changed frames that have to be
+            embedded, and the ids of the ingested images whose files are gone.
+    """
+    ingested = manifest.frames_of(dir_path.name)
+    changed = []
+    for frame in frames if frames is not None else iter_frames(dir_path):
+        digest = frame.content_hash or content_hash(frame.image_path, frame.caption)
+        if ingested.pop(frame.image_id, None) != (digest, manifest.model_id):
+            changed.append(frame._replace(content_hash=digest))
+    return changed, list(ingested)
+
+
+def delete_frames(
+    client: QdrantClient,
+    manifest: IngestionManifest,
+    movie_id: str,
+    image_ids,
+    store=None,
+):
+    """Deletes the points of the frames from both collections, the manifest and
+    the embedding store, if one is given."""
+    image_ids = list(image_ids)
+    if not image_ids:
+        return
+    if store is not None:
+        store.remove(movie_id, image_ids)
+    selector = models.PointIdsList(
+        points=[generate_id(image_id, movie_id) for image_id in image_ids]
+    )
+    client.delete("scenes", points_selector=selector)
+    client.delete("captions", points_selector=selector)
+    manifest.remove_frames(movie_id, image_ids)
+
+
+def ingest_incremental(
+    client: QdrantClient,
+    movie_info: dict,
+    image_data_path: Path,
+    manifest: IngestionManifest,
+    store=None,
+    dataset_manifest: Optional[str] = DATASET_MANIFEST_PATH,
+) -> dict:
+    """Brings the collections in line with the movie directories. Only new or
+        changed frames are embedded and upserted, and points whose files have
+        been removed are deleted. Progress is recorded as batches are uploaded,
+        so an interrupted run picks up where it stopped.
+
+    Args:
+        client (QdrantClient): connection to the vector store
+        movie_info (dict): Metadata on the movies
+        image_data_path (Path): directory holding one directory per movie
+        manifest (IngestionManifest): frames that are already ingested
+        store (EmbeddingStore): optional store of precomputed embeddings
+        dataset_manifest (str): optional dataset manifest that the movies and
+            their frames are listed from, see DATASET_MANIFEST_PATH
+
+    Returns:
+        dict: what was done along with the pipeline's stage throughput
+    """
+    listing = None
+    if dataset_manifest:
+        listing = list_dataset_manifest(dataset_manifest, image_data_path)
+        dir_paths = [image_data_path / movie_id for movie_id in sorted(listing)]
+    else:
+        dir_paths = sorted(path for path in image_data_path.iterdir() if path.is_dir())
+    summary = {"skipped_movies": 0, "embedded_frames": 0, "deleted_frames": 0}
+
+    # Movies whose directory no longer exists
+    present = {dir_path.name for dir_path in dir_paths}
+    for movie_id in manifest.movie_ids() - present:
+        image_ids = manifest.frames_of(movie_id)
+        delete_frames(client, manifest, movie_id, image_ids, store)
+        summary["deleted_frames"] += len(image_ids)
+
+    # Frames still waiting to be uploaded for each movie. A movie is marked
+    # complete once its last frame has been uploaded.
+    pending = {}
+    signatures = {}
+    lock = threading.Lock()
+
+    def on_uploaded(frames: List[Frame]):
+        manifest.record_frames(frames)
+        with lock:
+            for frame in frames:
+                pending[frame.movie_id] -= 1
+                if pending[frame.movie_id] == 0:
+                    manifest.mark_movie_complete(
+                        frame.movie_id, signatures[frame.movie_id]
+                    )
+
+    def changed_frames() -> Iterator[Frame]:
+        for dir_path in dir_paths:
+            movie_id = dir_path.name
+            if listing is not None:
+                signature, listed_frames = listing[movie_id]
+            else:
+                signature, listed_frames = movie_signature(dir_path), None
+            if manifest.is_movie_complete(movie_id, signature):
+                summary["skipped_movies"] += 1
+                continue
+
+            frames, removed = plan_movie(dir_path, manifest, listed_frames)
+            delete_frames(client, manifest, movie_id, removed, store)
+            summary["deleted_frames"] += len(removed)
+            summary["embedded_frames"] += len(frames)
+            if not frames:
+                manifest.mark_movie_complete(movie_id, signature)
+                continue
+
+            with lock:
+                pending[movie_id] = len(frames)
+                signatures[movie_id] = signature
+            print(f"Processing {dir_path} ({len(frames)} new or changed frames)")
+            yield from frames
+
+    pipeline = IngestionPipeline(
+        client, movie_info, on_uploaded=on_uploaded, store=store
+    )
+    summary["stats"] = pipeline.run(changed_frames())
+    return summary
@@ -0,0 +1,310 @@
+"""
+Staged ingestion of movie frames into the vector store. Frames flow through
+three stages that run concurrently:
+
+    decode (process pool) -> encode (batching thread) -> upload (thread pool)
+
+Bounded queues sit between the stages, so a slow stage applies backpressure to
+the ones before it instead of letting batches pile up in memory.
+"""
+
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+from config import (
+    BATCH_SIZE,
+    NUM_DECODE_WORKERS,
+    NUM_UPLOAD_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+)
+from decoding import decode_images
+from image_ingestion import Frame, build_payload
+from metrics import INGESTED_POINTS, STAGE_SECONDS
+from preprocessing import get_fast_params, set_fast_params
+from qdrant_client import QdrantClient, models
+from utils import generate_id, get_image_embeddings_from_pixels, get_text_embeddings
+
+
+class PipelineAborted(Exception):
+    """Raised inside a stage when another stage of the pipeline has failed."""
+
+
+class StageStats:
+    """Thread-safe throughput counters for one stage of the pipeline."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.frames = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, frames: int, seconds: float):
+        STAGE_SECONDS.observe(seconds, stage=f"ingest_{self.name}")
+        with self._lock:
+            self.frames += frames
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds: float, workers: int = 1) -> dict:
+        """Summarizes the stage.
+
+        `frames_per_second` is the throughput the stage would sustain if it never
+        had to wait on the other stages, so the stage with the lowest value is the
+        bottleneck.
+        """
+        busy_per_worker = self.busy_seconds / workers
+        return {
+            "frames": self.frames,
+            "workers": workers,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "frames_per_second": round(self.frames / busy_per_worker, 2)
+            if busy_per_worker > 0
+            else 0.0,
+            "utilization": round(busy_per_worker / wall_seconds, 3)
+            if wall_seconds > 0
+            else 0.0,
+        }
+
+
+class Batch(NamedTuple):
+    """A batch of frames on its way from the feeder to the encode stage. Frames
+    to be embedded come with the decoder's future, frames found in the embedding
+    store with their rows in it."""
+
+    frames: List[Frame]
+    # Resolves to the pixel values and the seconds spent decoding
+    decoding: Optional[Future] = None
+    stored_rows: Optional[List[int]] = None
+
+
+class IngestionPipeline:
+    """Embeds frames and streams them into the "scenes" and "captions" collections.
+
+    Args:
+        client (QdrantClient): connection to the vector store
+        movie_info (dict): Metadata on the movies
+        batch_size (int): frames per decode, encode and upload batch
+        num_decoders (int): processes decoding and preprocessing the JPEGs
+        num_uploaders (int): threads uploading points to the vector store
+        queue_size (int): maximum batches waiting between two stages
+        on_uploaded (Callable): called with the frames of every batch once it has
+            been written to both collections
+        store (EmbeddingStore): optional store of precomputed embeddings. Frames
+            stored with the same content hash skip decoding and inference, and
+            newly computed embeddings are added to it.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        movie_info: dict,
+        batch_size: int = BATCH_SIZE,
+        num_decoders: int = NUM_DECODE_WORKERS,
+        num_uploaders: int = NUM_UPLOAD_WORKERS,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        on_uploaded: Optional[Callable[[List[Frame]], None]] = None,
+        store=None,
+    ):
+        self.client = client
+        self.movie_info = movie_info
+        self.batch_size = batch_size
+        self.num_decoders = num_decoders
+        self.num_uploaders = num_uploaders
+        self.queue_size = queue_size
+        self.on_uploaded = on_uploaded
+        self.store = store
+
+        self._failed = threading.Event()
+        self._errors = []
+        self.stats = {
+            "decode": StageStats("decode"),
+            "encode": StageStats("encode"),
+            "upload": StageStats("upload"),
+        }
+
+    def run(self, frames: Iterable[Frame]) -> dict:
+        """Ingests the frames and blocks until all of them have been uploaded.
+
+        Args:
+            frames (Iterable[Frame]): frames to be ingested
+
+        Returns:
+            dict: per stage throughput, see `StageStats.report`
+        """
+        start = time.perf_counter()
+        decoded = queue.Queue(self.queue_size)
+        encoded = queue.Queue(self.queue_size)
+
+        # Spawn the decoders so they don't inherit the model or torch's threads.
+        # They get the preprocessing settings as plain data, so they never
+        # import transformers or torch.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            self.num_decoders,
+            mp_context=context,
+            initializer=set_fast_params,
+            initargs=(get_fast_params(),),
+        ) as pool:
+            feeder = self._start(self._feed, pool, frames, decoded)
+            encoder = self._start(self._encode, decoded, encoded)
+            uploaders = [
+                self._start(self._upload, encoded) for _ in range(self.num_uploaders)
+            ]
+            for thread in [feeder, encoder, *uploaders]:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        wall_seconds = time.perf_counter() - start
+        report = {
+            "decode": self.stats["decode"].report(wall_seconds, self.num_decoders),
+            "encode": self.stats["encode"].report(wall_seconds),
+            "upload": self.stats["upload"].report(wall_seconds, self.num_uploaders),
+            "wall_seconds": round(wall_seconds, 3),
+            "frames_per_second": round(self.stats["upload"].frames / wall_seconds, 2),
+        }
+        for name in ["decode", "encode", "upload"]:
+            print(f"[ingest] {name}: {report[name]['frames_per_second']} frames/s")
+        return report
+
+    # ============================= STAGES =============================
+
+    def _feed(self, pool: ProcessPoolExecutor, frames: Iterable[Frame], decoded):
+        """Batches the frames and submits them to the decoder processes. Holding
+        the futures in the bounded queue caps the number of batches in flight.
+        Frames found in the embedding store are batched separately and passed
+        straight to the encoder along with their rows. The store is looked up
+        once per movie."""
+
+        def decode(batch: List[Frame]) -> Batch:
+            paths = [frame.image_path for frame in batch]
+            return Batch(batch, decoding=pool.submit(decode_images, paths))
+
+        batch, stored, stored_rows = [], [], []
+        for _, movie_frames in itertools.groupby(frames, lambda f: f.movie_id):
+            movie_frames = list(movie_frames)
+            if self.store is not None:
+                rows = self.store.lookup(movie_frames)
+            else:
+                rows = [-1] * len(movie_frames)
+            for frame, row in zip(movie_frames, rows):
+                if row >= 0:
+                    stored.append(frame)
+                    stored_rows.append(row)
+                else:
+                    batch.append(frame)
+                if len(batch) == self.batch_size:
+                    self._put(decoded, decode(batch))
+                    batch = []
+                if len(stored) == self.batch_size:
+                    self._put(decoded, Batch(stored, stored_rows=stored_rows))
+                    stored, stored_rows = [], []
+        if batch:
+            self._put(decoded, decode(batch))
+        if stored:
+            self._put(decoded, Batch(stored, stored_rows=stored_rows))
+        self._put(decoded, None)
+
+    def _encode(self, decoded, encoded):
+        """Embeds each decoded batch and turns it into points for both collections."""
+        while True:
+            batch = self._get(decoded)
+            if batch is None:
+                break
+            frames = batch.frames
+
+            if batch.stored_rows is not None:
+                start = time.perf_counter()
+                image_embeddings = self.store.get("scenes", batch.stored_rows)
+                text_embeddings = self.store.get("captions", batch.stored_rows)
+            else:
+                pixel_values, decode_seconds = batch.decoding.result()
+                self.stats["decode"].record(len(frames), decode_seconds)
+                start = time.perf_counter()
+                image_embeddings = get_image_embeddings_from_pixels(
+                    pixel_values, self.batch_size
+                )
+                text_embeddings = get_text_embeddings(
+                    [frame.caption for frame in frames], self.batch_size
+                )
+                if self.store is not None:
+                    self.store.add(frames, image_embeddings, text_embeddings)
+            scene_points, caption_points = [], []
+            for frame, image_embedding, text_embedding in zip(
+                frames, image_embeddings.tolist(), text_embeddings.tolist()
+            ):
+                point_id = generate_id(frame.image_id, frame.movie_id)
+                payload = build_payload(
+                    frame.movie_id, frame.image_id, frame.caption, self.movie_info
+                )
+                scene_points.append(
+                    models.PointStruct(
+                        id=point_id, vector=image_embedding, payload=payload
+                    )
+                )
+                caption_points.append(
+                    models.PointStruct(
+                        id=point_id, vector=text_embedding, payload=payload
+                    )
+                )
+            self.stats["encode"].record(len(frames), time.perf_counter() - start)
+            self._put(encoded, (frames, scene_points, caption_points))
+
+        for _ in range(self.num_uploaders):
+            self._put(encoded, None)
+
+    def _upload(self, encoded):
+        """Writes batches of points to the vector store."""
+        while True:
+            batch = self._get(encoded)
+            if batch is None:
+                break
+            frames, scene_points, caption_points = batch
+
+            start = time.perf_counter()
+            self.client.upsert("scenes", points=scene_points)
+            self.client.upsert("captions", points=caption_points)
+            self.stats["upload"].record(len(frames), time.perf_counter() - start)
+            INGESTED_POINTS.inc(len(scene_points), collection="scenes")
+            INGESTED_POINTS.inc(len(caption_points), collection="captions")
+
+            if self.on_uploaded is not None:
+                self.on_uploaded(frames)
+
+    # ============================= PLUMBING =============================
+
+    def _start(self, target, *args) -> threading.Thread:
+        def run():
+            try:
+                target(*args)
+            except PipelineAborted:
+                pass
+            except Exception as e:
+                self._errors.append(e)
+                self._failed.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _put(self, q: queue.Queue, item):
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted()
+
+    def _get(self, q: queue.Queue):
+        while not self._failed.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineAborted()
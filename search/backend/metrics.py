@@ -0,0 +1,206 @@
+"""
+Minimal Prometheus instrumentation: labelled counters and histograms kept in
+process and rendered in the Prometheus text exposition format by `/metrics`.
+"""
+
+import cProfile
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import PROFILE_PATH, PROFILE_SAMPLE_RATE
+
+# Upper bounds in seconds of the histogram buckets, from tokenization of a single
+# query up to a full ingest batch
+DEFAULT_BUCKETS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+]
+
+
+def _format_labels(names: List[str], values: Tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    """Monotonic count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: List[str] = []):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split
+    by labels."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: List[str] = [],
+        buckets: List[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = sorted(buckets)
+        # Per label values: count of each bucket (not cumulative), sum, count
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+                lines.append(
+                    f"{self.name}_sum{_format_labels(self.labels, key)} {total}"
+                )
+                lines.append(
+                    f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+                )
+        return lines
+
+
+class Registry:
+    """The metrics exposed by `/metrics`."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labels: List[str] = []):
+        self.metrics.append(Counter(name, documentation, labels))
+        return self.metrics[-1]
+
+    def histogram(self, name: str, documentation: str, labels: List[str] = []):
+        self.metrics.append(Histogram(name, documentation, labels))
+        return self.metrics[-1]
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    "movieclip_http_requests_total",
+    "HTTP requests by path and status",
+    ["path", "status"],
+)
+ERRORS = REGISTRY.counter(
+    "movieclip_http_errors_total", "HTTP requests that failed", ["path"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "movieclip_http_request_seconds", "Latency of HTTP requests", ["path"]
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "movieclip_stage_seconds",
+    "Seconds spent in each stage of a search or an ingest batch",
+    ["stage"],
+)
+INGESTED_POINTS = REGISTRY.counter(
+    "movieclip_ingested_points_total",
+    "Points written to each collection",
+    ["collection"],
+)
+
+
+# ============================= PROFILING =============================
+
+_profiling = threading.Lock()
+
+
+@contextmanager
+def maybe_profile(name: str, sample_rate: float = PROFILE_SAMPLE_RATE):
+    """Profiles the `with` block for a `sample_rate` fraction of calls and dumps
+    the stats to PROFILE_PATH/<time in ns>-<name>.prof. Only one block is
+    profiled at a time. In the server the profile covers everything the event
+    loop runs meanwhile, but not the inference threads.
+    """
+    profile: Optional[cProfile.Profile] = None
+    if sample_rate > 0 and random.random() < sample_rate and _profiling.acquire(False):
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            _profiling.release()
+            Path(PROFILE_PATH).mkdir(parents=True, exist_ok=True)
+            safe_name = name.strip("/").replace("/", "_") or "root"
+            profile.dump_stats(
+                Path(PROFILE_PATH) / f"{time.time_ns()}-{safe_name}.prof"
+            )
@@ -0,0 +1,111 @@
+"""
+In-memory table of the movie metadata in results.json. With compact payloads the
+points only carry the ids of a frame, and the metadata is filtered on and joined
+from this table instead of being stored hundreds of times per movie.
+"""
+
+from typing import List, Optional, Tuple
+
+from thumbnails import thumbnail_url
+
+# Metadata of a movie and the results.json field it comes from
+MOVIE_FIELDS = {
+    "title": "Title",
+    "director": "Director",
+    "actor": "Actors",
+    "genre": "Genre",
+    "year": "Year",
+}
+
+# Search filter name to the metadata field it matches
+FILTER_FIELDS = {
+    "movie": "title",
+    "director": "director",
+    "actor": "actor",
+    "genre": "genre",
+    "year": "year",
+}
+
+
+class MovieTable:
+    """Movie metadata keyed by movie id, with posting lists for filtering.
+
+    Args:
+        movie_info (dict): contents of results.json
+    """
+
+    def __init__(self, movie_info: dict):
+        self.reload(movie_info)
+
+    def reload(self, movie_info: dict):
+        """Rebuilds the table, e.g. after results.json has changed."""
+        self.movies = {
+            movie_id: {field: info[key] for field, key in MOVIE_FIELDS.items()}
+            for movie_id, info in movie_info.items()
+        }
+        self.num_images = {
+            movie_id: info.get("NumImages", 0) for movie_id, info in movie_info.items()
+        }
+        self.postings = {field: {} for field in MOVIE_FIELDS}
+        for movie_id, movie in self.movies.items():
+            for field, values in movie.items():
+                for value in values if isinstance(values, list) else [values]:
+                    self.postings[field].setdefault(value, set()).add(movie_id)
+
+    def __len__(self) -> int:
+        return len(self.movies)
+
+    def resolve(self, **kwargs) -> Optional[List[str]]:
+        """Finds the movies that pass all of the search filters.
+
+        Args:
+            movie, director, actor, genre, year (str): optional filters
+
+        Returns:
+            Optional[List[str]]: the matching movie ids, or None if no filter is set
+        """
+        movie_ids = None
+        for name, field in FILTER_FIELDS.items():
+            value = kwargs.get(name)
+            if not value:
+                continue
+            matches = self.postings[field].get(value, set())
+            movie_ids = matches if movie_ids is None else movie_ids & matches
+        return None if movie_ids is None else sorted(movie_ids)
+
+    def num_frames(self, movie_ids: List[str]) -> int:
+        """Number of frames of the movies, going by the NumImages in results.json."""
+        return sum(self.num_images.get(movie_id, 0) for movie_id in movie_ids)
+
+    def join(
+        self, results: List[dict], fields: Optional[List[str]] = None
+    ) -> Tuple[List[dict], dict]:
+        """Adds the title and image path to the payload of every result, and
+        collects the full metadata of the movies in the results once. The
+        payloads are copied, since they may belong to the search index.
+
+        Args:
+            results (List[dict]): search results with compact payloads
+            fields (List[str]): payload fields to return, None for all of them.
+                The join keys and joined fields that weren't asked for are
+                dropped.
+
+        Returns:
+            Tuple[List[dict], dict]: the results, and the metadata by movie id
+        """
+        movies, joined = {}, []
+        for result in results:
+            payload = result["payload"]
+            movie = self.movies.get(payload["movie_id"], {})
+            movies[payload["movie_id"]] = movie
+            payload = {
+                **payload,
+                "title": movie.get("title"),
+                "image_path": thumbnail_url(payload["movie_id"], payload["image_id"]),
+            }
+            if fields is not None:
+                payload = {
+                    field: payload[field] for field in fields if field in payload
+                }
+            joined.append({**result, "payload": payload})
+        return joined, movies
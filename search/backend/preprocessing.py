@@ -0,0 +1,165 @@
+"""
+Image decoding and preprocessing for the CLIP image tower. This module does not
+load the model, and transformers is only imported to load the image processor,
+so that it can be imported cheaply by the ingestion worker processes.
+
+The fast path does the same resize, center crop, rescale and normalization as
+the Hugging Face processor. JPEGs are decoded at a reduced scale in draft mode
+when they are much larger than the model input, each image is resized with PIL,
+and the crop and normalization run once on the whole batch in NumPy.
+"""
+
+import io
+import math
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from config import MAX_UPLOAD_BYTES, MAX_UPLOAD_PIXELS, MODEL_NAME, PREPROCESSING
+from PIL import Image
+
+# JPEGs are decoded at no less than this multiple of the model's input size, so
+# the final resize still averages over several source pixels
+DRAFT_OVERSAMPLING = 2
+
+processor = None
+
+
+class FastParams(NamedTuple):
+    """The settings of the image processor that the fast path needs. They are
+    plain data, so the decoder processes get them from the pipeline without
+    importing transformers."""
+
+    size: int  # shortest edge that images are resized to
+    crop: Tuple[int, int]  # (height, width) of the center crop
+    resample: int
+    scale: np.ndarray  # rescale factor / std of each channel
+    offset: np.ndarray  # -mean / std of each channel
+
+
+fast_params: Optional[FastParams] = None
+
+
+class ImageTooLarge(ValueError):
+    """Raised for uploads over MAX_UPLOAD_BYTES or MAX_UPLOAD_PIXELS."""
+
+
+def get_processor():
+    """Returns the image processor for the model, loading it on first use."""
+    global processor
+    if processor is None:
+        from transformers import AutoImageProcessor
+
+        processor = AutoImageProcessor.from_pretrained(MODEL_NAME)
+    return processor
+
+
+def get_fast_params() -> FastParams:
+    """Returns the settings of the fast path, taking them from the image
+    processor on first use."""
+    global fast_params
+    if fast_params is None:
+        processor = get_processor()
+        size = processor.size
+        std = np.asarray(processor.image_std, dtype=np.float32)
+        fast_params = FastParams(
+            size=size.get("shortest_edge") or min(size["height"], size["width"]),
+            crop=(processor.crop_size["height"], processor.crop_size["width"]),
+            resample=processor.resample,
+            scale=np.float32(processor.rescale_factor) / std,
+            offset=-np.asarray(processor.image_mean, dtype=np.float32) / std,
+        )
+    return fast_params
+
+
+def set_fast_params(params: FastParams):
+    """Sets the settings of the fast path, e.g. in a decoder process."""
+    global fast_params
+    fast_params = params
+
+
+def input_size() -> int:
+    """Shortest edge that the processor resizes images to."""
+    return get_fast_params().size
+
+
+def draft(image: Image.Image) -> Image.Image:
+    """Makes a JPEG that has not been decoded yet decode at the smallest DCT
+    scale that keeps its shortest edge at DRAFT_OVERSAMPLING times the input
+    size. Decoding at 1/2, 1/4 or 1/8 scale is much cheaper than decoding the
+    full still and resizing it."""
+    if image.format == "JPEG":
+        scale = DRAFT_OVERSAMPLING * input_size() / min(image.size)
+        if scale < 1:
+            image.draft(
+                "RGB",
+                (math.ceil(image.width * scale), math.ceil(image.height * scale)),
+            )
+    return image
+
+
+def load_image(image_path: Path) -> Image.Image:
+    """Decodes the image at `image_path` into an RGB image."""
+    with Image.open(image_path) as image:
+        if PREPROCESSING == "fast":
+            draft(image)
+        return image.convert("RGB")
+
+
+def open_upload(data: bytes) -> Image.Image:
+    """Opens an uploaded image without decoding it. Only the header is read, so
+    oversized uploads are rejected before any pixels are decoded, and JPEGs are
+    set to decode downscaled.
+
+    Raises:
+        ImageTooLarge: the upload is over MAX_UPLOAD_BYTES or MAX_UPLOAD_PIXELS
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Upload of {len(data)} bytes")
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > MAX_UPLOAD_PIXELS:
+        raise ImageTooLarge(f"Upload of {image.width}x{image.height} pixels")
+    if PREPROCESSING == "fast":
+        draft(image)
+    return image
+
+
+def resize_and_crop(image: Image.Image, size: int, crop: tuple) -> np.ndarray:
+    """Resizes the shortest edge to `size` like the processor does and center
+    crops to `crop` (height, width). Returns an uint8 (H, W, 3) array."""
+    width, height = image.size
+    if width <= height:
+        new_size = (size, int(size * height / width))
+    else:
+        new_size = (int(size * width / height), size)
+    if new_size != image.size:
+        image = image.resize(new_size, resample=get_fast_params().resample)
+
+    crop_height, crop_width = crop
+    top = (new_size[1] - crop_height) // 2
+    left = (new_size[0] - crop_width) // 2
+    return np.asarray(image.crop((left, top, left + crop_width, top + crop_height)))
+
+
+def preprocess_images(images: List[Image.Image]) -> np.ndarray:
+    """Resizes, crops and normalizes the images for the image tower.
+
+    Args:
+        images (List[Image]): images to be preprocessed
+
+    Returns:
+        np.ndarray: float32 pixel values of shape (len(images), 3, H, W).
+    """
+    images = [image.convert("RGB") for image in images]
+    if PREPROCESSING != "fast":
+        inputs = get_processor()(images=images, return_tensors="np")
+        return inputs["pixel_values"].astype(np.float32, copy=False)
+
+    params = get_fast_params()
+    batch = np.stack(
+        [resize_and_crop(image, params.size, params.crop) for image in images]
+    )
+
+    # (x * rescale - mean) / std as one multiply-add over the whole batch
+    pixel_values = batch.astype(np.float32) * params.scale + params.offset
+    return np.ascontiguousarray(pixel_values.transpose(0, 3, 1, 2))
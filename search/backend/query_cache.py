@@ -0,0 +1,84 @@
+"""
+In-memory cache of query text embeddings. Search traffic repeats the same
+phrases a lot, and a cache hit skips tokenization and the text tower entirely.
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+from config import BATCH_SIZE, QUERY_CACHE_SIZE
+
+
+class EmbeddingCache:
+    """Bounded, thread-safe map of normalized query text to its embedding. The
+    least recently used entry is evicted once the cache is full.
+
+    Args:
+        maxsize (int): maximum number of cached embeddings, 0 disables the cache
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Canonical form of a query. CLIP's tokenizer lowercases and collapses
+        whitespace itself, so this does not change the embedding."""
+        return " ".join(text.lower().split())
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.normalize(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        key = self.normalize(text)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def warm_up(self, path: Path, compute: Callable[[List[str]], np.ndarray]) -> int:
+        """Embeds the queries in a file, one per line, and caches them. Only the
+            first `maxsize` distinct queries are used.
+
+        Returns:
+            int: the number of queries that were cached
+        """
+        with open(path) as f:
+            texts = list(dict.fromkeys(self.normalize(line) for line in f))
+        texts = [text for text in texts if text][: self.maxsize]
+        for start in range(0, len(texts), BATCH_SIZE):
+            batch = texts[start : start + BATCH_SIZE]
+            for text, embedding in zip(batch, compute(batch)):
+                self.put(text, embedding)
+        return len(texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
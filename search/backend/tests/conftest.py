@@ -0,0 +1,31 @@
+"""
+Fixtures shared by the backend tests. The tests run with a tiny randomly
+initialized CLIP model and tokenizer, so nothing is downloaded and no Qdrant
+server is needed.
+
+Usage (from backend/):
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+@pytest.fixture(scope="session")
+def tiny_clip(tmp_path_factory):
+    """Installs the tiny CLIP model of the offline benchmark as the float32 torch
+    encoder, along with the default CLIP image processor."""
+    import preprocessing
+    from benchmarks.offline import tiny_clip
+    from encoders import TorchEncoder
+    from transformers import CLIPImageProcessor
+    from utils import set_encoder
+
+    model, tokenizer = tiny_clip(tmp_path_factory.mktemp("tiny_clip"))
+    set_encoder(TorchEncoder(model), tokenizer)
+    preprocessing.processor = CLIPImageProcessor()
+    return model, tokenizer
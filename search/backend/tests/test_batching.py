@@ -0,0 +1,29 @@
+import numpy as np
+from PIL import Image
+from utils import get_image_embeddings, get_text_embeddings
+
+CAPTIONS = [
+    "a man",
+    "a woman holding a red phone in a dark room near the window",
+    "two people running on the beach at night with a dog",
+    "city",
+]
+
+
+def test_batched_text_embeddings_match_single(tiny_clip):
+    # Captions of different lengths are padded to the longest one in the batch
+    batched = get_text_embeddings(CAPTIONS, batch_size=len(CAPTIONS))
+    single = np.concatenate([get_text_embeddings([text]) for text in CAPTIONS])
+    np.testing.assert_allclose(batched, single, atol=1e-5)
+    np.testing.assert_allclose(np.linalg.norm(batched, axis=1), 1, atol=1e-5)
+
+
+def test_batched_image_embeddings_match_single(tiny_clip):
+    rng = np.random.default_rng(0)
+    images = [
+        Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        for width, height in [(320, 200), (200, 320), (224, 224), (640, 360)]
+    ]
+    batched = get_image_embeddings(images, batch_size=3)
+    single = np.concatenate([get_image_embeddings([image]) for image in images])
+    np.testing.assert_allclose(batched, single, atol=1e-5)
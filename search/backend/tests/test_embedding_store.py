@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+from embedding_store import EmbeddingStore
+from image_ingestion import Frame
+from ingestion_manifest import embedding_id
+
+
+def make_frames(content_hash: str):
+    return [
+        Frame("tt1", f"{i}.jpg", Path(f"tt1/{i}.jpg"), f"frame {i}", content_hash)
+        for i in range(4)
+    ]
+
+
+def random_embeddings(rng, n):
+    return rng.standard_normal((n, 512)).astype(np.float32)
+
+
+def test_embedding_ids_differ_by_backend_and_precision():
+    assert embedding_id("clip", "torch", "float32") == "clip"
+    ids = {
+        embedding_id("clip", backend, precision)
+        for backend in ["torch", "onnx"]
+        for precision in ["float32", "int8"]
+    }
+    assert len(ids) == 4
+
+
+def test_reembedded_frames_overwrite_their_rows(tmp_path):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore(tmp_path, model_id="tiny-clip", dtype="float32")
+    frames = make_frames("old")
+    store.add(frames, random_embeddings(rng, 4), random_embeddings(rng, 4))
+    size = store._matrix_path("scenes").stat().st_size
+
+    changed = make_frames("new")[:2]
+    scenes, captions = random_embeddings(rng, 2), random_embeddings(rng, 2)
+    store.add(changed, scenes, captions)
+
+    assert len(store) == 4
+    assert store._matrix_path("scenes").stat().st_size == size
+    rows = store.lookup(changed)
+    assert rows == [0, 1]
+    np.testing.assert_array_equal(store.get("scenes", rows), scenes)
+    np.testing.assert_array_equal(store.get("captions", rows), captions)
+    assert store.lookup(frames) == [-1, -1, 2, 3]
+
+    # A new store on the same directory sees the overwritten rows
+    reopened = EmbeddingStore(tmp_path, model_id="tiny-clip", dtype="float32")
+    assert len(reopened) == 4
+    np.testing.assert_array_equal(reopened.get("scenes", rows), scenes)
+
+
+def test_removed_frames_free_their_rows(tmp_path):
+    rng = np.random.default_rng(1)
+    store = EmbeddingStore(tmp_path, model_id="tiny-clip", dtype="float32")
+    frames = make_frames("hash")
+    store.add(frames, random_embeddings(rng, 4), random_embeddings(rng, 4))
+    store.remove("tt1", ["1.jpg", "2.jpg"])
+
+    assert len(store) == 2
+    assert store.lookup(frames) == [0, -1, -1, 3]
+
+    new = [frame._replace(image_id=f"new{i}.jpg") for i, frame in enumerate(frames)]
+    scenes = random_embeddings(rng, 3)
+    store.add(new[:3], scenes, random_embeddings(rng, 3))
+    # Two frames take the freed rows, the third one is appended
+    rows = store.lookup(new[:3])
+    assert sorted(rows) == [1, 2, 4]
+    np.testing.assert_array_equal(store.get("scenes", rows), scenes)
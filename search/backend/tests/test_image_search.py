@@ -0,0 +1,52 @@
+import image_search
+import pytest
+from image_search import build_query_filter, plan_search
+from movie_table import MovieTable
+
+MOVIE_INFO = {
+    "tt0000001": {
+        "Title": "Movie",
+        "Director": ["Director"],
+        "Actors": ["Actor"],
+        "Genre": ["Drama"],
+        "Year": "2000",
+        "NumImages": 100,
+    }
+}
+
+
+@pytest.fixture
+def full_payloads(monkeypatch):
+    monkeypatch.setattr(image_search, "PAYLOAD_MODE", "full")
+
+
+@pytest.mark.parametrize("movie_table", [None, MovieTable({})])
+def test_full_payloads_keep_the_payload_filter_without_the_table(
+    full_payloads, movie_table
+):
+    # No entry in results.json, Qdrant's payload filter still finds the frames
+    query_filter, params = plan_search(movie_table, genre="Drama")
+    assert query_filter == build_query_filter(genre="Drama")
+    assert params is None or not params.exact
+
+
+def test_full_payloads_search_selective_filters_exactly(full_payloads):
+    query_filter, params = plan_search(MovieTable(MOVIE_INFO), genre="Drama")
+    assert query_filter == build_query_filter(genre="Drama")
+    assert params.exact
+
+
+def test_compact_payloads_filter_on_the_movies_of_the_table(monkeypatch):
+    monkeypatch.setattr(image_search, "PAYLOAD_MODE", "compact")
+    table = MovieTable(MOVIE_INFO)
+    query_filter, params = plan_search(table, genre="Drama")
+    assert query_filter.must[0].key == "movie_id"
+    assert query_filter.must[0].match.any == ["tt0000001"]
+    assert plan_search(table, genre="Western") is None
+
+
+def test_compact_payloads_refuse_filters_without_the_table(monkeypatch):
+    monkeypatch.setattr(image_search, "PAYLOAD_MODE", "compact")
+    with pytest.raises(ValueError):
+        plan_search(None, genre="Drama")
+    assert plan_search(None) == (None, None)
@@ -0,0 +1,48 @@
+import hashlib
+import sqlite3
+
+from ingestion_manifest import IngestionManifest, list_dataset_manifest, plan_movie
+from utils import content_hash
+
+
+def write_dataset_manifest(path, image_data_path, captions):
+    """The images table of dataset/manifest.py, with the columns ingestion reads."""
+    db = sqlite3.connect(path)
+    db.execute(
+        """CREATE TABLE images (split TEXT, movie_id TEXT, name TEXT,
+        content_hash TEXT, caption TEXT)"""
+    )
+    for name, caption in captions.items():
+        data = (image_data_path / "tt1" / name).read_bytes()
+        db.execute(
+            "INSERT INTO images VALUES ('train', 'tt1', ?, ?, ?)",
+            (name, hashlib.sha256(data).hexdigest(), caption),
+        )
+    db.commit()
+    db.close()
+
+
+def test_manifest_frames_are_planned_without_reading_the_images(tmp_path):
+    image_data_path = tmp_path / "train"
+    (image_data_path / "tt1").mkdir(parents=True)
+    captions = {f"{i}.jpg": f"frame {i}" for i in range(3)}
+    for i, name in enumerate(captions):
+        (image_data_path / "tt1" / name).write_bytes(bytes([i]) * 100)
+    write_dataset_manifest(tmp_path / "manifest.sqlite", image_data_path, captions)
+
+    signature, frames = list_dataset_manifest(
+        str(tmp_path / "manifest.sqlite"), image_data_path
+    )["tt1"]
+    # The same hashes as when the movie directory is walked
+    assert [frame.content_hash for frame in frames] == [
+        content_hash(frame.image_path, frame.caption) for frame in frames
+    ]
+
+    for frame in frames:
+        frame.image_path.unlink()
+    manifest = IngestionManifest(str(tmp_path / "ingest.sqlite"), "tiny-clip")
+    changed, removed = plan_movie(image_data_path / "tt1", manifest, frames)
+    assert changed == frames and removed == []
+
+    manifest.record_frames(changed)
+    assert plan_movie(image_data_path / "tt1", manifest, frames) == ([], [])
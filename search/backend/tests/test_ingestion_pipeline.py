@@ -0,0 +1,107 @@
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from embedding_store import EmbeddingStore
+from image_ingestion import Frame, create_collections, embed_frames
+from ingestion_pipeline import IngestionPipeline
+from PIL import Image
+from preprocessing import get_fast_params
+from qdrant_client import QdrantClient
+from utils import content_hash, generate_id
+
+BACKEND_PATH = Path(__file__).parent.parent
+MOVIE_INFO = {
+    f"tt{m:07d}": {
+        "Title": f"Movie {m}",
+        "Director": ["Director"],
+        "Actors": ["Actor"],
+        "Genre": ["Drama"],
+        "Year": "2000",
+    }
+    for m in range(3)
+}
+
+
+@pytest.fixture
+def frames(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = []
+    for m in range(3):
+        movie_id = f"tt{m:07d}"
+        (tmp_path / movie_id).mkdir()
+        for i in range(1, 6):
+            image_path = tmp_path / movie_id / f"{i}.jpg"
+            pixels = rng.integers(0, 256, (180, 320, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(image_path)
+            caption = f"frame {i} of movie {m}"
+            frames.append(
+                Frame(
+                    movie_id,
+                    image_path.name,
+                    image_path,
+                    caption,
+                    content_hash(image_path, caption),
+                )
+            )
+    return frames
+
+
+def test_decoder_does_not_import_the_model_code(tiny_clip, frames, tmp_path):
+    params_path = tmp_path / "params.pickle"
+    params_path.write_bytes(pickle.dumps(get_fast_params()))
+    code = (
+        "import pickle, sys\n"
+        "import decoding, preprocessing\n"
+        f"preprocessing.set_fast_params(pickle.load(open({str(params_path)!r}, 'rb')))\n"
+        f"pixel_values, _ = decoding.decode_images([{str(frames[0].image_path)!r}])\n"
+        "assert pixel_values.shape == (1, 3, 224, 224)\n"
+        "print(sorted({'torch', 'transformers', 'utils'} & set(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_pipeline_embeds_new_frames_and_reads_stored_ones(tiny_clip, frames, tmp_path):
+    store = EmbeddingStore(tmp_path / "embeddings", model_id="tiny-clip")
+    # The frames of the first movie are already stored
+    embed_frames(frames[:5], store)
+
+    client = QdrantClient(":memory:")
+    create_collections(client, payload_indexes=False)
+    uploaded = []
+    pipeline = IngestionPipeline(
+        client,
+        MOVIE_INFO,
+        batch_size=4,
+        num_decoders=2,
+        on_uploaded=uploaded.extend,
+        store=store,
+    )
+    pipeline.run(iter(frames))
+    report = pipeline.stats
+
+    assert sorted(uploaded) == sorted(frames)
+    assert report["decode"].frames == 10
+    assert report["encode"].frames == 15
+    assert len(store) == 15
+
+    rows = store.lookup(frames)
+    points = client.retrieve(
+        "scenes",
+        [generate_id(frame.image_id, frame.movie_id) for frame in frames],
+        with_vectors=True,
+    )
+    vectors = {point.id: point.vector for point in points}
+    for frame, row in zip(frames, rows):
+        vector = vectors[generate_id(frame.image_id, frame.movie_id)]
+        np.testing.assert_allclose(vector, store.get("scenes", [row])[0], atol=1e-3)
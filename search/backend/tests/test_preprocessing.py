@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+import preprocessing
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+from preprocessing import draft, preprocess_images
+
+
+def synthetic_still(seed: int, size=(1920, 1080)) -> bytes:
+    """A 1080p JPEG of blurred shapes on a gradient, smooth like a film still."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    gradient = np.stack([x / width, y / height, (x + y) / (width + height)], -1)
+    image = Image.fromarray((gradient * 255).astype(np.uint8))
+    canvas = ImageDraw.Draw(image)
+    for _ in range(30):
+        left, top = rng.integers(0, width), rng.integers(0, height)
+        right, bottom = left + rng.integers(20, 400), top + rng.integers(20, 400)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        canvas.ellipse([left, top, right, bottom], fill=color)
+    data = io.BytesIO()
+    image.filter(ImageFilter.GaussianBlur(2)).save(data, "JPEG", quality=90)
+    return data.getvalue()
+
+
+@pytest.fixture(scope="module")
+def stills():
+    return [synthetic_still(seed) for seed in range(8)]
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    from transformers import CLIPImageProcessor
+
+    monkeypatch.setattr(preprocessing, "processor", CLIPImageProcessor())
+    monkeypatch.setattr(preprocessing, "fast_params", None)
+    return preprocessing.processor
+
+
+def test_fast_path_matches_the_processor(stills, processor):
+    images = [Image.open(io.BytesIO(data)).convert("RGB") for data in stills]
+    expected = processor(images=images, return_tensors="np")["pixel_values"]
+    np.testing.assert_allclose(preprocess_images(images), expected, rtol=0, atol=1e-6)
+
+
+def test_draft_decoding_stays_close_to_the_processor(stills, processor):
+    images = [Image.open(io.BytesIO(data)).convert("RGB") for data in stills]
+    expected = processor(images=images, return_tensors="np")["pixel_values"]
+
+    drafts = [draft(Image.open(io.BytesIO(data))) for data in stills]
+    # 1080p decodes at half scale, still twice the input size of 224
+    assert drafts[0].size == (960, 540)
+    difference = np.abs(preprocess_images(drafts) - expected)
+    # In normalized pixel units, where the channels span about 4
+    assert difference.max() < 0.1
+    assert difference.mean() < 0.005
@@ -0,0 +1,170 @@
+import asyncio
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pytest
+import vector_index
+from embedding_store import EmbeddingStore, load_into_qdrant
+from image_ingestion import Frame, build_payload
+from ingestion_manifest import IngestionManifest, delete_frames
+from movie_table import MovieTable
+from qdrant_client import QdrantClient, models
+from utils import generate_id
+from vector_index import NumpyIndex
+
+GENRES = [["Drama"], ["Comedy"], ["Drama", "Crime"]]
+# tt0000003 is stored but has no metadata, so it is not searchable
+MOVIE_INFO = {
+    f"tt{m:07d}": {
+        "Title": f"Movie {m}",
+        "Director": ["Director"],
+        "Actors": [f"Actor {m}"],
+        "Genre": GENRES[m],
+        "Year": str(2000 + m),
+    }
+    for m in range(3)
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore(tmp_path, model_id="tiny-clip", dtype="float32")
+    for m in [0, 3, 1, 2]:
+        frames = [
+            Frame(f"tt{m:07d}", f"{i}.jpg", Path(f"{i}.jpg"), f"frame {i}", "hash")
+            for i in range(10)
+        ]
+        embeddings = rng.standard_normal((2, len(frames), 512)).astype(np.float32)
+        store.add(frames, *embeddings)
+    return NumpyIndex(store, MOVIE_INFO)
+
+
+def brute_force(index, query, limit, movie_ids=None):
+    """Point ids of the `limit` closest frames by a full argsort."""
+    frames = [frame for frame in index.store.frames() if frame.movie_id in MOVIE_INFO]
+    if movie_ids is not None:
+        frames = [frame for frame in frames if frame.movie_id in movie_ids]
+    matrix = index.store.get("scenes", [frame.row for frame in frames])
+    scores = matrix @ (query / np.linalg.norm(query))
+    return [frames[i].point_id for i in np.argsort(-scores)[:limit]]
+
+
+def genre_filter(genre):
+    return models.Filter(
+        must=[
+            models.FieldCondition(key="genre[]", match=models.MatchValue(value=genre))
+        ]
+    )
+
+
+def test_search_matches_brute_force(index):
+    rng = np.random.default_rng(1)
+    assert len(index) == 30
+    for limit in [1, 5, 30, 100]:
+        query = rng.standard_normal(512)
+        results = asyncio.run(index.search("scenes", query, limit=limit))
+        assert [point.id for point in results] == brute_force(index, query, limit)
+        scores = [point.score for point in results]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_search_batch_applies_filters_and_limits(index):
+    rng = np.random.default_rng(2)
+    queries = rng.standard_normal((3, 512))
+    requests = [
+        models.SearchRequest(vector=queries[0].tolist(), limit=7, with_payload=True),
+        models.SearchRequest(
+            vector=queries[1].tolist(),
+            filter=genre_filter("Drama"),
+            limit=15,
+            with_payload=["movie_id"],
+        ),
+        models.SearchRequest(
+            vector=queries[2].tolist(), filter=genre_filter("Western"), limit=5
+        ),
+    ]
+    unfiltered, drama, western = asyncio.run(index.search_batch("scenes", requests))
+
+    assert [point.id for point in unfiltered] == brute_force(index, queries[0], 7)
+    assert [point.id for point in drama] == brute_force(
+        index, queries[1], 15, {"tt0000000", "tt0000002"}
+    )
+    assert {point.payload["movie_id"] for point in drama} <= {"tt0000000", "tt0000002"}
+    assert all(list(point.payload) == ["movie_id"] for point in drama)
+    assert western == []
+
+
+def test_reload_picks_up_new_frames(index):
+    frame = Frame("tt0000001", "new.jpg", Path("new.jpg"), "new frame", "hash")
+    query = np.random.default_rng(3).standard_normal(512).astype(np.float32)
+    index.store.add([frame], query[None], query[None])
+    assert len(index) == 30
+    index.reload()
+    assert len(index) == 31
+    best = asyncio.run(index.search("scenes", query, limit=1))[0]
+    assert best.id == generate_id("new.jpg", "tt0000001")
+
+
+def test_joining_results_leaves_the_index_payloads_alone(index, monkeypatch):
+    monkeypatch.setattr(
+        vector_index, "build_payload", partial(build_payload, payload_mode="compact")
+    )
+    index.reload()
+    query = np.random.default_rng(4).standard_normal(512)
+    points = asyncio.run(index.search("scenes", query, limit=5))
+    results, movies = MovieTable(MOVIE_INFO).join(
+        [
+            {"id": point.id, "score": point.score, "payload": point.payload}
+            for point in points
+        ]
+    )
+    assert all(result["payload"]["title"] for result in results)
+    assert all(
+        set(payload) == {"movie_id", "image_id", "caption"}
+        for payload in index.snapshot.payloads
+    )
+
+
+def test_joined_compact_results_only_carry_the_requested_fields(index, monkeypatch):
+    monkeypatch.setattr(
+        vector_index, "build_payload", partial(build_payload, payload_mode="compact")
+    )
+    index.reload()
+    query = np.random.default_rng(5).standard_normal(512)
+    points = asyncio.run(
+        index.search("scenes", query, limit=5, with_payload=["movie_id", "image_id"])
+    )
+    results, movies = MovieTable(MOVIE_INFO).join(
+        [{"id": point.id, "payload": point.payload} for point in points],
+        fields=["title", "image_path"],
+    )
+    assert len(results) == 5
+    assert all(set(result["payload"]) == {"title", "image_path"} for result in results)
+    assert set(movies) <= set(MOVIE_INFO)
+
+
+def test_deleted_frames_disappear_after_reload(index, tmp_path):
+    client = QdrantClient(":memory:")
+    load_into_qdrant(index.store, client, MOVIE_INFO)
+    manifest = IngestionManifest(str(tmp_path / "ingest.sqlite"), "tiny-clip")
+    deleted = generate_id("3.jpg", "tt0000001")
+    # The deleted frame's own embedding, which would otherwise be the best match
+    (row,) = [frame.row for frame in index.store.frames() if frame.point_id == deleted]
+    query = index.store.get("scenes", [row])[0]
+    delete_frames(client, manifest, "tt0000001", ["3.jpg"], store=index.store)
+
+    index.reload()
+    assert len(index) == 29
+    assert deleted not in index.snapshot.ids
+    results = asyncio.run(index.search("scenes", query, limit=30))
+    assert deleted not in [point.id for point in results]
+    assert len(client.retrieve("scenes", [deleted])) == 0
+
+
+def test_load_returns_only_the_frames_with_metadata(index):
+    client = QdrantClient(":memory:")
+    loaded = load_into_qdrant(index.store, client, MOVIE_INFO)
+    assert len(loaded) == client.count("scenes").count == 30
+    assert {frame.movie_id for frame in loaded} == set(MOVIE_INFO)
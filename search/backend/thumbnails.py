@@ -0,0 +1,155 @@
+"""
+Thumbnails of the movie frames, so result cards don't download full-size stills.
+Every frame gets one thumbnail per size in THUMBNAIL_SIZES:
+
+|- <THUMBNAIL_PATH>/
+|   |- <size>/
+|   |   |- <movie id>/
+|   |   |   |- <frame>.webp
+
+Usage:
+    python thumbnails.py    # generate the missing thumbnails of IMAGE_DATA_PATH
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+from config import (
+    IMAGE_CACHE_MAX_AGE,
+    IMAGE_DATA_PATH,
+    NUM_DECODE_WORKERS,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_PATH,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_SIZE,
+    THUMBNAIL_SIZES,
+)
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+
+def thumbnail_name(image_id: str) -> str:
+    return f"{Path(image_id).stem}.{EXTENSIONS[THUMBNAIL_FORMAT]}"
+
+
+def thumbnail_url(movie_id: str, image_id: str, size: int = THUMBNAIL_SIZE) -> str:
+    """URL path of a frame's thumbnail, or of the original frame when
+    thumbnails are turned off."""
+    if size not in THUMBNAIL_SIZES:
+        return f"/images/{movie_id}/{image_id}"
+    return f"/thumbnails/{size}/{movie_id}/{thumbnail_name(image_id)}"
+
+
+def make_thumbnails(
+    image_path: Path, thumbnail_path: Path = Path(THUMBNAIL_PATH)
+) -> int:
+    """Writes the thumbnails of one frame that are missing or older than it.
+
+    Returns:
+        int: the number of thumbnails written
+    """
+    movie_id, image_id = image_path.parent.name, image_path.name
+    source_mtime = image_path.stat().st_mtime
+    outputs = {}
+    for size in THUMBNAIL_SIZES:
+        output = thumbnail_path / str(size) / movie_id / thumbnail_name(image_id)
+        if not output.exists() or output.stat().st_mtime < source_mtime:
+            outputs[size] = output
+    if not outputs:
+        return 0
+
+    with Image.open(image_path) as image:
+        # Decode at the smallest DCT scale that still covers the largest size
+        largest = max(outputs)
+        image.draft("RGB", (largest, largest))
+        image = image.convert("RGB")
+    for size, output in sorted(outputs.items(), reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so a half written thumbnail is never served
+        partial = output.with_name(output.name + ".part")
+        image.save(partial, THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY)
+        partial.replace(output)
+    return len(outputs)
+
+
+def generate_thumbnails(
+    image_data_path: Path,
+    thumbnail_path: Path = Path(THUMBNAIL_PATH),
+    num_workers: int = NUM_DECODE_WORKERS,
+) -> int:
+    """Generates the missing thumbnails of every frame in parallel.
+
+    Args:
+        image_data_path (Path): directory holding one directory per movie
+        thumbnail_path (Path): root directory of the thumbnails
+        num_workers (int): processes decoding and resizing the frames
+
+    Returns:
+        int: the number of thumbnails written
+    """
+    if not THUMBNAIL_SIZES:
+        return 0
+    image_paths: List[Path] = sorted(image_data_path.glob("*/*.jpg"))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(num_workers, mp_context=context) as pool:
+        return sum(
+            pool.map(
+                make_thumbnails,
+                image_paths,
+                [thumbnail_path] * len(image_paths),
+                chunksize=64,
+            )
+        )
+
+
+class CachedStaticFiles(StaticFiles):
+    """Static files that browsers may cache for IMAGE_CACHE_MAX_AGE seconds.
+    Starlette already sends the ETag and Last-Modified headers and answers
+    conditional requests with 304."""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in [200, 304]:
+            response.headers["Cache-Control"] = f"public, max-age={IMAGE_CACHE_MAX_AGE}"
+        return response
+
+
+class ThumbnailFiles(CachedStaticFiles):
+    """Serves `<size>/<movie id>/<frame>` thumbnails, generating the ones that
+    are missing, e.g. for frames that were added after the last ingest.
+
+    Args:
+        image_data_path (Path): directory holding one directory per movie
+    """
+
+    def __init__(self, image_data_path: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.image_data_path = Path(image_data_path)
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            parts = Path(path).parts
+            if e.status_code != 404 or len(parts) != 3:
+                raise
+            size, movie_id, name = parts
+            image_path = self.image_data_path / movie_id / f"{Path(name).stem}.jpg"
+            if not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+                raise
+            if not image_path.is_file():
+                raise
+            await run_in_threadpool(make_thumbnails, image_path, Path(self.directory))
+            return await super().get_response(path, scope)
+
+
+if __name__ == "__main__":
+    count = generate_thumbnails(Path(IMAGE_DATA_PATH))
+    print(f"Generated {count} thumbnails")
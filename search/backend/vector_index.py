@@ -0,0 +1,241 @@
+"""
+In-process exact search over the embedding store. For a catalog of a few hundred
+thousand 512-d vectors a single matrix product is cheaper than a round-trip to
+Qdrant, and it needs no server at all, which also makes it handy for tests.
+"""
+
+import asyncio
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from embedding_store import COLLECTIONS, EmbeddingStore
+from image_ingestion import build_payload
+from qdrant_client import models
+
+# Payload fields that the search filters can match on
+FILTER_FIELDS = ["movie_id", "title", "director", "actor", "genre", "year"]
+
+# Rows scored per matrix product, to bound the float32 copy of float16 rows
+CHUNK_SIZE = 16384
+
+
+class Snapshot(NamedTuple):
+    """The searchable state of the index, replaced as a whole on reload."""
+
+    ids: List[str]
+    payloads: List[dict]
+    matrices: Dict[str, np.ndarray]
+    postings: Dict[str, Dict[object, np.ndarray]]  # positions of every value
+
+
+class NumpyIndex:
+    """Exact top-k search over the normalized embeddings of the store. It
+    implements the part of `AsyncQdrantClient` that image_search uses, so the
+    search functions work unchanged on top of it.
+
+    Args:
+        store (EmbeddingStore): embeddings of the frames
+        movie_info (dict): Metadata on the movies. Frames of movies missing from
+            it are not searchable.
+    """
+
+    def __init__(self, store: EmbeddingStore, movie_info: dict):
+        self.store = store
+        self.movie_info = movie_info
+        self.reload()
+
+    def reload(self):
+        """Picks up the frames that were added to the store since the index was
+        built. The new state is built aside and published with one assignment,
+        so searches running meanwhile see either the old or the new index."""
+        frames = [
+            frame for frame in self.store.frames() if frame.movie_id in self.movie_info
+        ]
+        ids = [frame.point_id for frame in frames]
+        payloads = [
+            build_payload(
+                frame.movie_id, frame.image_id, frame.caption, self.movie_info
+            )
+            for frame in frames
+        ]
+
+        # Use the memory maps directly unless replaced or filtered-out rows
+        # leave gaps in them
+        rows = np.array([frame.row for frame in frames], dtype=np.int64)
+        matrices = {}
+        for name in COLLECTIONS:
+            matrix = self.store.matrix(name)
+            contiguous = len(rows) == len(matrix) and np.array_equal(
+                rows, np.arange(len(rows))
+            )
+            matrices[name] = matrix if contiguous else np.asarray(matrix[rows])
+
+        # Posting lists of every filterable value
+        postings = {field: {} for field in FILTER_FIELDS}
+        for i, payload in enumerate(payloads):
+            for field in FILTER_FIELDS:
+                values = payload.get(field)
+                for value in values if isinstance(values, list) else [values]:
+                    postings[field].setdefault(value, []).append(i)
+        postings = {
+            field: {value: np.array(rows) for value, rows in values.items()}
+            for field, values in postings.items()
+        }
+        self.snapshot = Snapshot(ids, payloads, matrices, postings)
+
+    def __len__(self) -> int:
+        return len(self.snapshot.ids)
+
+    def _match(
+        self, condition: models.FieldCondition, snapshot: Snapshot
+    ) -> np.ndarray:
+        """Returns the mask of the points satisfying one filter condition."""
+        field = condition.key.removesuffix("[]")
+        if field not in snapshot.postings:
+            raise ValueError(f"Cannot filter on {condition.key}")
+        if isinstance(condition.match, models.MatchValue):
+            values = [condition.match.value]
+        elif isinstance(condition.match, models.MatchAny):
+            values = condition.match.any
+        else:
+            raise ValueError(f"Unsupported match {condition.match}")
+
+        mask = np.zeros(len(snapshot.ids), dtype=bool)
+        for value in values:
+            postings = snapshot.postings[field].get(value)
+            if postings is not None:
+                mask[postings] = True
+        return mask
+
+    def mask(
+        self, query_filter: Optional[models.Filter], snapshot: Optional[Snapshot] = None
+    ) -> Optional[np.ndarray]:
+        """Turns a filter whose `must` clauses are field matches into a mask of
+        the points that satisfy it."""
+        snapshot = snapshot or self.snapshot
+        if query_filter is None or not query_filter.must:
+            return None
+        if query_filter.should or query_filter.must_not:
+            raise ValueError("Only `must` filters are supported")
+        mask = np.ones(len(snapshot.ids), dtype=bool)
+        for condition in query_filter.must:
+            mask &= self._match(condition, snapshot)
+        return mask
+
+    def scores(
+        self,
+        collection_name: str,
+        query_vector,
+        rows: Optional[np.ndarray] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> np.ndarray:
+        """Cosine similarity of the query to every point, or to the points at
+        `rows` only."""
+        matrix = (snapshot or self.snapshot).matrices[collection_name]
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        if rows is not None:
+            return matrix[rows].astype(np.float32, copy=False) @ query
+        return np.concatenate(
+            [
+                matrix[start : start + CHUNK_SIZE].astype(np.float32, copy=False)
+                @ query
+                for start in range(0, len(matrix), CHUNK_SIZE)
+            ]
+            or [np.zeros(0, dtype=np.float32)]
+        )
+
+    def top_k(
+        self,
+        collection_name: str,
+        query_vector,
+        limit: int,
+        query_filter: Optional[models.Filter] = None,
+        snapshot: Optional[Snapshot] = None,
+    ) -> List[tuple]:
+        """Returns the (position, score) of the `limit` closest points. The
+        positions are those of `snapshot`, the current one by default."""
+        snapshot = snapshot or self.snapshot
+        mask = self.mask(query_filter, snapshot)
+        if mask is None:
+            candidates = None
+            scores = self.scores(collection_name, query_vector, snapshot=snapshot)
+        else:
+            # Only score the points that pass the filter
+            candidates = np.flatnonzero(mask)
+            scores = self.scores(collection_name, query_vector, candidates, snapshot)
+
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        positions = best if candidates is None else candidates[best]
+        return list(zip(positions.tolist(), scores[best].tolist()))
+
+    def _scored_point(
+        self, snapshot: Snapshot, position: int, score: float, with_payload=True
+    ) -> models.ScoredPoint:
+        # A copy, so that callers can't change the payloads of the index
+        payload = snapshot.payloads[position]
+        if isinstance(with_payload, list):
+            payload = {key: payload[key] for key in with_payload if key in payload}
+        else:
+            payload = dict(payload)
+        return models.ScoredPoint(
+            id=snapshot.ids[position],
+            version=0,
+            score=score,
+            payload=payload,
+        )
+
+    async def search(
+        self,
+        collection_name: str,
+        query_vector,
+        query_filter: Optional[models.Filter] = None,
+        limit: int = 10,
+        with_payload=True,
+        **kwargs,
+    ) -> List[models.ScoredPoint]:
+        """Same as `AsyncQdrantClient.search`, always exact. The matrix product
+        runs on a worker thread to keep the event loop free. `with_payload` is
+        True or a list of the fields to return."""
+        # Positions and payloads come from the same snapshot, even if the index
+        # is reloaded meanwhile
+        snapshot = self.snapshot
+        best = await asyncio.to_thread(
+            self.top_k, collection_name, query_vector, limit, query_filter, snapshot
+        )
+        return [
+            self._scored_point(snapshot, position, score, with_payload)
+            for position, score in best
+        ]
+
+    async def search_batch(
+        self, collection_name: str, requests: List[models.SearchRequest], **kwargs
+    ) -> List[List[models.ScoredPoint]]:
+        """Same as `AsyncQdrantClient.search_batch`, always exact."""
+
+        snapshot = self.snapshot
+
+        def search_all():
+            return [
+                self.top_k(
+                    collection_name,
+                    request.vector,
+                    request.limit,
+                    request.filter,
+                    snapshot,
+                )
+                for request in requests
+            ]
+
+        batch = await asyncio.to_thread(search_all)
+        return [
+            [
+                self._scored_point(snapshot, position, score, request.with_payload)
+                for position, score in best
+            ]
+            for request, best in zip(requests, batch)
+        ]